@@ -1,5 +1,7 @@
 from PIL import Image
 import os
+from service.encoder_profiles import save_image
+from service.uploads import open_image
 
 class LogoProcessor:
     def __init__(self):
@@ -20,8 +22,8 @@ class LogoProcessor:
         Thêm logo vào ảnh gốc
         
         Args:
-            image_path: Đường dẫn đến ảnh gốc
-            logo_path: Đường dẫn đến file logo
+            image_path: Đường dẫn đến ảnh gốc (hoặc UploadedFile)
+            logo_path: Đường dẫn đến file logo (hoặc UploadedFile)
             position: Vị trí đặt logo (top_left, top_right, bottom_left, bottom_right, center, top_center, bottom_center, left_center, right_center)
             scale: Tỷ lệ kích thước logo so với ảnh gốc (0.1 = 10%)
             
@@ -30,7 +32,7 @@ class LogoProcessor:
         """
         try:
             # Mở ảnh gốc và logo
-            with Image.open(image_path) as img:
+            with open_image(image_path) as img:
                 # Chuyển ảnh gốc sang RGB nếu cần
                 if img.mode in ('RGBA', 'LA'):
                     background = Image.new('RGB', img.size, (255, 255, 255))
@@ -40,7 +42,7 @@ class LogoProcessor:
                     img = img.convert('RGB')
                     
                 # Mở logo
-                with Image.open(logo_path) as logo:
+                with open_image(logo_path) as logo:
                     # Chuyển logo sang RGBA nếu cần
                     if logo.mode != 'RGBA':
                         logo = logo.convert('RGBA')
@@ -81,12 +83,43 @@ class LogoProcessor:
                     return result
                     
         except Exception as e:
-            print(f"Lỗi khi xử lý ảnh {image_path}: {str(e)}")
-            raise Exception(f"Lỗi khi xử lý ảnh {image_path}: {str(e)}")
+            name = getattr(image_path, 'name', image_path)
+            print(f"Lỗi khi xử lý ảnh {name}: {str(e)}")
+            raise Exception(f"Lỗi khi xử lý ảnh {name}: {str(e)}")
+
+    def process_images(self, images, logo, output_dir, position, scale=0.1, profile=None, target_bytes=None):
+        """
+        Thêm logo vào danh sách ảnh đã đọc sẵn (không cần lưu ảnh upload ra thư mục)
+
+        Args:
+            images: Danh sách UploadedFile
+            logo: UploadedFile hoặc đường dẫn logo
+            output_dir: Thư mục lưu ảnh kết quả
+
+        Returns:
+            Danh sách đường dẫn ảnh đã xử lý
+        """
+        output_paths = []
+        for image in images:
+            if not image.name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                continue
+            try:
+                processed_img = self.add_logo(image, logo, position, scale)
+                output_path = os.path.join(output_dir, f'processed_{image.name}')
+                save_image(processed_img, output_path, 'JPEG', profile, target_bytes)
+                output_paths.append(output_path)
+            except Exception as e:
+                print(f"Lỗi khi xử lý file {image.name}: {str(e)}")
+                continue
+        return output_paths
     
-    def process_folder(self, folder_path, logo_path, position, scale=0.1):
+    def process_folder(self, folder_path, logo_path, position, scale=0.1, profile=None, target_bytes=None):
         """
         Xử lý tất cả ảnh trong thư mục
+        
+        Args:
+            profile: Profile encode ảnh kết quả (fast, balanced, small, quality)
+            target_bytes: Dung lượng mục tiêu cho ảnh kết quả
         """
         try:
             # Xử lý từng ảnh
@@ -101,7 +134,7 @@ class LogoProcessor:
                         # Lưu ảnh đã xử lý
                         if processed_img:
                             output_path = os.path.join(folder_path, f'processed_{filename}')
-                            processed_img.save(output_path, 'JPEG', quality=95)
+                            save_image(processed_img, output_path, 'JPEG', profile, target_bytes)
                             return output_path
                     except Exception as e:
                         print(f"Lỗi khi xử lý file {filename}: {str(e)}")
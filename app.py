@@ -1,33 +1,41 @@
 import time
-from flask import Flask, render_template, request, jsonify, send_file, url_for
+from flask import Flask, render_template, request, jsonify, send_file, url_for, Response
 import os
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageEnhance
-import shutil
-from changeImage import convert_images
+from changeImage import convert_batch
 from cutmergeimage import ImageProcessor
 from mergeWord import merge_word_documents
 from renameImage import rename_files
 import requests
 from bs4 import BeautifulSoup
-import io
-import zipfile
 import re
 from flask_cors import CORS
 from ocr_processor import process_folder
 from add_logo import LogoProcessor
 from docx import Document
-from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 from service.dowloadImg import (
     download_selected_images,
+    stream_selected_images,
 )
+from service.workspace import Workspace, load_published
+from service.archive import stream_zip
+from service.encoder_profiles import resolve_profile
+from service.jobs import ASYNC_JOBS, JobManager, JobError, is_async_request, job_accepted
+from service.ocr_cache import file_digest
+from service.genai_clients import get_client
+from service.ocr_engine import OcrEngine
+from service.ocr_payload import encode_payload, payload_params
+from service.uploads import UploadRequest, UploadedFile, ingest_uploads, open_image
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__, static_folder='public')
+# Giữ file upload trong bộ nhớ, chỉ ghi ra đĩa khi vượt ngưỡng
+app.request_class = UploadRequest
 CORS(app)
 app.config['UPLOAD_FOLDER'] = '/tmp'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max-limit
@@ -35,6 +43,16 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max-limit
 # Create temporary directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Hàng đợi job nền cho các thao tác chạy lâu
+job_manager = JobManager(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+app.extensions['job_manager'] = job_manager
+
+
+@app.context_processor
+def inject_job_settings():
+    # Giao diện chỉ gửi async=1 khi server cho phép chạy job nền
+    return {'async_jobs': ASYNC_JOBS}
+
 
 # Hàm xử lý lỗi chung
 def handle_error(e):
@@ -47,6 +65,13 @@ def handle_error(e):
         error_msg = "File ảnh không hợp lệ hoặc bị hỏng"
     return jsonify({'error': error_msg})
 
+def get_encoder_options():
+    """Đọc profile encode và dung lượng mục tiêu mỗi ảnh (KB) từ form"""
+    profile = resolve_profile(request.form.get('profile'))
+    target_kb = request.form.get('target_kb')
+    target_bytes = int(float(target_kb) * 1024) if target_kb else None
+    return profile, target_bytes
+
 @app.route('/')
 def index():
     functions = {
@@ -86,62 +111,34 @@ def execute_change_image():
         
         files = request.files.getlist('files')
         target_format = request.form.get('target_format', 'webp')
+        profile, target_bytes = get_encoder_options()
         
         if not files or files[0].filename == '':
             return jsonify({'error': 'Không có file được chọn'})
             
-        # Tạo thư mục tạm thời
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_convert')
-        output_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'output_convert')
-        
-        for dir_path in [temp_dir, output_dir]:
-            if os.path.exists(dir_path):
-                shutil.rmtree(dir_path)
-            os.makedirs(dir_path)
-        
-        # Theo dõi các chuyển đổi đã thực hiện
-        conversions = []
+        # Tạo thư mục làm việc riêng cho request
+        with Workspace(app.config['UPLOAD_FOLDER'], 'convert') as workspace:
+            output_dir = workspace.subdir('output')
             
-        # Lưu và xử lý từng file
-        for file in files:
-            if file.filename:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(temp_dir, filename)
-                file.save(file_path)
-                
-                # Xác định định dạng nguồn và chuyển đổi
-                with Image.open(file_path) as img:
-                    source_format = img.format.lower() if img.format else os.path.splitext(filename)[1][1:].lower()
-                    # Chuyển đổi và lưu với định dạng mới
-                    output_path = os.path.join(output_dir, os.path.splitext(filename)[0] + '.' + target_format.lower())
-                    
-                    # Thêm thông tin chuyển đổi
-                    conversions.append(f"{source_format.upper()} → {target_format.upper()}")
-                    
-                    if target_format.upper() == 'WEBP':
-                        img.save(output_path, 'WEBP', quality=90)
-                    elif target_format.upper() == 'JPEG':
-                        if img.mode in ('RGBA', 'LA'):
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[-1])
-                            background.save(output_path, 'JPEG', quality=95)
-                        else:
-                            img.save(output_path, 'JPEG', quality=95)
-                    else:  # PNG
-                        img.save(output_path, 'PNG')
-        
-        # Tạo file zip
-        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'converted_images.zip')
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, output_dir)
-                    zipf.write(file_path, arcname)
-        
-        # Xóa thư mục tạm
-        shutil.rmtree(temp_dir)
-        shutil.rmtree(output_dir)
+            # Đọc ảnh trực tiếp từ upload và chuẩn bị danh sách chuyển đổi
+            tasks = []
+            for upload in ingest_uploads(files, os.path.join(workspace.path, 'input')):
+                output_path = os.path.join(output_dir, os.path.splitext(upload.name)[0] + '.' + target_format.lower())
+                tasks.append((upload, output_path))
+            
+            # Chuyển đổi song song trên nhiều process
+            target = target_format.upper() if target_format.upper() in ('WEBP', 'JPEG') else 'PNG'
+            results, stats = convert_batch(tasks, target, profile=profile, target_bytes=target_bytes)
+            
+            # Theo dõi các chuyển đổi đã thực hiện
+            conversions = [f"{r['source_format'].upper()} → {target_format.upper()}" for r in results if r['success']]
+            failed_files = [f"{os.path.basename(r['input'])}: {r['error']}" for r in results if not r['success']]
+            
+            if not conversions:
+                return jsonify({'error': 'Không thể chuyển đổi ảnh nào', 'failed_files': failed_files})
+            
+            # Đăng ký kết quả, file zip được stream khi tải xuống
+            zip_filename = workspace.publish('converted_images.zip', output_dir)
         
         # Tạo thông báo chi tiết về các chuyển đổi
         unique_conversions = list(set(conversions))
@@ -149,8 +146,10 @@ def execute_change_image():
         
         return jsonify({
             'message': f'Chuyển đổi thành công! ({conversion_message})',
-            'output_files': ['converted_images.zip'],
-            'conversions': unique_conversions
+            'output_files': [zip_filename],
+            'conversions': unique_conversions,
+            'failed_files': failed_files,
+            'stats': stats
         })
         
     except Exception as e:
@@ -167,80 +166,91 @@ def execute_cut_merge_image():
     images_per_group = int(request.form.get('parts', 2))  # Số ảnh mỗi nhóm khi ghép
     width = request.form.get('width')
     height = request.form.get('height')
+    pad = request.form.get('pad_width') in ('1', 'true', 'on')  # Thêm viền thay vì co giãn khi ghép
+    snap = request.form.get('cut_mode', 'smart') != 'fixed'  # Cắt tại khoảng trống giữa các khung
     
     if not files or files[0].filename == '':
         return jsonify({'error': 'Không có file được chọn'})
-        
-    # Tạo thư mục tạm thời
-    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_process')
-    output_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'output_process')
     
-    for dir_path in [temp_dir, output_dir]:
-        if os.path.exists(dir_path):
-            shutil.rmtree(dir_path)
-        os.makedirs(dir_path)
-        
     try:
-        # Lưu các file
-        saved_files = []
-        for file in files:
-            if file.filename:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(temp_dir, filename)
-                file.save(file_path)
-                saved_files.append(file_path)
-                
-                # Resize ảnh nếu có yêu cầu
-                if width or height:
-                    with Image.open(file_path) as img:
-                        new_width = int(width) if width else img.width
-                        new_height = int(height) if height else img.height
-                        resized = img.resize((new_width, new_height))
-                        resized.save(file_path)
+        profile, target_bytes = get_encoder_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)})
         
-        processor = ImageProcessor(temp_dir)
+    # Tạo thư mục làm việc riêng cho request
+    workspace = Workspace(app.config['UPLOAD_FOLDER'], 'process')
         
-        try:
-            if action == 'split':
-                result_files = processor.split_images(min_height)
-            else:  # merge
-                if len(saved_files) < images_per_group:
-                    return jsonify({'error': f'Số lượng ảnh ({len(saved_files)}) phải lớn hơn hoặc bằng số ảnh mỗi nhóm ({images_per_group})'})
-                result_files = processor.combine_images(images_per_group)
-            
-            if not result_files:
-                return jsonify({'error': 'Không thể xử lý ảnh. Vui lòng kiểm tra lại các tham số.'})
-            
-            # Copy các file kết quả vào thư mục output với tên mới
-            for i, file_path in enumerate(result_files, 1):
-                file_ext = os.path.splitext(file_path)[1]
-                new_name = f"{i}{file_ext}"
-                new_path = os.path.join(output_dir, new_name)
-                shutil.copy2(file_path, new_path)
-            
-            # Tạo file zip chứa kết quả
-            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'processed_images.zip')
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for root, dirs, files in os.walk(output_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, output_dir)
-                        zipf.write(file_path, arcname)
-            
-            # Xóa thư mục tạm
-            shutil.rmtree(temp_dir)
-            shutil.rmtree(output_dir)
-            
-            return jsonify({
-                'message': 'Xử lý thành công!',
-                'output_files': ['processed_images.zip']
-            })
-            
-        except Exception as e:
-            return jsonify({'error': str(e)})
+    try:
+        # Đọc ảnh trực tiếp từ upload
+        images = ingest_uploads(files, os.path.join(workspace.path, 'input'))
+        
+        # Resize ảnh nếu có yêu cầu
+        if width or height:
+            for index, image in enumerate(images):
+                with image.open_image() as img:
+                    new_width = int(width) if width else img.width
+                    new_height = int(height) if height else img.height
+                    resized = img.resize((new_width, new_height))
+                    images[index] = UploadedFile.from_image(image.name, resized, img.format)
+        
+        if action != 'split' and len(images) < images_per_group:
+            return jsonify({'error': f'Số lượng ảnh ({len(images)}) phải lớn hơn hoặc bằng số ảnh mỗi nhóm ({images_per_group})'})
+        
+        # Chạy nền nếu client yêu cầu, job sẽ tự dọn workspace
+        if is_async_request():
+            job = job_manager.submit_with_workspace('cutmergeimage', workspace, run_cut_merge, images,
+                                                    action, min_height, images_per_group, profile, target_bytes, pad, snap)
+            workspace = None
+            return job_accepted(job)
+        
+        return jsonify(run_cut_merge(workspace, images, action, min_height, images_per_group, profile, target_bytes,
+                                     pad, snap))
             
+    except JobError as e:
+        return jsonify({'error': str(e)})
     except Exception as e:
         return handle_error(e)
+    finally:
+        # Xóa thư mục tạm
+        if workspace:
+            workspace.cleanup()
+
+def run_cut_merge(workspace, images, action, min_height, images_per_group, profile=None, target_bytes=None,
+                  pad=False, snap=True, progress=None):
+    """Cắt hoặc ghép các ảnh upload và tạo file zip kết quả trong workspace"""
+    output_dir = workspace.subdir('output')
+    
+    if progress:
+        progress(0, 1, 'Đang xử lý ảnh')
+    
+    try:
+        processor = ImageProcessor(output_dir, profile, target_bytes, images=images)
+        if action == 'split':
+            result_files = processor.split_images(min_height, snap=snap)
+        else:  # merge
+            result_files = processor.combine_images(images_per_group, pad)
+    except Exception as e:
+        raise JobError(str(e))
+    
+    if not result_files:
+        raise JobError('Không thể xử lý ảnh. Vui lòng kiểm tra lại các tham số.')
+    
+    # Đặt tên mới theo số thứ tự cho các file kết quả
+    entries = []
+    for i, file_path in enumerate(result_files, 1):
+        file_ext = os.path.splitext(file_path)[1]
+        entries.append((f"{i}{file_ext}", file_path))
+    
+    # Đăng ký kết quả, file zip được stream khi tải xuống
+    zip_filename = workspace.publish('processed_images.zip', entries=entries)
+    
+    if progress:
+        progress(1, 1, 'Xử lý thành công!')
+    
+    return {
+        'message': 'Xử lý thành công!',
+        'output_files': [zip_filename]
+    }
 
 @app.route('/execute/mergeWord', methods=['POST'])
 def execute_merge_word():
@@ -251,11 +261,9 @@ def execute_merge_word():
     if not files or files[0].filename == '':
         return jsonify({'error': 'Không có file được chọn'})
     
-    # Tạo thư mục tạm thời
-    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_word')
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
+    # Tạo thư mục làm việc riêng cho request
+    workspace = Workspace(app.config['UPLOAD_FOLDER'], 'word')
+    temp_dir = workspace.subdir('input')
     
     try:
         # Lưu các file
@@ -270,23 +278,21 @@ def execute_merge_word():
         success = merge_word_documents(temp_dir, output_path)
         
         if success:
-            # Tạo file zip chứa kết quả
-            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'merged_documents.zip')
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(output_path, 'merged_document.docx')
-            
-            # Xóa thư mục tạm
-            shutil.rmtree(temp_dir)
+            # Đăng ký kết quả, file zip được stream khi tải xuống
+            zip_filename = workspace.publish('merged_documents.zip', entries=[('merged_document.docx', output_path)])
             
             return jsonify({
                 'message': 'Gộp file thành công!',
-                'output_files': ['merged_documents.zip']
+                'output_files': [zip_filename]
             })
         else:
             return jsonify({'error': 'Không thể gộp các file'})
         
     except Exception as e:
         return handle_error(e)
+    finally:
+        # Xóa thư mục tạm
+        workspace.cleanup()
 
 @app.route('/execute/renameImage', methods=['POST'])
 def execute_rename_image():
@@ -297,11 +303,9 @@ def execute_rename_image():
     if not files or files[0].filename == '':
         return jsonify({'error': 'Không có file được chọn'})
     
-    # Tạo thư mục tạm thời
-    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_rename')
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
+    # Tạo thư mục làm việc riêng cho request
+    workspace = Workspace(app.config['UPLOAD_FOLDER'], 'rename')
+    temp_dir = workspace.subdir('input')
     
     try:
         # Lưu các file
@@ -314,25 +318,19 @@ def execute_rename_image():
         # Đổi tên file
         rename_files(temp_dir)
         
-        # Tạo file zip chứa kết quả
-        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'renamed_images.zip')
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
-        
-        # Xóa thư mục tạm
-        shutil.rmtree(temp_dir)
+        # Đăng ký kết quả, file zip được stream khi tải xuống
+        zip_filename = workspace.publish('renamed_images.zip', temp_dir)
         
         return jsonify({
             'message': 'Đổi tên file thành công!',
-            'output_files': ['renamed_images.zip']
+            'output_files': [zip_filename]
         })
         
     except Exception as e:
         return handle_error(e)
+    finally:
+        # Xóa thư mục tạm
+        workspace.cleanup()
 
 @app.route('/execute/ocr', methods=['POST'])
 def execute_ocr():
@@ -342,235 +340,169 @@ def execute_ocr():
         mode = request.form.get('mode', 'ocr')
         genres = request.form.getlist('genres[]')
         styles = request.form.getlist('styles[]')
+        target_langs = request.form.getlist('target_langs[]')
         
         if not files or not api_key:
             return jsonify({'error': 'Vui lòng cung cấp file và API key'})
         
-        # Tạo một tài liệu Word mới
-        doc = Document()
-        
-        extracted_texts = []
-        processed_files = []
-        failed_files = []
-        
-        # Tạo thư mục tạm thời
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_ocr')
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
+        # Tạo thư mục làm việc riêng cho request
+        workspace = Workspace(app.config['UPLOAD_FOLDER'], 'ocr')
+        spill_dir = os.path.join(workspace.path, 'input')
         
         try:
-            # Xử lý từng file một
+            # Đọc các file từ upload để xử lý (có thể chạy nền)
+            uploads = []
+            failed_files = []
             for file in files:
                 if not file.filename:
                     continue
-                    
-                try:
-                    # Kiểm tra định dạng file
-                    file_ext = os.path.splitext(file.filename)[1].lower()
-                    
-                    if file_ext in ['.docx', '.doc']:
-                        # Xử lý file Word
-                        success = process_word_file(file, doc, mode, genres, styles, api_key)
-                        if success:
-                            processed_files.append(file.filename)
-                        else:
-                            failed_files.append(file.filename)
-                            
-                    elif file_ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                        # Lưu file ảnh vào thư mục tạm
-                        filename = secure_filename(file.filename)
-                        file_path = os.path.join(temp_dir, filename)
-                        file.save(file_path)
-                        
-                        # Xử lý file ảnh
-                        success = process_image_file(file_path, doc, mode, genres, styles, api_key)
-                        if success:
-                            processed_files.append(file.filename)
-                        else:
-                            failed_files.append(file.filename)
-                    else:
-                        failed_files.append(file.filename)
-                        continue
-                        
-                except Exception as e:
-                    print(f"Lỗi khi xử lý file {file.filename}: {str(e)}")
+                
+                # Kiểm tra định dạng file
+                file_ext = os.path.splitext(file.filename)[1].lower()
+                if file_ext in ['.docx', '.doc']:
+                    kind = 'word'
+                elif file_ext in ['.jpg', '.jpeg', '.png', '.webp']:
+                    kind = 'image'
+                else:
                     failed_files.append(file.filename)
                     continue
+                
+                for upload in ingest_uploads([file], spill_dir):
+                    uploads.append((file.filename, upload, kind))
             
-            if not processed_files:
-                return jsonify({'error': 'Không thể xử lý bất kỳ file nào'})
-            
-            # Lưu tài liệu
-            output_filename = f'VBCĐ_{int(time.time())}.docx'
-            output_path = os.path.join(temp_dir, output_filename)
-            doc.save(output_path)
-            
-            # Tạo file zip chứa kết quả
-            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'processed_ocr.zip')
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(output_path, output_filename)
+            # Chạy nền nếu client yêu cầu, job sẽ tự dọn workspace
+            if is_async_request():
+                job = job_manager.submit_with_workspace('ocr', workspace, run_ocr, uploads, failed_files,
+                                                        mode, genres, styles, api_key, target_langs)
+                workspace = None
+                return job_accepted(job)
             
-            # Xóa thư mục tạm
-            shutil.rmtree(temp_dir)
-            
-            return jsonify({
-                'success': True,
-                'word_files': {'all': ['processed_ocr.zip']},
-                'processed_files': processed_files,
-                'failed_files': failed_files,
-                'extracted_texts': extracted_texts
-            })
+            return jsonify(run_ocr(workspace, uploads, failed_files, mode, genres, styles, api_key, target_langs))
             
         except Exception as e:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
             return jsonify({'error': str(e)})
+        finally:
+            # Xóa thư mục tạm
+            if workspace:
+                workspace.cleanup()
         
     except Exception as e:
         return jsonify({'error': str(e)})
 
-def process_word_file(file, doc, mode, genres, styles, api_key):
-    try:
-        docx_doc = Document(file)
-        text = ''
-        for para in docx_doc.paragraphs:
-            text += para.text + '\n'
-        
-        if text.strip():
-            if mode == 'translate':
-                # Dịch văn bản
-                target_langs = request.form.getlist('target_langs[]')
-                for lang in target_langs:
-                    prompt = f"""
-                        Hãy dịch đoạn văn bản sau sang {getLangName(lang)}.
-                        Thể loại: {', '.join(genres) if genres else 'Không xác định'}
-                        Phong cách: {', '.join(styles) if styles else 'Không xác định'}
-                        
-                        Văn bản cần dịch:
-                        {text}
-                    """
-                    client = genai.Client(api_key=api_key)
-                    
-                    response = client.models.generate_content(
-                        model="gemini-2.5-pro-exp-03-25",
-                        contents=prompt,
-                        config={"temperature": 0.2}
-                    )
-                    
-                    if response.text:
-                        doc.add_paragraph(f"=== {getLangName(lang)} ===")
-                        doc.add_paragraph(response.text)
-                        doc.add_paragraph('---')
-            else:
-                doc.add_paragraph(text)
-                doc.add_paragraph('---')
-        return True
-    except Exception as e:
-        print(f"Lỗi khi xử lý file Word {file.filename}: {str(e)}")
-        return False
+def run_ocr(workspace, uploads, failed_files, mode, genres, styles, api_key, target_langs, progress=None):
+    """
+    Nhận dạng/dịch các file upload và tạo file zip chứa tài liệu Word trong workspace
 
-def process_image_file(file_path, doc, mode, genres, styles, api_key):
-    try:
+    Các file được xử lý đồng thời (OcrEngine giới hạn số request và quota mỗi phút),
+    nội dung được ghép vào tài liệu Word theo đúng thứ tự upload.
+    """
+    engine = OcrEngine(api_key)
+    
+    def process(item):
+        original_name, upload, kind = item
+        if kind == 'word':
+            # Xử lý file Word
+            return process_word_file(engine, upload, mode, genres, styles, target_langs)
+        # Xử lý file ảnh
+        return process_image_file(engine, upload, mode, genres, styles, target_langs)
+    
+    if progress:
+        progress(0, len(uploads), 'Đang xử lý')
+    results = engine.map(process, uploads, progress)
+    
+    # Tạo một tài liệu Word mới
+    doc = Document()
+    
+    extracted_texts = []
+    processed_files = []
+    failed_files = list(failed_files)
+    
+    for (original_name, upload, kind), (success, paragraphs) in zip(uploads, results):
+        if not success:
+            print(f"Lỗi khi xử lý file {original_name}: {str(paragraphs)}")
+            failed_files.append(original_name)
+            continue
+        for paragraph in paragraphs:
+            doc.add_paragraph(paragraph)
+        processed_files.append(original_name)
+    
+    if not processed_files:
+        raise JobError('Không thể xử lý bất kỳ file nào')
+    
+    # Lưu tài liệu
+    output_filename = f'VBCĐ_{int(time.time())}.docx'
+    output_path = os.path.join(workspace.path, output_filename)
+    doc.save(output_path)
+    
+    # Đăng ký kết quả, file zip được stream khi tải xuống
+    zip_filename = workspace.publish('processed_ocr.zip', entries=[(output_filename, output_path)])
+    
+    if progress:
+        progress(len(uploads), len(uploads), 'Hoàn thành')
+    
+    return {
+        'success': True,
+        'word_files': {'all': [zip_filename]},
+        'output_files': [zip_filename],
+        'processed_files': processed_files,
+        'failed_files': failed_files,
+        'extracted_texts': extracted_texts,
+        'cache': dict(engine.stats),
+        'payloads': engine.payloads
+    }
+
+def text_paragraphs(engine, text, mode, genres, styles, target_langs):
+    """Các đoạn cần ghi vào tài liệu Word: văn bản gốc, hoặc bản dịch của từng ngôn ngữ"""
+    if mode != 'translate':
+        return [text, '---']
+    # Dịch sang tất cả ngôn ngữ trong một request
+    translations = engine.translate_many(text, [getLangName(lang) for lang in target_langs], genres, styles)
+    paragraphs = []
+    for lang in target_langs:
+        translated = translations.get(getLangName(lang))
+        if translated:
+            paragraphs.extend([f"=== {getLangName(lang)} ===", translated, '---'])
+    return paragraphs
+
+def process_word_file(engine, source, mode, genres, styles, target_langs):
+    """Đọc văn bản trong file Word, trả về các đoạn cần ghi vào tài liệu kết quả"""
+    with source.open_binary() as f:
+        docx_doc = Document(f)
+    text = ''
+    for para in docx_doc.paragraphs:
+        text += para.text + '\n'
+    
+    if not text.strip():
+        return []
+    return text_paragraphs(engine, text, mode, genres, styles, target_langs)
+
+# Tham số tiền xử lý ảnh trước khi OCR (là một phần của khóa cache)
+OCR_PREPROCESS = {'mode': 'L', 'contrast': 1.5, 'payload': payload_params()}
+
+def process_image_file(engine, source, mode, genres, styles, target_langs):
+    """Nhận dạng (và dịch) văn bản trong ảnh, trả về các đoạn cần ghi vào tài liệu kết quả"""
+    # Ảnh đã OCR trước đó (cùng nội dung, cùng tham số) thì không cần xử lý lại
+    cache_key = engine.ocr_key(file_digest(source), OCR_PREPROCESS)
+    text = engine.cached_ocr(cache_key)
+    if text is None:
         # Đọc và xử lý ảnh
-        with Image.open(file_path) as img:
-            # Kiểm tra kích thước ảnh
-            max_size = (1920, 1080)
-            if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
+        with open_image(source) as img:
             # Chuyển sang grayscale và tăng độ tương phản
-            img = img.convert('L')
+            img = img.convert(OCR_PREPROCESS['mode'])
             enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            
-            # Chuyển ảnh đã xử lý thành bytes
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # Tạo prompt cho việc nhận dạng văn bản
-            prompt = f"""
-                NHIỆM VỤ: Nhận dạng và trích xuất văn bản từ ảnh với độ chính xác cao nhất.
-                
-                YÊU CẦU CHẤT LƯỢNG:
-                1. Nhận dạng chính xác 100% nội dung văn bản, kể cả chữ nhỏ
-                2. Phân biệt rõ các đoạn văn bản khác nhau, các bóng thoại khác nhau
-                3. Giữ nguyên vị trí và thứ tự của các bóng thoại
-                4. Không bỏ sót bất kỳ ký tự nào
-                
-                QUY TẮC XỬ LÝ:
-                1. Loại bỏ các yếu tố không phải văn bản 
-                2. QUAN TRỌNG: Xử lý mỗi bóng thoại (speech bubble) như MỘT CÂU HOÀN CHỈNH TRÊN MỘT DÒNG DUY NHẤT
-                3. Mỗi bóng thoại riêng biệt sẽ được xuất ra thành một dòng văn bản riêng biệt
-                4. Giữ nguyên các dấu câu và định dạng đặc biệt
-                
-                ĐỊNH DẠNG ĐẦU RA:
-                - Mỗi bóng thoại trên một dòng riêng
-                - Giữ nguyên các dấu câu và định dạng
-                - Không thêm bất kỳ chú thích hay giải thích nào
-                - Không tách văn bản trong một bóng thoại thành nhiều dòng
-            """
+            img = enhancer.enhance(OCR_PREPROCESS['contrast'])
             
-            client = genai.Client(api_key=api_key)
-            
-            # Gửi yêu cầu đến Gemini API với cấu hình tối ưu
-            response = client.models.generate_content(
-                model="gemini-2.5-pro-exp-03-25",
-                contents=[
-                    {"text": prompt},
-                    {"inline_data": {"mime_type": "image/png", "data": img_byte_arr}}
-                ],
-                config={
-                    "temperature": 0.1,  # Giảm temperature để tăng độ chính xác
-                    "max_output_tokens": 2048,  # Tăng max tokens để xử lý văn bản dài
-                    "top_p": 0.8,
-                    "top_k": 40,
-                    "candidate_count": 1
-                }
-            )
-            
-            if response.text:
-                # Thêm thông tin về file đang xử lý
-                doc.add_paragraph(f"=== File: {os.path.basename(file_path)} ===")
-                
-                if mode == 'translate':
-                    # Dịch văn bản
-                    target_langs = request.form.getlist('target_langs[]')
-                    for lang in target_langs:
-                        prompt = f"""
-                            Hãy dịch đoạn văn bản sau sang {getLangName(lang)}.
-                            Thể loại: {', '.join(genres) if genres else 'Không xác định'}
-                            Phong cách: {', '.join(styles) if styles else 'Không xác định'}
-                            
-                            Văn bản cần dịch:
-                            {response.text}
-                        """
-                        
-                        response = client.models.generate_content(
-                            model="gemini-2.5-pro-exp-03-25",
-                            contents=prompt,
-                            config={
-                                "temperature": 0.2,
-                                "max_output_tokens": 2048
-                            }
-                        )
-                        
-                        if response.text:
-                            doc.add_paragraph(f"=== {getLangName(lang)} ===")
-                            doc.add_paragraph(response.text)
-                            doc.add_paragraph('---')
-                else:
-                    doc.add_paragraph(response.text)
-                    doc.add_paragraph('---')
-                    
-                # Thêm delay giữa các lần xử lý để tránh rate limit
-                time.sleep(1)
-                
-            return True
-    except Exception as e:
-        print(f"Lỗi khi xử lý file ảnh {file_path}: {str(e)}")
-        return False
+            # Chọn độ phân giải và định dạng để ảnh gửi lên nằm trong dung lượng cho phép
+            data, mime_type, payload = encode_payload(img, OCR_PREPROCESS['payload']['budget'])
+        
+        text = engine.ocr_image(data, mime_type, cache_key, dict(payload, file=source.name))
+    if not text:
+        return []
+    
+    # Thêm thông tin về file đang xử lý
+    paragraphs = [f"=== File: {os.path.basename(source.name)} ==="]
+    paragraphs.extend(text_paragraphs(engine, text, mode, genres, styles, target_langs))
+    return paragraphs
 
 # Hàm chuyển đổi mã ngôn ngữ thành tên
 def getLangName(code):
@@ -591,11 +523,9 @@ def execute_merge_ocr():
     if not files or files[0].filename == '':
         return jsonify({'error': 'Không có file được chọn'})
     
-    # Tạo thư mục tạm thời
-    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_merge_ocr')
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
+    # Tạo thư mục làm việc riêng cho request
+    workspace = Workspace(app.config['UPLOAD_FOLDER'], 'merge_ocr')
+    temp_dir = workspace.subdir('input')
     
     try:
         # Lưu các file Word
@@ -610,29 +540,41 @@ def execute_merge_ocr():
         success = merge_word_documents(temp_dir, output_path)
         
         if success:
-            # Tạo file zip chứa kết quả
-            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'merged_ocr.zip')
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(output_path, 'merged_ocr.docx')
-            
-            # Xóa thư mục tạm
-            shutil.rmtree(temp_dir)
+            # Đăng ký kết quả, file zip được stream khi tải xuống
+            zip_filename = workspace.publish('merged_ocr.zip', entries=[('merged_ocr.docx', output_path)])
             
             return jsonify({
                 'message': 'Gộp file thành công!',
-                'output_files': ['merged_ocr.zip']
+                'output_files': [zip_filename]
             })
         else:
             return jsonify({'error': 'Không thể gộp các file'})
         
     except Exception as e:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         return handle_error(e)
+    finally:
+        # Xóa thư mục tạm
+        workspace.cleanup()
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job không tồn tại'}), 404
+    return jsonify(job)
 
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
+        # Kết quả đã publish: stream file zip trực tiếp từ workspace
+        entries = load_published(app.config['UPLOAD_FOLDER'], filename)
+        if entries is not None:
+            return Response(
+                stream_zip(entries),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            )
+        
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(file_path):
             return jsonify({'error': 'File không tồn tại'})
@@ -694,7 +636,7 @@ def test_api_key():
         if not api_key:
             return jsonify({'error': 'API key không được cung cấp'})
         
-        client = genai.Client(api_key=api_key)
+        client = get_client(api_key)
         
         # Tạo một tin nhắn đơn giản để kiểm tra API key
         response = client.models.generate_content(
@@ -710,6 +652,10 @@ def test_api_key():
 def execute_download():
     return download_selected_images()
 
+@app.route('/execute/download_images/stream', methods=['POST'])
+def execute_download_stream():
+    return stream_selected_images()
+
 @app.route('/add_logo', methods=['GET', 'POST'])
 def add_logo():
     if request.method == 'GET':
@@ -729,50 +675,40 @@ def add_logo():
         # Lấy các tham số
         position = request.form.get('position', 'top_left')
         scale = float(request.form.get('scale', 10)) / 100  # Chuyển đổi từ phần trăm sang thập phân
+        profile, target_bytes = get_encoder_options()
         
-        # Tạo thư mục tạm thời
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_logo')
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
+        # Tạo thư mục làm việc riêng cho request
+        workspace = Workspace(app.config['UPLOAD_FOLDER'], 'logo')
+        temp_dir = os.path.join(workspace.path, 'input')
             
         try:
-            # Lưu logo
-            logo_path = os.path.join(temp_dir, 'logo.png')
-            logo.save(logo_path)
+            # Đọc logo và các ảnh trực tiếp từ upload
+            logo_upload = ingest_uploads([logo], os.path.join(workspace.path, 'logo'))[0]
+            images = ingest_uploads(files, temp_dir)
             
-            # Lưu các file ảnh
-            for file in files:
-                if file.filename:
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(temp_dir, filename)
-                    file.save(file_path)
-                    
             # Xử lý ảnh
             processor = LogoProcessor()
-            output_path = processor.process_folder(temp_dir, logo_path, position, scale)
+            output_paths = processor.process_images(images, logo_upload, workspace.subdir('output'),
+                                                    position, scale, profile, target_bytes)
             
-            if output_path:
-                # Tạo file zip chứa kết quả
-                zip_path = os.path.join(app.config['UPLOAD_FOLDER'], 'processed_images.zip')
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    zipf.write(output_path, os.path.basename(output_path))
-                
-                # Xóa thư mục tạm
-                shutil.rmtree(temp_dir)
+            if output_paths:
+                # Đăng ký kết quả, file zip được stream khi tải xuống
+                zip_filename = workspace.publish('processed_images.zip',
+                                                 entries=[(os.path.basename(path), path) for path in output_paths])
                         
                 return jsonify({
                     'success': True,
                     'message': 'Thêm logo thành công',
-                    'download_url': url_for('download_file', filename='processed_images.zip', _external=True)
+                    'download_url': url_for('download_file', filename=zip_filename, _external=True)
                 })
             else:
                 return jsonify({'error': 'Không thể xử lý ảnh'}), 500
             
         except Exception as e:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
             return jsonify({'error': str(e)}), 500
+        finally:
+            # Xóa thư mục tạm
+            workspace.cleanup()
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
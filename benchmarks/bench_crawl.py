@@ -0,0 +1,108 @@
+"""
+Đo tốc độ lấy URL ảnh từ trang chapter lớn
+
+So sánh extract_image_urls (một lần duyệt, lxml nếu đã cài) với cách crawl cũ
+(BeautifulSoup html.parser, ba lần find_all trên toàn cây).
+
+Chạy: python -m benchmarks.bench_crawl [số ảnh] [số lần lặp]
+"""
+import re
+import sys
+import time
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+from service.image_downloader import extract
+from service.image_downloader.extract import extract_image_urls
+
+BASE_URL = 'https://example.com/truyen/chapter-1'
+EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+THUMBNAILS = ['type=f218_218', 'type=w160', 'type=w210', 'type=q90', 'type=a92', 'thumb_', 'thumbnail']
+
+
+def make_page(image_count):
+    """Trang chapter giả: ảnh lazy-load, thumbnail, quảng cáo, ảnh nền và link ảnh"""
+    parts = ['<html><head><meta charset="utf-8"><title>Chapter</title></head><body>']
+    parts.append('<div class="menu">' + ''.join(
+        f'<a href="/truyen/chapter-{i}">Chapter {i}</a>' for i in range(image_count)) + '</div>')
+    parts.append('<div class="reading-detail box_doc">')
+    for i in range(image_count):
+        parts.append(
+            f'<div class="page-chapter" id="page_{i}">'
+            f'<img data-src="//cdn.example.com/{i}.jpg" src="/images/loading.gif" alt="trang {i}"></div>'
+        )
+        if i % 10 == 0:
+            parts.append(f'<div class="ads"><img src="https://ads.example.com/banner_{i}.png?type=w160"></div>')
+            parts.append(f'<div class="chapter-bg" style="background-image: url(\'/bg/{i}.webp\')"></div>')
+            parts.append(f'<a href="/raw/{i}.png">tải ảnh gốc</a>')
+    parts.append('</div>')
+    parts.append('<ul class="list-comic">' + ''.join(
+        f'<li><img src="/thumb_{i}.jpg"><span>Truyện {i}</span></li>' for i in range(image_count)) + '</ul>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def legacy_extract(html, url):
+    """Cách crawl trước đây (bỏ phần in log)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    image_urls = []
+    for img in soup.find_all('img'):
+        for attr in ['data-url', 'data-src', 'data-original', 'data-lazy-src', 'src']:
+            src = img.get(attr, '')
+            if src:
+                if not src.startswith(('http://', 'https://')):
+                    src = urljoin(url, src)
+                if any(x in src.lower() for x in THUMBNAILS + ['bg_transparency']):
+                    continue
+                if any(src.lower().endswith(ext) for ext in EXTENSIONS):
+                    image_urls.append(src)
+
+    keywords = ['image', 'img', 'photo', 'picture', 'chapter', 'comic']
+    for div in soup.find_all('div', class_=lambda x: x and any(k in x.lower() for k in keywords)):
+        style = div.get('style', '')
+        if 'background-image' in style:
+            for src in re.findall(r'url\([\'"]?(.*?)[\'"]?\)', style):
+                if not src.startswith(('http://', 'https://')):
+                    src = urljoin(url, src)
+                if any(x in src.lower() for x in THUMBNAILS):
+                    continue
+                if any(src.lower().endswith(ext) for ext in EXTENSIONS):
+                    image_urls.append(src)
+
+    for a in soup.find_all('a', href=lambda x: x and any(x.lower().endswith(ext) for ext in EXTENSIONS)):
+        src = a.get('href', '')
+        if not src.startswith(('http://', 'https://')):
+            src = urljoin(url, src)
+        if any(x in src.lower() for x in THUMBNAILS):
+            continue
+        image_urls.append(src)
+
+    return list(dict.fromkeys(image_urls))
+
+
+def measure(func, html, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(html, BASE_URL)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    html = make_page(image_count)
+    print(f"Trang thử: {len(html) / 1024:.0f} KB, {image_count} ảnh, parser: "
+          f"{'lxml' if extract.lxml is not None else 'html.parser'}")
+
+    legacy_time, legacy_urls = measure(legacy_extract, html, repeat)
+    new_time, new_urls = measure(extract_image_urls, html, repeat)
+    print(f"Cách cũ:  {legacy_time * 1000:.1f} ms ({len(legacy_urls)} ảnh)")
+    print(f"Cách mới: {new_time * 1000:.1f} ms ({len(new_urls)} ảnh), nhanh hơn {legacy_time / new_time:.1f} lần")
+    if new_urls != legacy_urls:
+        print("Cảnh báo: danh sách ảnh khác với cách cũ")
+
+
+if __name__ == '__main__':
+    main()
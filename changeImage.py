@@ -1,6 +1,9 @@
 import os
-from PIL import Image
 import sys
+import time
+from service.workers import run_in_pool
+from service.encoder_profiles import save_image
+from service.uploads import UploadedFile, open_image
 
 
 def clear_screen():
@@ -39,7 +42,76 @@ def get_folders():
     return input_folder, output_folder
 
 
-def convert_images(input_folder, output_folder, source_format, target_format):
+def convert_file(source, output_path, target_format, profile=None, target_bytes=None):
+    """
+    Chuyển đổi một ảnh sang định dạng đích (hàm top-level để chạy được trong process con)
+
+    Args:
+        source: Đường dẫn ảnh hoặc UploadedFile (ảnh upload giữ trong bộ nhớ)
+
+    Returns:
+        dict gồm input, output, source_format, success, error, size, quality, elapsed
+    """
+    started = time.perf_counter()
+    input_name = source.name if isinstance(source, UploadedFile) else source
+    result = {
+        'input': input_name,
+        'output': output_path,
+        'source_format': None,
+        'success': False,
+        'error': None,
+        'size': None,
+        'quality': None
+    }
+
+    try:
+        with open_image(source) as img:
+            result['source_format'] = img.format or os.path.splitext(input_name)[1][1:].upper()
+            result['size'], result['quality'] = save_image(img, output_path, target_format, profile, target_bytes)
+
+        result['success'] = True
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['elapsed'] = time.perf_counter() - started
+    return result
+
+
+def convert_batch(tasks, target_format, max_workers=None, profile=None, target_bytes=None):
+    """
+    Chuyển đổi nhiều ảnh song song trên nhiều process
+
+    Args:
+        tasks: Danh sách (đường dẫn ảnh hoặc UploadedFile, output_path)
+        target_format: 'JPEG', 'PNG' hoặc 'WEBP'
+        max_workers: Số process (None dùng pool chung của ứng dụng, 1 chạy tuần tự)
+        profile: Profile encode (fast, balanced, small, quality)
+        target_bytes: Dung lượng mục tiêu cho mỗi ảnh (JPEG/WebP)
+
+    Returns:
+        (results, stats): results giữ nguyên thứ tự của tasks, stats gồm
+        converted, errors, elapsed, images_per_second
+    """
+    started = time.perf_counter()
+    results = run_in_pool(
+        convert_file,
+        [(source, output_path, target_format, profile, target_bytes) for source, output_path in tasks],
+        max_workers=max_workers
+    )
+    elapsed = time.perf_counter() - started
+
+    converted = sum(1 for r in results if r['success'])
+    stats = {
+        'converted': converted,
+        'errors': len(results) - converted,
+        'elapsed': round(elapsed, 3),
+        'images_per_second': round(converted / elapsed, 2) if elapsed > 0 else 0
+    }
+    return results, stats
+
+
+def convert_images(input_folder, output_folder, source_format, target_format, max_workers=None,
+                   profile=None, target_bytes=None):
     """
     Chuyển đổi tất cả ảnh từ định dạng nguồn sang định dạng đích
     """
@@ -49,56 +121,43 @@ def convert_images(input_folder, output_folder, source_format, target_format):
         'PNG': ['.png'],
         'WEBP': ['.webp']
     }
+    target_extensions = {
+        'WEBP': '.webp',
+        'JPEG': '.jpg',
+        'PNG': '.png'
+    }
 
     source_extensions = format_mapping[source_format]
-    converted_count = 0
-    error_count = 0
+    tasks = []
 
-    print("\nĐang chuyển đổi ảnh...")
-
-    for filename in os.listdir(input_folder):
+    for filename in sorted(os.listdir(input_folder)):
         name, ext = os.path.splitext(filename)
-        ext = ext.lower()
 
         # Kiểm tra nếu file có định dạng nguồn phù hợp
-        if ext in source_extensions:
+        if ext.lower() in source_extensions:
             input_path = os.path.join(input_folder, filename)
-
             # Tạo tên file mới với định dạng đích
-            if target_format == 'WEBP':
-                new_filename = f"{name}.webp"
-            elif target_format == 'JPEG':
-                new_filename = f"{name}.jpg"
-            else:  # PNG
-                new_filename = f"{name}.png"
-
-            output_path = os.path.join(output_folder, new_filename)
-
-            try:
-                # Mở và chuyển đổi ảnh
-                with Image.open(input_path) as img:
-                    # Chuyển sang RGB nếu ảnh ở chế độ RGBA
-                    if img.mode == 'RGBA' and target_format == 'JPEG':
-                        img = img.convert('RGB')
-
-                    # Lưu ảnh với định dạng mới
-                    if target_format == 'WEBP':
-                        img.save(output_path, 'WEBP', quality=90, method=6)
-                    elif target_format == 'JPEG':
-                        img.save(output_path, 'JPEG', quality=95)
-                    else:  # PNG
-                        img.save(output_path, 'PNG')
-
-                print(f"✓ Đã chuyển đổi: {filename} -> {new_filename}")
-                converted_count += 1
-
-            except Exception as e:
-                print(f"✗ Lỗi khi chuyển đổi {filename}: {str(e)}")
-                error_count += 1
+            output_path = os.path.join(output_folder, f"{name}{target_extensions[target_format]}")
+            tasks.append((input_path, output_path))
+
+    print(f"\nĐang chuyển đổi {len(tasks)} ảnh...")
+
+    results, stats = convert_batch(tasks, target_format, max_workers=max_workers or os.cpu_count(),
+                                   profile=profile, target_bytes=target_bytes)
+
+    for result in results:
+        filename = os.path.basename(result['input'])
+        new_filename = os.path.basename(result['output'])
+        if result['success']:
+            print(f"✓ Đã chuyển đổi: {filename} -> {new_filename}")
+        else:
+            print(f"✗ Lỗi khi chuyển đổi {filename}: {result['error']}")
 
     print(f"\nHoàn thành!")
-    print(f"- Số ảnh đã chuyển đổi thành công: {converted_count}")
-    print(f"- Số ảnh bị lỗi: {error_count}")
+    print(f"- Số ảnh đã chuyển đổi thành công: {stats['converted']}")
+    print(f"- Số ảnh bị lỗi: {stats['errors']}")
+    print(f"- Thời gian: {stats['elapsed']}s ({stats['images_per_second']} ảnh/giây)")
+    return results, stats
 
 
 def main():
@@ -1,22 +1,146 @@
 import os
 from PIL import Image
 import math
+import numpy as np
 import shutil
 import re
+from service.encoder_profiles import save_image
+from service.uploads import UploadedFile
+from service.workers import IMAGE_WORKERS, run_in_pool, stream_to_pool
+
+# Khoảng tìm điểm cắt quanh vị trí cắt đều, tính theo tỉ lệ của min_height
+SNAP_TOLERANCE = 0.2
+
+# Số dòng xử lý mỗi lần khi tính độ biến thiên (giới hạn bộ nhớ tạm của numpy)
+ROW_CHUNK = 1024
+
+
+def row_variance(img):
+    """
+    Tính phương sai độ sáng của từng dòng pixel.
+
+    Dòng có phương sai thấp là khoảng trống giữa các khung (nền trơn),
+    cắt ở đó sẽ không cắt ngang bong bóng thoại.
+    """
+    gray = img.convert('L') if img.mode != 'L' else img
+    pixels = np.asarray(gray)
+    scores = np.empty(pixels.shape[0], dtype=np.float32)
+    for start in range(0, pixels.shape[0], ROW_CHUNK):
+        scores[start:start + ROW_CHUNK] = pixels[start:start + ROW_CHUNK].var(axis=1, dtype=np.float32)
+    return scores
+
+
+def compute_cuts(height, min_height, row_scores=None, tolerance=None):
+    """
+    Tính các khoảng (top, bottom) khi cắt ảnh cao `height` thành các phần cao khoảng min_height
+
+    :param row_scores: Phương sai từng dòng (row_variance); nếu có, mỗi điểm cắt được dời
+                       tới dòng trơn nhất trong khoảng `tolerance` quanh vị trí cắt đều
+    :param tolerance: Số pixel tối đa được dời (mặc định SNAP_TOLERANCE * min_height)
+    """
+    # Tính số phần cần cắt dựa trên chiều cao tối thiểu
+    num_parts = max(1, math.ceil(height / min_height))
+    part_height = height // num_parts  # Chiều cao thực tế của mỗi phần
+
+    # Vị trí cắt đều (không tính đầu và cuối ảnh)
+    positions = [(i + 1) * part_height for i in range(num_parts - 1)]
+
+    if row_scores is not None and positions:
+        if tolerance is None:
+            tolerance = int(min_height * SNAP_TOLERANCE)
+        # Ưu tiên dòng gần vị trí cắt đều khi các dòng trơn như nhau
+        distance_weight = 1e-3
+        snapped = []
+        previous = 0
+        for index, target in enumerate(positions):
+            next_target = positions[index + 1] if index + 1 < len(positions) else height
+            low = max(previous + 1, target - tolerance)
+            high = min(next_target - 1, target + tolerance)
+            if low < high:
+                window = row_scores[low:high + 1]
+                offsets = np.abs(np.arange(low, high + 1) - target)
+                target = low + int(np.argmin(window + offsets * distance_weight))
+            snapped.append(target)
+            previous = target
+        positions = snapped
+
+    # Phần cuối cùng sẽ lấy đến hết chiều cao của ảnh
+    bounds = [0] + positions + [height]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def part_path(output_dir, input_image, index):
+    """Tên file của phần thứ index (bắt đầu từ 0) khi cắt ảnh input_image"""
+    base_name = os.path.splitext(input_image)[0]
+    return os.path.join(output_dir, f"{base_name}_part_{index + 1}.jpg")
+
+
+def split_file(source, output_dir, min_height, profile=None, target_bytes=None, snap=True):
+    """
+    Cắt một ảnh và lưu các phần (hàm top-level để chạy được trong process con)
+
+    :param snap: Dời điểm cắt tới khoảng trống giữa các khung thay vì cắt đều
+
+    :return: Danh sách đường dẫn các phần đã lưu
+    """
+    result_files = []
+    with source.open_image() as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        width, height = img.size
+        row_scores = row_variance(img) if snap else None
+        for i, (top, bottom) in enumerate(compute_cuts(height, min_height, row_scores)):
+            output_path = part_path(output_dir, source.name, i)
+            save_image(img.crop((0, top, width, bottom)), output_path, 'JPEG', profile, target_bytes)
+            result_files.append(output_path)
+    return result_files
+
+
+def encode_part(mode, size, data, output_path, profile=None, target_bytes=None):
+    """Encode một phần ảnh đã giải mã (dữ liệu pixel thô) ra file JPEG"""
+    save_image(Image.frombytes(mode, size, data), output_path, 'JPEG', profile, target_bytes)
+    return output_path
 
 
 class ImageProcessor:
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, profile=None, target_bytes=None, images=None):
+        """
+        :param folder_path: Thư mục chứa ảnh gốc, cũng là nơi lưu ảnh kết quả
+        :param profile: Profile encode cho ảnh kết quả (fast, balanced, small, quality)
+        :param target_bytes: Dung lượng mục tiêu cho mỗi ảnh kết quả
+        :param images: Danh sách UploadedFile đã đọc sẵn (ví dụ ảnh upload trong bộ nhớ),
+                       khi có thì không đọc thư mục và không xóa ảnh gốc
+        """
         self.folder_path = folder_path
         self.folder_name = os.path.basename(folder_path)
-        self.image_files = [f for f in os.listdir(folder_path) if
-                            f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+        self.profile = profile
+        self.target_bytes = target_bytes
+        self.remove_sources = images is None
+        if images is None:
+            images = [UploadedFile.from_path(os.path.join(folder_path, f)) for f in os.listdir(folder_path)]
+        self.images = {image.name: image for image in images
+                       if image.name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))}
+        self.image_files = list(self.images)
         if not self.image_files:
             raise Exception(f"Không tìm thấy ảnh trong thư mục {folder_path}")
 
-    def combine_images(self, images_per_group):
+    def _open(self, img_file):
+        return self.images[img_file].open_image()
+
+    def _remove_source(self, img_file):
+        """Xóa ảnh gốc trên đĩa (chỉ khi đọc từ thư mục)"""
+        if self.remove_sources:
+            os.remove(self.images[img_file].path)
+
+    def combine_images(self, images_per_group, pad=False):
         """
         Ghép các phần ảnh đã cắt thành một ảnh hoàn chỉnh theo chiều dọc
+
+        Chỉ đọc header để tính kích thước ảnh ghép, sau đó lần lượt giải mã và dán
+        từng ảnh vào nên bộ nhớ tối đa chỉ xấp xỉ kích thước ảnh kết quả.
+
+        :param pad: Ảnh hẹp hơn được căn giữa trên nền trắng thay vì co giãn theo chiều rộng
         """
         try:
             result_files = []
@@ -27,51 +151,52 @@ class ImageProcessor:
             total_images = len(self.image_files)
             num_groups = (total_images + images_per_group - 1) // images_per_group
             
-            # Mở và đọc tất cả ảnh trong nhóm
             for group_idx in range(num_groups):
                 start_idx = group_idx * images_per_group
                 end_idx = min(start_idx + images_per_group, total_images)
                 group_images = self.image_files[start_idx:end_idx]
                 
-                # Đọc và xử lý các ảnh trong nhóm
-                image_parts = []
-                max_width = 0
-                total_height = 0
-                
+                # Chỉ đọc header để lấy kích thước, chưa giải mã dữ liệu ảnh
+                sizes = []
                 for img_file in group_images:
-                    with Image.open(os.path.join(self.folder_path, img_file)) as img:
-                        if img.mode == 'RGBA':
-                            img = img.convert('RGB')
-                        image_parts.append(img.copy())
-                        max_width = max(max_width, img.width)
-                        total_height += img.height
+                    with self._open(img_file) as img:
+                        sizes.append(img.size)
+                max_width = max(width for width, height in sizes)
+                total_height = sum(height for width, height in sizes)
                 
                 # Tạo ảnh mới
-                result = Image.new('RGB', (max_width, total_height))
+                result = Image.new('RGB', (max_width, total_height), (255, 255, 255))
                 
-                # Ghép các phần ảnh
+                # Giải mã và ghép lần lượt từng phần ảnh
                 y_offset = 0
-                for img in image_parts:
-                    # Đảm bảo ảnh có cùng chiều rộng
-                    if img.width != max_width:
-                        img = img.resize((max_width, img.height), Image.Resampling.LANCZOS)
-                    
-                    # Ghép ảnh vào kết quả
-                    result.paste(img, (0, y_offset))
-                    y_offset += img.height
+                for img_file in group_images:
+                    with self._open(img_file) as img:
+                        part = img if img.mode == 'RGB' else img.convert('RGB')
+                        x_offset = 0
+                        if part.width != max_width:
+                            if pad:
+                                x_offset = (max_width - part.width) // 2
+                            else:
+                                # Đảm bảo ảnh có cùng chiều rộng
+                                part = part.resize((max_width, part.height), Image.Resampling.LANCZOS)
+                        
+                        # Ghép ảnh vào kết quả
+                        result.paste(part, (x_offset, y_offset))
+                        y_offset += part.height
+                        if part is not img:
+                            part.close()
                 
                 # Lưu ảnh ghép
                 output_path = os.path.join(self.folder_path, f"{self.folder_name}_group_{group_idx + 1}.jpg")
-                result.save(output_path, quality=95)
+                save_image(result, output_path, 'JPEG', self.profile, self.target_bytes)
                 result_files.append(output_path)
                 
                 # Giải phóng bộ nhớ
-                for img in image_parts:
-                    img.close()
+                result.close()
 
             # Xóa các ảnh gốc
             for img_file in self.image_files:
-                os.remove(os.path.join(self.folder_path, img_file))
+                self._remove_source(img_file)
 
             print(f"Đã ghép thành công thành {num_groups} ảnh")
             return result_files
@@ -79,50 +204,69 @@ class ImageProcessor:
         except Exception as e:
             raise Exception(f"Lỗi khi ghép ảnh: {str(e)}")
 
-    def split_images(self, min_height):
+    def split_images(self, min_height, max_workers=None, snap=True):
         """
         Cắt ảnh thành nhiều phần dựa trên chiều cao tối thiểu
+
+        Khi có nhiều ảnh, mỗi ảnh được cắt trên một process riêng. Khi có ít ảnh hơn
+        số process, ảnh được giải mã một lần rồi các phần được encode song song.
+
         :param min_height: Chiều cao tối thiểu cho mỗi phần (pixel)
+        :param max_workers: Số process (None dùng pool chung của ứng dụng, 1 chạy tuần tự)
+        :param snap: Dời điểm cắt tới khoảng trống giữa các khung để không cắt ngang bong bóng thoại
         :return: Danh sách đường dẫn các file đã cắt
         """
         try:
+            workers = max_workers or IMAGE_WORKERS
+            if workers <= 1 or len(self.image_files) >= workers:
+                # Chia theo file: mỗi process giải mã và cắt một ảnh
+                file_results = run_in_pool(
+                    split_file,
+                    [(self.images[f], self.folder_path, min_height, self.profile, self.target_bytes, snap)
+                     for f in self.image_files],
+                    max_workers=max_workers
+                )
+            else:
+                # Ít ảnh nhưng rất cao: chia theo phần để tận dụng hết các core
+                file_results = [self._split_parallel(f, min_height, max_workers, snap) for f in self.image_files]
+
             result_files = []
-            
-            # Xử lý từng ảnh trong thư mục
-            for input_image in self.image_files:
-                base_name = os.path.splitext(input_image)[0]
-                
-                with Image.open(os.path.join(self.folder_path, input_image)) as img:
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-
-                    width, height = img.size
-                    
-                    # Tính số phần cần cắt dựa trên chiều cao tối thiểu
-                    num_parts = math.ceil(height / min_height)
-                    part_height = height // num_parts  # Chiều cao thực tế của mỗi phần
-                    
-                    # Cắt và lưu từng phần
-                    for i in range(num_parts):
-                        top = i * part_height
-                        # Phần cuối cùng sẽ lấy đến hết chiều cao của ảnh
-                        bottom = height if i == num_parts - 1 else (i + 1) * part_height
-                        part = img.crop((0, top, width, bottom))
-                        
-                        # Tạo tên file với số thứ tự
-                        output_path = os.path.join(self.folder_path, f"{base_name}_part_{i+1}.jpg")
-                        part.save(output_path, quality=95)
-                        result_files.append(output_path)
+            for input_image, parts in zip(self.image_files, file_results):
+                result_files.extend(parts)
 
                 # Xóa ảnh gốc sau khi đã cắt xong
-                os.remove(os.path.join(self.folder_path, input_image))
-                print(f"Đã cắt ảnh {input_image} thành {num_parts} phần")
+                self._remove_source(input_image)
+                print(f"Đã cắt ảnh {input_image} thành {len(parts)} phần")
 
             return result_files
 
         except Exception as e:
             raise Exception(f"Lỗi khi cắt ảnh: {str(e)}")
 
+    def _split_parallel(self, input_image, min_height, max_workers=None, snap=True):
+        """
+        Giải mã ảnh một lần, gửi dữ liệu từng phần sang các process để encode
+
+        Mỗi phần chỉ được cắt khi còn chỗ trong số tác vụ đang chạy (bằng số process),
+        nên bộ nhớ tạm thêm vào ảnh đã giải mã chỉ khoảng vài phần thay vì cả ảnh.
+        """
+        with self._open(input_image) as img:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            width, height = img.size
+            row_scores = row_variance(img) if snap else None
+
+            def tasks():
+                for i, (top, bottom) in enumerate(compute_cuts(height, min_height, row_scores)):
+                    part = img.crop((0, top, width, bottom))
+                    task = (part.mode, part.size, part.tobytes(), part_path(self.folder_path, input_image, i),
+                            self.profile, self.target_bytes)
+                    part.close()
+                    yield task
+
+            return stream_to_pool(encode_part, tasks(), max_workers=max_workers)
+
 
 def main():
     folder_path = input("Nhập folder: ").strip()
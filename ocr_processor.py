@@ -3,26 +3,82 @@ from PIL import Image
 import google.generativeai as genai
 from docx import Document
 import re
-import io
+from service.ocr_cache import file_digest, get_default_ocr_cache, make_key, text_digest
+from service.ocr_engine import parse_translations
+from service.ocr_payload import encode_payload, payload_params
+
+MODEL_NAME = 'gemini-2.5-pro-exp-03-25'
+
+# Tăng khi đổi prompt để không dùng lại kết quả cache của prompt cũ
+PROMPT_VERSION = 1
+
+# Phong cách dịch theo thể loại
+STYLE_GUIDES = {
+    'drama': 'tình cảm sâu lắng, cảm xúc',
+    'adult': 'người lớn, chín chắn nhưng tế nhị',
+    'romance': 'lãng mạn, ngọt ngào',
+    'comedy': 'hài hước, vui nhộn',
+    'bl': 'tình cảm nam nam tinh tế',
+    'wuxia': 'kiếm hiệp, võ thuật cổ trang',
+    'action': 'hành động, gay cấn'
+}
+
+# Tên ngôn ngữ đích theo mã
+LANG_GUIDES = {
+    'vi': 'tiếng Việt',
+    'en': 'tiếng Anh',
+    'ja': 'tiếng Nhật',
+    'ko': 'tiếng Hàn',
+    'zh': 'tiếng Trung'
+}
 
 class OCRProcessor:
     def __init__(self, api_key=None):
         # Cấu hình Gemini nếu có API key
         if api_key:
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-pro-exp-03-25')
+            self.model = genai.GenerativeModel(MODEL_NAME)
         else:
             self.model = None
+        # Cache kết quả OCR/dịch theo hash nội dung
+        self.cache = get_default_ocr_cache()
+        self.cache_hits = 0
+        # Tổng dung lượng ảnh đã gửi lên Gemini
+        self.bytes_sent = 0
+
+    def cached(self, key, compute):
+        """Lấy kết quả từ cache, nếu chưa có thì gọi compute() và lưu lại"""
+        if self.cache:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache_hits += 1
+                return value
+        value = compute()
+        if self.cache and value:
+            self.cache.put(key, value)
+        return value
+
+    def translation_key(self, text, target_lang, genre=None):
+        return make_key('ocr_processor_translate', text_digest(text), target_lang, genre, PROMPT_VERSION, MODEL_NAME)
 
     def process_image(self, image_path):
         """Xử lý OCR cho một ảnh với nhiều ngôn ngữ"""
+        try:
+            key = make_key('ocr_processor', file_digest(image_path), payload_params(), PROMPT_VERSION, MODEL_NAME)
+            return self.cached(key, lambda: self._process_image(image_path))
+        except Exception as e:
+            print(f"Lỗi khi xử lý OCR cho {image_path}: {str(e)}")
+            return ""
+
+    def _process_image(self, image_path):
         try:
             # Đọc ảnh
             with Image.open(image_path) as img:
-                # Chuyển ảnh sang bytes
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='PNG')
-                img_byte_arr = img_byte_arr.getvalue()
+                # Ảnh xám WebP/JPEG trong giới hạn dung lượng thay vì PNG kích thước gốc
+                img_byte_arr, mime_type, payload = encode_payload(img)
+                self.bytes_sent += payload['bytes']
+                print(f"Gửi {os.path.basename(image_path)}: {payload['bytes'] / 1024:.0f} KB "
+                      f"({payload['format']} {payload['width']}x{payload['height']}, quality {payload['quality']})")
                 
                 # Tạo prompt cho việc nhận dạng văn bản
                 prompt = """
@@ -50,7 +106,7 @@ class OCRProcessor:
                 # Gửi yêu cầu đến Gemini API
                 response = self.model.generate_content([
                     prompt,
-                    {"mime_type": "image/png", "data": img_byte_arr}
+                    {"mime_type": mime_type, "data": img_byte_arr}
                 ])
                 
                 return response.text.strip()
@@ -66,28 +122,10 @@ class OCRProcessor:
 
         try:
             # Xác định phong cách dựa trên thể loại
-            style_guide = ""
-            if genre:
-                style_guides = {
-                    'drama': 'tình cảm sâu lắng, cảm xúc',
-                    'adult': 'người lớn, chín chắn nhưng tế nhị',
-                    'romance': 'lãng mạn, ngọt ngào',
-                    'comedy': 'hài hước, vui nhộn',
-                    'bl': 'tình cảm nam nam tinh tế',
-                    'wuxia': 'kiếm hiệp, võ thuật cổ trang',
-                    'action': 'hành động, gay cấn'
-                }
-                style_guide = style_guides.get(genre, '')
+            style_guide = STYLE_GUIDES.get(genre, '') if genre else ''
 
             # Xác định ngôn ngữ đích
-            lang_guides = {
-                'vi': 'tiếng Việt',
-                'en': 'tiếng Anh',
-                'ja': 'tiếng Nhật',
-                'ko': 'tiếng Hàn',
-                'zh': 'tiếng Trung'
-            }
-            lang_guide = lang_guides.get(target_lang, 'tiếng Việt')
+            lang_guide = LANG_GUIDES.get(target_lang, 'tiếng Việt')
 
             prompt = f"""
             Đây là văn bản được trích xuất từ truyện tranh/manga:
@@ -101,13 +139,65 @@ class OCRProcessor:
             {f'5. Phong cách phù hợp với thể loại {style_guide}' if style_guide else ''}
             """
             
-            response = self.model.generate_content(prompt)
-            return response.text
+            key = self.translation_key(text, target_lang, genre)
+            return self.cached(key, lambda: self.model.generate_content(prompt).text)
             
         except Exception as e:
             print(f"Lỗi khi dịch văn bản: {str(e)}")
             return text
 
+    def translate_texts(self, text, target_langs, genre=None):
+        """
+        Dịch văn bản sang nhiều ngôn ngữ trong một request (phản hồi JSON theo mã ngôn ngữ),
+        ngôn ngữ nào không đọc được từ phản hồi thì dịch riêng bằng translate_text
+
+        :return: {mã ngôn ngữ: bản dịch}
+        """
+        target_langs = list(dict.fromkeys(target_langs))
+        if not self.model or not text or len(target_langs) < 2:
+            return {lang: self.translate_text(text, lang, genre) for lang in target_langs}
+
+        translations = {}
+        missing = []
+        for lang in target_langs:
+            value = self.cache.get(self.translation_key(text, lang, genre)) if self.cache else None
+            if value is not None:
+                self.cache_hits += 1
+                translations[lang] = value
+            else:
+                missing.append(lang)
+
+        if len(missing) > 1:
+            style_guide = STYLE_GUIDES.get(genre, '') if genre else ''
+            languages = ', '.join(f'"{lang}": {LANG_GUIDES.get(lang, "tiếng Việt")}' for lang in missing)
+            prompt = f"""
+            Đây là văn bản được trích xuất từ truyện tranh/manga:
+            {text}
+            
+            Hãy dịch và chỉnh sửa văn bản theo yêu cầu sau:
+            1. Dịch sang từng ngôn ngữ sau ({languages}) với văn phong tự nhiên, dễ đọc
+            2. Giữ nguyên ý nghĩa và cảm xúc của nguyên tác
+            3. Sửa lỗi chính tả và dấu câu
+            4. Định dạng văn bản cho dễ đọc
+            {f'5. Phong cách phù hợp với thể loại {style_guide}' if style_guide else ''}
+            
+            Chỉ trả về một đối tượng JSON, khóa là mã ngôn ngữ ({', '.join(missing)}), giá trị là bản dịch.
+            """
+            try:
+                batch = parse_translations(self.model.generate_content(prompt).text, missing)
+            except Exception as e:
+                print(f"Không đọc được bản dịch nhiều ngôn ngữ, dịch riêng từng ngôn ngữ: {str(e)}")
+                batch = {}
+            for lang, value in batch.items():
+                if self.cache:
+                    self.cache.put(self.translation_key(text, lang, genre), value)
+            translations.update(batch)
+            missing = [lang for lang in missing if lang not in batch]
+
+        for lang in missing:
+            translations[lang] = self.translate_text(text, lang, genre)
+        return translations
+
     def save_to_word(self, text, output_path):
         """Lưu văn bản vào file Word"""
         try:
@@ -156,12 +246,12 @@ def process_folder(folder_path, api_key=None, genre=None, target_langs=None):
             text = processor.process_image(img_path)
             
             if text:
-                # Dịch và lưu cho từng ngôn ngữ
+                # Dịch sang tất cả ngôn ngữ trong một request nếu có API key
+                translations = processor.translate_texts(text, target_langs, genre) if api_key else {}
+                
+                # Lưu cho từng ngôn ngữ
                 for lang in target_langs:
-                    # Dịch văn bản nếu có API key
-                    translated_text = text
-                    if api_key:
-                        translated_text = processor.translate_text(text, lang, genre)
+                    translated_text = translations.get(lang, text)
                     
                     # Tạo tên file Word theo định dạng số thứ tự
                     word_filename = f"{idx}_{lang}.docx"
@@ -174,6 +264,10 @@ def process_folder(folder_path, api_key=None, genre=None, target_langs=None):
         if not any(output_files.values()):
             raise Exception("Không thể trích xuất được văn bản từ các ảnh")
         
+        if processor.cache_hits:
+            print(f"Dùng lại {processor.cache_hits} kết quả OCR/dịch từ cache")
+        print(f"Tổng dung lượng ảnh đã gửi: {processor.bytes_sent / 1024:.0f} KB")
+        
         return output_files
         
     except Exception as e:
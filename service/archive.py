@@ -0,0 +1,253 @@
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 64 * 1024
+
+# Giới hạn của định dạng zip thường, vượt quá phải dùng Zip64
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_MAX_ENTRIES = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# Định dạng đã nén sẵn, nén thêm không giảm được dung lượng nên lưu nguyên
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip'}
+
+# Số thread nén deflate song song (zlib nhả GIL nên tận dụng được nhiều core)
+DEFLATE_WORKERS = int(os.environ.get('ARCHIVE_WORKERS', os.cpu_count() or 4))
+
+# File lớn hơn ngưỡng này được nén tuần tự theo từng đoạn thay vì nén trước vào bộ nhớ
+MAX_PRECOMPRESS_SIZE = 64 * 1024 * 1024
+
+
+def dos_datetime(timestamp):
+    """Chuyển timestamp sang định dạng ngày giờ DOS dùng trong file zip"""
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def choose_method(arcname):
+    """Chọn phương thức nén theo loại nội dung: lưu nguyên ảnh, nén deflate cho docx/json/text..."""
+    ext = os.path.splitext(arcname)[1].lower()
+    return ZIP_STORED if ext in STORED_EXTENSIONS else ZIP_DEFLATED
+
+
+def deflate_file(path, compresslevel=6):
+    """Nén deflate toàn bộ một file, trả về (dữ liệu đã nén, crc, kích thước gốc)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return compressed, zlib.crc32(data), len(data)
+
+
+class ZipStream:
+    """
+    Ghi file zip dạng stream: mỗi phương thức là generator trả về các đoạn bytes
+    để gửi thẳng cho client (chunked transfer) mà không cần seek hay file tạm.
+
+    Kích thước và CRC của từng entry được ghi trong data descriptor sau dữ liệu,
+    tự động chuyển sang Zip64 khi entry, offset hoặc số lượng entry vượt giới hạn zip thường.
+    """
+
+    def __init__(self, compresslevel=6):
+        self.compresslevel = compresslevel
+        self.offset = 0
+        self.entries = []
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def write_file(self, arcname, path, method=ZIP_STORED):
+        """Ghi một file trên đĩa vào archive"""
+        size = os.path.getsize(path)
+
+        def read_chunks():
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        yield from self._write_entry(arcname, read_chunks(), size, os.path.getmtime(path), method)
+
+    def write_bytes(self, arcname, data, method=ZIP_STORED, mtime=None):
+        """Ghi dữ liệu trong bộ nhớ vào archive"""
+        chunks = (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+        yield from self._write_entry(arcname, chunks, len(data), mtime or time.time(), method)
+
+    def write_compressed(self, arcname, compressed, crc, size, mtime=None):
+        """Ghi dữ liệu đã được nén deflate sẵn (ví dụ nén song song ở thread khác)"""
+        entry = self._start_entry(arcname, size, mtime or time.time(), ZIP_DEFLATED)
+        yield self._emit(entry.pop('header'))
+        if compressed:
+            yield self._emit(compressed)
+        yield self._finish_entry(entry, crc, len(compressed), size)
+
+    def _start_entry(self, arcname, size, mtime, method):
+        name = arcname.replace(os.sep, '/').encode('utf-8')
+        header_offset = self.offset
+        # Dữ liệu nén có thể lớn hơn dữ liệu gốc một chút nên chừa khoảng dư
+        zip64 = size >= ZIP32_LIMIT - (1 << 20) or header_offset >= ZIP32_LIMIT
+        version = 45 if zip64 else 20
+        flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        dos_time, dos_date = dos_datetime(mtime)
+
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            size_field = ZIP32_LIMIT
+        else:
+            extra = b''
+            size_field = 0
+
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, flags, method, dos_time, dos_date,
+            0, size_field, size_field, len(name), len(extra)
+        ) + name + extra
+
+        return {
+            'header': header,
+            'name': name,
+            'method': method,
+            'flags': flags,
+            'version': version,
+            'zip64': zip64,
+            'dos_time': dos_time,
+            'dos_date': dos_date,
+            'offset': header_offset
+        }
+
+    def _finish_entry(self, entry, crc, compressed_size, size):
+        if entry.pop('zip64'):
+            descriptor = struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size)
+        else:
+            descriptor = struct.pack('<IIII', 0x08074b50, crc, compressed_size, size)
+
+        entry.update({'crc': crc, 'compressed_size': compressed_size, 'size': size})
+        self.entries.append(entry)
+        return self._emit(descriptor)
+
+    def _write_entry(self, arcname, chunks, size, mtime, method):
+        entry = self._start_entry(arcname, size, mtime, method)
+        yield self._emit(entry.pop('header'))
+
+        crc = 0
+        raw_size = 0
+        compressed_size = 0
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            raw_size += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                compressed_size += len(chunk)
+                yield self._emit(chunk)
+
+        if compressor:
+            tail = compressor.flush()
+            compressed_size += len(tail)
+            if tail:
+                yield self._emit(tail)
+
+        yield self._finish_entry(entry, crc, compressed_size, raw_size)
+
+    def close(self):
+        """Ghi central directory và kết thúc archive"""
+        cd_offset = self.offset
+
+        for entry in self.entries:
+            zip64_fields = []
+            size = entry['size']
+            compressed_size = entry['compressed_size']
+            offset = entry['offset']
+            if size >= ZIP32_LIMIT:
+                zip64_fields.append(size)
+                size = ZIP32_LIMIT
+            if compressed_size >= ZIP32_LIMIT:
+                zip64_fields.append(compressed_size)
+                compressed_size = ZIP32_LIMIT
+            if offset >= ZIP32_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP32_LIMIT
+
+            extra = b''
+            if zip64_fields:
+                extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+
+            version = 45 if zip64_fields else entry['version']
+            yield self._emit(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+                entry['flags'], entry['method'], entry['dos_time'], entry['dos_date'],
+                entry['crc'], compressed_size, size, len(entry['name']), len(extra),
+                0, 0, 0, 0o644 << 16, offset
+            ) + entry['name'] + extra)
+
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+
+        if count >= ZIP32_MAX_ENTRIES or cd_offset >= ZIP32_LIMIT or cd_size >= ZIP32_LIMIT:
+            eocd64_offset = self.offset
+            yield self._emit(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0,
+                count, count, cd_size, cd_offset
+            ))
+            yield self._emit(struct.pack('<IIQI', 0x07064b50, 0, eocd64_offset, 1))
+
+        yield self._emit(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0,
+            min(count, ZIP32_MAX_ENTRIES), min(count, ZIP32_MAX_ENTRIES),
+            min(cd_size, ZIP32_LIMIT), min(cd_offset, ZIP32_LIMIT), 0
+        ))
+
+
+def stream_zip(entries, max_workers=DEFLATE_WORKERS):
+    """
+    Generator tạo file zip từ danh sách (arcname, đường dẫn file)
+
+    Các entry được đọc và gửi lần lượt, không tạo file zip trên đĩa.
+    Ảnh đã nén (JPEG/PNG/WebP) được lưu nguyên; các file còn lại được nén
+    deflate trước trên nhiều thread trong một cửa sổ giới hạn, rồi ghi ra đúng thứ tự.
+    """
+    archive = ZipStream()
+    window = max(1, max_workers) * 2
+    entries = iter(entries)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        def fill():
+            while len(pending) < window:
+                entry = next(entries, None)
+                if entry is None:
+                    return
+                arcname, path = entry
+                method = choose_method(arcname)
+                future = None
+                if method == ZIP_DEFLATED and os.path.getsize(path) <= MAX_PRECOMPRESS_SIZE:
+                    future = executor.submit(deflate_file, path, archive.compresslevel)
+                pending.append((arcname, path, method, future))
+
+        fill()
+        while pending:
+            arcname, path, method, future = pending.popleft()
+            fill()
+            if future:
+                compressed, crc, size = future.result()
+                yield from archive.write_compressed(arcname, compressed, crc, size, os.path.getmtime(path))
+            else:
+                yield from archive.write_file(arcname, path, method)
+
+    yield from archive.close()
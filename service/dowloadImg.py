@@ -1,7 +1,10 @@
 import os
-import shutil
-import zipfile
-from flask import current_app, jsonify, request
+import hashlib
+import json
+import queue
+import threading
+from contextlib import nullcontext
+from flask import Response, current_app, jsonify, request
 import requests
 from urllib.parse import urlparse, urljoin
 from PIL import Image
@@ -10,6 +13,18 @@ import time
 import random
 from bs4 import BeautifulSoup
 from .image_downloader import ImageDownloader
+from .image_downloader.formats import transcode_file
+from .image_downloader.series import MAX_SERIES_CHAPTERS, download_series, expand_chapter_range
+from .workspace import Workspace, WORKSPACE_PREFIX
+from .archive import ZIP_DEFLATED, ZipStream, choose_method
+from .jobs import JobError, is_async_request, job_accepted
+from .encoder_profiles import resolve_profile
+from .workers import get_process_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa được giữa các thread trong cùng process
+    fcntl = None
 
 def is_valid_image_url(url):
     """Kiểm tra URL có phải là ảnh hợp lệ không"""
@@ -187,51 +202,385 @@ def crawl_images(url):
         print(f"Error crawling images: {str(e)}")
         return []
 
+_chapter_locks = {}
+_chapter_locks_lock = threading.Lock()
+
+def chapter_dir(root, base_url, target_format=None, profile=None):
+    """
+    Thư mục cố định của chapter (theo URL) để lần tải sau tải tiếp thay vì tải lại từ đầu
+
+    Định dạng đích và profile là một phần của khóa: ảnh gốc và ảnh đã chuyển định dạng
+    nằm ở các thư mục khác nhau nên request sau không nhận nhầm ảnh của request trước.
+    """
+    key_source = '\n'.join([base_url, target_format or '', (profile or '') if target_format else ''])
+    key = hashlib.sha1(key_source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(root, f'{WORKSPACE_PREFIX}chapter_{key}')
+
+class ChapterLock:
+    """
+    Khóa chapter để hai request cùng URL không ghi đè file của nhau
+
+    Khóa cả giữa các thread (threading.Lock) lẫn giữa các process khi chạy nhiều
+    worker (flock trên file .lock trong thư mục chapter).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with _chapter_locks_lock:
+            self.thread_lock = _chapter_locks.setdefault(path, threading.Lock())
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.file = open(os.path.join(self.path, '.lock'), 'a')
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+        except Exception:
+            if self.file:
+                self.file.close()
+                self.file = None
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        finally:
+            self.file = None
+            self.thread_lock.release()
+        return False
+
+def get_chapter_lock(path):
+    """Khóa của thư mục chapter (thư mục phải tồn tại)"""
+    return ChapterLock(path)
+
+def parse_chapter_urls(data):
+    """
+    Danh sách chapter của chế độ tải nhiều chapter: `chapters` (danh sách URL) hoặc
+    `chapter_template` (URL có {n}) cùng `chapter_from`, `chapter_to`; None nếu chỉ tải một chapter
+
+    :raise ValueError: Tham số không hợp lệ
+    """
+    if data.get('chapters'):
+        chapters = data['chapters']
+        if isinstance(chapters, str):
+            chapters = chapters.split()
+        chapters = [url.strip() for url in chapters if url and url.strip()]
+        if len(chapters) > MAX_SERIES_CHAPTERS:
+            raise ValueError(f'Chỉ tải được tối đa {MAX_SERIES_CHAPTERS} chapter mỗi lần')
+        return list(dict.fromkeys(chapters))
+    if data.get('chapter_template'):
+        try:
+            start = int(data.get('chapter_from', 1))
+            end = int(data.get('chapter_to', start))
+        except (TypeError, ValueError):
+            raise ValueError('Số chapter không hợp lệ')
+        return expand_chapter_range(data['chapter_template'], start, end)
+    return None
+
+def parse_format_options(data):
+    """
+    Định dạng để chuyển ảnh ngay khi tải xong (để trống giữ nguyên định dạng gốc) và profile encode
+
+    :raise ValueError: Định dạng hoặc profile không hợp lệ
+    """
+    target_format = (data.get('target_format') or '').upper() or None
+    if target_format and target_format not in ('JPEG', 'WEBP', 'PNG'):
+        raise ValueError(f'Định dạng không hợp lệ: {target_format}')
+    return target_format, resolve_profile(data.get('profile'))
+
 def download_selected_images():
     try:
         # Lấy URL trang web
         base_url = request.json.get('base_url', '')
         print(f"Received base URL: {base_url}")  # Debug log
         
-        if not base_url:
+        # Chế độ tải nhiều chapter
+        try:
+            chapter_urls = parse_chapter_urls(request.json)
+        except ValueError as e:
+            return jsonify({'error': str(e)})
+        
+        if not base_url and not chapter_urls:
             return jsonify({'error': 'Vui lòng nhập URL trang web'})
         
-        # Tạo thư mục tạm thời
-        temp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_download')
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
+        try:
+            target_format, profile = parse_format_options(request.json)
+        except ValueError as e:
+            return jsonify({'error': str(e)})
+        # Tải tiếp từ lần tải trước của cùng URL (client chủ động bật bằng "resume": true)
+        resume = request.json.get('resume', False) in (True, 1, '1', 'true')
+        
+        # Tạo thư mục làm việc riêng cho request
+        workspace = Workspace(current_app.config['UPLOAD_FOLDER'], 'download')
+        try:
+            # Chạy nền nếu client yêu cầu, job sẽ tự dọn workspace
+            if chapter_urls:
+                func, kind, target = run_series_download, 'download_series', chapter_urls
+            else:
+                func, kind, target = run_download, 'download', base_url
+            if is_async_request():
+                job_manager = current_app.extensions['job_manager']
+                job = job_manager.submit_with_workspace(kind, workspace, func, target,
+                                                        target_format, profile, resume)
+                workspace = None
+                return job_accepted(job)
+            
+            # Trả về kết quả
+            return jsonify(func(workspace, target, target_format, profile, resume))
+        except JobError as e:
+            return jsonify({'error': str(e)})
+        finally:
+            # Xóa thư mục tạm
+            if workspace:
+                workspace.cleanup()
         
+    except Exception as e:
+        print(f"General error in download_selected_images: {str(e)}")  # Debug log
+        return jsonify({'error': str(e)})
+
+def chapter_output(workspace, base_url, name, resume, target_format=None, profile=None):
+    """Thư mục lưu ảnh của chapter và lock tương ứng (thư mục cố định theo URL và định dạng khi bật resume)"""
+    if resume:
+        temp_dir = chapter_dir(workspace.root, base_url, target_format, profile)
+        os.makedirs(temp_dir, exist_ok=True)
+        # Gia hạn thời gian giữ lại thư mục chapter
+        os.utime(temp_dir)
+        return temp_dir, get_chapter_lock(temp_dir)
+    return workspace.subdir(name), nullcontext()
+
+def chapter_entries(workspace, output_dir, files, name, resume):
+    """
+    Các entry (tên file, đường dẫn) để publish kết quả của chapter, gọi khi còn giữ lock của chapter
+
+    Khi bật resume, thư mục chapter dùng chung giữa các request (request sau có thể chuyển
+    định dạng và xóa ảnh gốc), nên ảnh được hard link vào workspace của request này trước khi publish.
+    """
+    files = files + ['info.json']
+    if resume:
+        return workspace.snapshot(name, output_dir, files, copy=('info.json',))
+    return [(file, os.path.join(output_dir, file)) for file in files]
+
+def run_download(workspace, base_url, target_format=None, profile=None, resume=False, progress=None):
+    """
+    Tải chapter và tạo file zip kết quả
+
+    Khi bật resume, ảnh được lưu trong thư mục cố định theo URL (info.json làm manifest)
+    nên lần chạy lại chỉ tải các ảnh còn thiếu hoặc bị lỗi.
+    """
+    temp_dir, lock = chapter_output(workspace, base_url, 'images', resume, target_format, profile)
+    
+    with lock:
         # Khởi tạo downloader và tải ảnh
-        downloader = ImageDownloader()
-        success, result = downloader.download_chapter(base_url, temp_dir)
+        downloader = ImageDownloader(transcode=target_format, profile=profile, resume=resume)
+        success, result = downloader.download_chapter(base_url, temp_dir, progress_callback=progress)
         
         if not success:
-            return jsonify({'error': result})
-        
-        # Tạo file zip chứa kết quả
-        zip_filename = 'downloaded_images.zip'
-        zip_path = os.path.join(current_app.config['UPLOAD_FOLDER'], zip_filename)
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
-        
-        # Xóa thư mục tạm
-        shutil.rmtree(temp_dir)
-        
-        # Add output_files to the result
-        result_with_files = result.copy() if isinstance(result, dict) else {}
-        result_with_files.update({
-            'message': f'Đã tải xuống {result.get("success_count", 0)} ảnh!',
-            'output_files': [zip_filename]  # Add this line
-        })
+            raise JobError(result)
         
-        # Trả về kết quả
-        return jsonify(result_with_files)
+        # Đăng ký kết quả (không gồm file .part còn dở), file zip được stream khi tải xuống
+        entries = chapter_entries(workspace, temp_dir, result.pop('files'), 'images', resume)
+        zip_filename = workspace.publish('downloaded_images.zip', entries=entries)
+    
+    # Add output_files to the result
+    result_with_files = result.copy() if isinstance(result, dict) else {}
+    result_with_files.update({
+        'message': f'Đã tải xuống {result.get("success_count", 0)} ảnh!',
+        'output_files': [zip_filename]
+    })
+    return result_with_files
+
+def run_series_download(workspace, chapter_urls, target_format=None, profile=None, resume=False, progress=None):
+    """
+    Tải nhiều chapter theo dây chuyền (crawl chapter sau trong lúc tải ảnh chapter trước)
+    và tạo một file zip, mỗi chapter nằm trong thư mục chapter_<số thứ tự>
+    """
+    downloader = ImageDownloader(transcode=target_format, profile=profile, resume=resume)
+    entries = []
+    
+    def output_for(number, url):
+        return chapter_output(workspace, url, f'chapter_{number:03d}', resume, target_format, profile)
+    
+    def on_downloaded(chapter):
+        # Chạy khi còn giữ lock của chapter: tách file khỏi thư mục chapter dùng chung
+        if chapter['success']:
+            folder = f"chapter_{chapter['number']:03d}"
+            chapter['entries'] = chapter_entries(workspace, chapter['output_dir'], chapter['result'].pop('files'),
+                                                 folder, resume)
+    
+    def on_chapter(chapter):
+        # Đăng ký các file của chapter vào archive ngay khi chapter tải xong
+        if not chapter['success']:
+            return
+        folder = f"chapter_{chapter['number']:03d}"
+        for name, path in chapter.pop('entries'):
+            entries.append((f'{folder}/{name}', path))
+    
+    chapters = download_series(downloader, chapter_urls, output_for, progress, on_chapter, on_downloaded)
+    if not entries:
+        raise JobError('Không tải được chapter nào')
+    
+    summary = []
+    for chapter in chapters:
+        item = {'number': chapter['number'], 'url': chapter['url'], 'success': chapter['success']}
+        if chapter['success']:
+            result = chapter['result']
+            item.update(success_count=result['success_count'], failed_count=result['failed_count'])
+        else:
+            item['error'] = chapter['error']
+        summary.append(item)
+    
+    summary_path = os.path.join(workspace.path, 'series.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({'chapters': summary}, f, ensure_ascii=False, indent=2)
+    entries.sort(key=lambda entry: entry[0])
+    entries.append(('series.json', summary_path))
+    zip_filename = workspace.publish('downloaded_series.zip', entries=entries)
+    
+    success_count = sum(1 for chapter in chapters if chapter['success'])
+    return {
+        'message': f'Đã tải xuống {success_count}/{len(chapters)} chapter!',
+        'success_count': success_count,
+        'failed_count': len(chapters) - success_count,
+        'chapters': summary,
+        'output_files': [zip_filename]
+    }
+
+def stream_selected_images():
+    """
+    Tải chapter và stream file zip ngay trong lúc tải (POST base_url, target_format, profile)
+
+    Ảnh nào tải xong trước được ghi vào archive trước; tên entry theo số thứ tự
+    (image_001.jpg, ...) nên thứ tự trang không phụ thuộc thứ tự tải xong.
+    """
+    data = request.get_json(silent=True) or request.form
+    base_url = data.get('base_url', '')
+    if not base_url:
+        return jsonify({'error': 'Vui lòng nhập URL trang web'})
+    try:
+        target_format, profile = parse_format_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)})
+    
+    downloader = ImageDownloader()
+    image_urls = downloader.crawl_images(base_url)
+    if not image_urls:
+        return jsonify({'error': 'Không tìm thấy ảnh nào trong trang web'})
+    
+    return Response(
+        stream_chapter(current_app.config['UPLOAD_FOLDER'], downloader, base_url, image_urls, target_format, profile),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="downloaded_images.zip"'}
+    )
+
+def stream_chapter(upload_folder, downloader, base_url, image_urls, target_format=None, profile=None):
+    """
+    Generator tạo file zip của chapter trong lúc ảnh đang tải
+
+    Workspace và thread tải chỉ được tạo khi generator bắt đầu chạy. Ảnh cần đổi định dạng
+    được gửi sang process pool ngay khi tải xong; ảnh được xóa ngay sau khi ghi vào archive,
+    nên trên đĩa chỉ còn các ảnh đang chờ ghi. Khi client ngắt kết nối, các ảnh chưa tải bị hủy
+    và workspace được dọn khi cả việc tải và việc stream đều kết thúc.
+    """
+    workspace = Workspace(upload_folder, 'stream')
+    completed = queue.Queue()
+    outcome = {}
+    users = [2]
+    users_lock = threading.Lock()
+    
+    def release():
+        with users_lock:
+            users[0] -= 1
+            if users[0] == 0:
+                workspace.cleanup()
+    
+    def on_image(image):
+        # Chuyển định dạng trên process pool dùng chung trong khi các ảnh khác vẫn đang tải
+        future = None
+        if target_format and image['format'] != target_format:
+            pool = get_process_pool()
+            if pool:
+                try:
+                    future = pool.submit(transcode_file, image['path'], target_format, profile)
+                except RuntimeError as e:  # Pool đã hỏng hoặc đã đóng
+                    print(f"Không thể gửi {image['path']} sang process pool: {str(e)}")
+        completed.put((image, future))
+    
+    def download():
+        try:
+            outcome['failed_urls'] = downloader.download_images_parallel(
+                image_urls, workspace.path, on_image=on_image
+            )[1]
+        except Exception as e:
+            print(f"Lỗi khi tải chapter {base_url}: {str(e)}")
+            outcome['error'] = str(e)
+        finally:
+            completed.put(None)
+            release()
+    
+    threading.Thread(target=download, daemon=True).start()
+    
+    archive = ZipStream()
+    images = []
+    try:
+        while True:
+            item = completed.get()
+            if item is None:
+                break
+            image, future = item
+            path = image.pop('path')
+            if target_format and image['format'] != target_format:
+                try:
+                    path, size = wait_transcode(path, future, target_format, profile)
+                    image.update(format=target_format, size=size)
+                    image.pop('sha256', None)
+                except Exception as e:
+                    print(f"Không thể chuyển định dạng {path}: {str(e)}")
+            image['file'] = os.path.basename(path)
+            yield from archive.write_file(image['file'], path, choose_method(image['file']))
+            os.remove(path)
+            images.append(image)
         
+        images.sort(key=lambda image: image['index'])
+        failed_urls = outcome.get('failed_urls', [])
+        info = {
+            'total_images': len(image_urls),
+            'downloaded_count': len(images),
+            'failed_count': len(image_urls) - len(images),
+            'failed_urls': failed_urls,
+            'images': images,
+            'source_url': base_url,
+            'download_time': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if 'error' in outcome:
+            info['error'] = outcome['error']
+        data = json.dumps(info, ensure_ascii=False, indent=2).encode('utf-8')
+        yield from archive.write_bytes('info.json', data, ZIP_DEFLATED)
+        yield from archive.close()
+    finally:
+        # Client ngắt kết nối (GeneratorExit) hoặc lỗi: dừng tải và bỏ các ảnh đang chờ chuyển định dạng
+        downloader.cancel()
+        while True:
+            try:
+                item = completed.get_nowait()
+            except queue.Empty:
+                break
+            if item and item[1]:
+                item[1].cancel()
+        release()
+
+def wait_transcode(path, future, target_format, profile=None):
+    """Lấy kết quả chuyển định dạng từ process pool, chuyển trong process hiện tại nếu không có pool hoặc pool lỗi"""
+    if future is None:
+        return transcode_file(path, target_format, profile)
+    try:
+        return future.result()
     except Exception as e:
-        print(f"General error in download_selected_images: {str(e)}")  # Debug log
-        return jsonify({'error': str(e)})
\ No newline at end of file
+        if not os.path.exists(path):
+            raise
+        print(f"Lỗi process pool khi chuyển {path}: {str(e)}")
+        return transcode_file(path, target_format, profile)
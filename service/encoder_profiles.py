@@ -0,0 +1,126 @@
+import io
+import os
+from PIL import Image
+
+# Các profile encode: đổi CPU lấy dung lượng một cách tường minh
+#   fast     - encode nhanh nhất, file lớn hơn
+#   balanced - cân bằng tốc độ và dung lượng
+#   small    - file nhỏ nhất, tốn CPU nhất
+#   quality  - chất lượng cao (giữ nguyên thiết lập cũ của các công cụ)
+PROFILES = {
+    'fast': {
+        'WEBP': {'quality': 85, 'method': 2},
+        'JPEG': {'quality': 85},
+        'PNG': {'compress_level': 1}
+    },
+    'balanced': {
+        'WEBP': {'quality': 90, 'method': 4},
+        'JPEG': {'quality': 90, 'optimize': True},
+        'PNG': {'compress_level': 6}
+    },
+    'small': {
+        'WEBP': {'quality': 80, 'method': 6},
+        'JPEG': {'quality': 80, 'optimize': True, 'progressive': True},
+        'PNG': {'optimize': True}
+    },
+    'quality': {
+        # Giống hệt route /execute/changeImage cũ (WebP method mặc định 4 của Pillow).
+        # Công cụ dòng lệnh changeImage.py trước đây dùng method 6: nay encode WebP nhanh hơn,
+        # file lớn hơn một chút; cần file nhỏ nhất thì dùng profile small
+        'WEBP': {'quality': 90, 'method': 4},
+        'JPEG': {'quality': 95},
+        'PNG': {}
+    }
+}
+
+DEFAULT_PROFILE = os.environ.get('ENCODER_PROFILE', 'quality')
+
+# Các định dạng có tham số quality để tìm theo dung lượng mục tiêu
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+MIN_QUALITY = 30
+
+
+def resolve_profile(name=None):
+    """Kiểm tra tên profile, trả về profile mặc định nếu không truyền"""
+    name = (name or DEFAULT_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError(f"Profile encode không hợp lệ: {name} (hỗ trợ: {', '.join(PROFILES)})")
+    return name
+
+
+def get_save_options(target_format, profile=None):
+    """Lấy tham số Image.save cho định dạng và profile"""
+    return dict(PROFILES[resolve_profile(profile)].get(target_format.upper(), {}))
+
+
+def prepare_for_format(img, target_format):
+    """Chuyển mode ảnh cho phù hợp định dạng đích (JPEG không có kênh alpha)"""
+    if target_format.upper() == 'JPEG':
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            return background
+        # JPEG hỗ trợ ảnh xám (L), giữ nguyên để file nhỏ hơn
+        if img.mode not in ('RGB', 'L'):
+            return img.convert('RGB')
+    return img
+
+
+def _encode(img, target_format, options):
+    buffer = io.BytesIO()
+    img.save(buffer, target_format, **options)
+    return buffer.getvalue()
+
+
+def encode_image(img, target_format, profile=None, target_bytes=None, min_quality=MIN_QUALITY):
+    """
+    Encode ảnh theo profile, có thể tìm quality để đạt dung lượng mục tiêu
+
+    Args:
+        img: Ảnh PIL
+        target_format: 'JPEG', 'WEBP' hoặc 'PNG'
+        profile: Tên profile (fast, balanced, small, quality)
+        target_bytes: Dung lượng tối đa mong muốn cho mỗi ảnh (chỉ áp dụng cho JPEG/WebP)
+        min_quality: Quality thấp nhất được thử khi tìm theo dung lượng
+
+    Returns:
+        (dữ liệu đã encode, quality đã dùng hoặc None)
+    """
+    target_format = target_format.upper()
+    options = get_save_options(target_format, profile)
+    img = prepare_for_format(img, target_format)
+
+    if not target_bytes or target_format not in LOSSY_FORMATS:
+        return _encode(img, target_format, options), options.get('quality')
+
+    # Thử quality của profile trước, đa số ảnh đã đạt mục tiêu
+    max_quality = options.get('quality', 90)
+    data = _encode(img, target_format, options)
+    if len(data) <= target_bytes:
+        return data, max_quality
+
+    # Tìm nhị phân quality cao nhất mà vẫn không vượt quá dung lượng mục tiêu
+    best = None
+    low, high = min_quality, max_quality - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _encode(img, target_format, dict(options, quality=quality))
+        if len(candidate) <= target_bytes:
+            best = (candidate, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if best is None:
+        # Không đạt được mục tiêu, dùng quality thấp nhất cho phép
+        return _encode(img, target_format, dict(options, quality=min_quality)), min_quality
+    return best
+
+
+def save_image(img, output_path, target_format, profile=None, target_bytes=None):
+    """Encode và ghi ảnh ra file, trả về (kích thước file, quality đã dùng)"""
+    data, quality = encode_image(img, target_format, profile, target_bytes)
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return len(data), quality
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from google import genai
+
+# Thời gian giữ client của một API key không được dùng tới trước khi bỏ (giây)
+CLIENT_TTL = int(os.environ.get('GENAI_CLIENT_TTL', 600))
+
+
+class ClientPool:
+    """
+    Giữ genai.Client theo API key để dùng lại kết nối HTTP (keep-alive, TLS) giữa
+    các request và thread thay vì tạo client mới cho mỗi file.
+
+    Client không được dùng quá `ttl` giây bị bỏ khỏi pool (request đang dùng vẫn
+    giữ tham chiếu tới nó cho tới khi xong).
+    """
+
+    def __init__(self, ttl=CLIENT_TTL):
+        self.ttl = ttl
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, api_key):
+        key = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            entry = self.clients.get(key)
+            if entry is None:
+                entry = self.clients[key] = {'client': genai.Client(api_key=api_key), 'used': now}
+            entry['used'] = now
+            return entry['client']
+
+    def _evict(self, now):
+        for key, entry in list(self.clients.items()):
+            if now - entry['used'] > self.ttl:
+                del self.clients[key]
+
+
+_pool = ClientPool()
+
+
+def get_client(api_key):
+    """Lấy client dùng chung cho API key"""
+    return _pool.get(api_key)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Event loop chạy nền dùng chung cho các request Gemini bất đồng bộ (client.aio).
+
+    Mọi request async đều chạy trên cùng một loop nên kết nối của client.aio
+    được dùng lại giữa các thread và các request.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True, name='genai-aio').start()
+        return _loop
+
+
+def run_async(coro):
+    """Chạy coroutine trên event loop chung và chờ kết quả (gọi từ thread thường)"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
@@ -1,4 +1,4 @@
 from .downloader import ImageDownloader
-from .sources import SourceConfig
+from .sources import Source, SourceConfig, register_source
 
-__all__ = ['ImageDownloader', 'SourceConfig'] 
\ No newline at end of file
+__all__ = ['ImageDownloader', 'Source', 'SourceConfig', 'register_source'] 
\ No newline at end of file
@@ -0,0 +1,249 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlparse
+import httpx
+from ..ratelimit import backoff_delay, get_host_policy, parse_retry_after
+from .formats import verify_image
+from .partial import CHUNK_SIZE, PartialFile
+
+# Số request đồng thời tối đa của cả chapter (giới hạn theo host nằm trong HostPolicy)
+MAX_IN_FLIGHT = int(os.environ.get('DOWNLOAD_CONCURRENCY', 128))
+
+# Mã lỗi cho biết host đang chặn hoặc quá tải, nên giảm tốc độ và thử lại
+THROTTLE_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class AsyncDownloadEngine:
+    """
+    Tải nhiều ảnh trên một thread bằng asyncio + httpx.
+
+    Hàng trăm request có thể chờ cùng lúc mà không chiếm thread. Mỗi host có
+    token bucket và giới hạn kết nối AIMD riêng (service.ratelimit): host nhanh chạy
+    hết tốc độ, chỉ host trả về 403/429/5xx hoặc chậm đi mới bị giảm, Retry-After
+    được tôn trọng. Thời gian chờ không chặn các request khác.
+    """
+
+    def __init__(self, get_headers, verify=False, resume=False, cache=None, max_in_flight=MAX_IN_FLIGHT,
+                 max_retries=3, timeout=10, transport=None, cancelled=None):
+        """
+        :param get_headers: Hàm get_headers(url) trả về headers cho request
+        :param verify: Kiểm tra đầy đủ từng ảnh bằng PIL sau khi tải (mặc định chỉ kiểm tra magic bytes)
+        :param resume: Giữ file .part khi lỗi và tải tiếp bằng HTTP Range
+        :param cache: HttpCache để kiểm tra lại bản lưu bằng request có điều kiện (None để tắt)
+        :param transport: httpx transport thay cho kết nối mạng thật (ví dụ httpx.MockTransport khi test)
+        :param cancelled: threading.Event, khi được set thì các ảnh chưa gửi request sẽ không được tải
+        """
+        self.get_headers = get_headers
+        self.verify = verify
+        self.resume = resume
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.transport = transport
+        self.cancelled = cancelled
+
+    def download_all(self, tasks, progress_callback=None, on_complete=None):
+        """
+        Tải danh sách (url, save_path, index), chạy event loop riêng cho tới khi xong
+
+        Đuôi của save_path được đổi theo định dạng thật của ảnh.
+        on_complete(path, info, url, index) được gọi ngay khi mỗi ảnh tải xong (không được chặn lâu).
+
+        :return: Danh sách (success, result, url, info) theo đúng thứ tự tasks,
+                 info gồm format và size của ảnh đã tải (None nếu lỗi)
+        """
+        return asyncio.run(self._download_all(tasks, progress_callback, on_complete))
+
+    async def _download_all(self, tasks, progress_callback, on_complete):
+        limits = httpx.Limits(max_connections=self.max_in_flight,
+                              max_keepalive_connections=self.max_in_flight)
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.hosts = {}
+        done = 0
+
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=True,
+                                     transport=self.transport) as client:
+            async def run(url, save_path, index):
+                nonlocal done
+                success, result, info = await self._download_one(client, url, save_path, index)
+                if success and on_complete:
+                    on_complete(result, info, url, index)
+
+                done += 1
+                if progress_callback:
+                    progress_callback(done, len(tasks))
+                return success, result, url, info
+
+            return await asyncio.gather(*(run(url, save_path, index) for url, save_path, index in tasks))
+
+    def _host(self, url):
+        """Trạng thái của host: policy dùng chung, số request đang chạy và Condition để chờ lượt"""
+        host = urlparse(url).netloc.lower()
+        if host not in self.hosts:
+            self.hosts[host] = {'policy': get_host_policy(host), 'active': 0, 'cond': asyncio.Condition()}
+        return self.hosts[host]
+
+    async def _fetch(self, client, url, headers, partial):
+        """
+        Gửi request khi host còn lượt (giới hạn AIMD) và token bucket cho phép.
+
+        Với phản hồi 200/206, dữ liệu được ghi ra file .part theo từng đoạn khi nhận được
+        và định dạng được nhận dạng từ các byte đầu, không giữ cả ảnh trong bộ nhớ.
+
+        :return: (status_code, headers, latency, format) - format là None nếu không phải ảnh
+                 hoặc phần đã tải không dùng được để tải tiếp
+        """
+        host = self._host(url)
+        policy = host['policy']
+        async with host['cond']:
+            await host['cond'].wait_for(lambda: host['active'] < policy.limit)
+            host['active'] += 1
+
+        try:
+            # Chờ token/Retry-After trước khi chiếm lượt chung để không chặn các host khác
+            delay = policy.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self.in_flight:
+                started = time.monotonic()
+                headers = dict(headers, **partial.request_headers())
+                async with client.stream('GET', url, headers=headers) as response:
+                    latency = time.monotonic() - started
+                    fmt = None
+                    if response.status_code in (200, 206):
+                        fmt = await self._stream_to_file(response, partial)
+                    return response.status_code, response.headers, latency, fmt
+        finally:
+            partial.close()
+            async with host['cond']:
+                host['active'] -= 1
+                host['cond'].notify_all()
+
+    async def _stream_to_file(self, response, partial):
+        """Ghi body ra file theo từng đoạn, dừng sớm nếu các byte đầu không phải ảnh"""
+        if not partial.begin(response.status_code, response.headers.get('Content-Range')):
+            return None
+        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+            if not partial.write(chunk):
+                return None
+        return partial.finish()
+
+    async def _download_one(self, client, url, save_path, index):
+        """
+        Tải một ảnh với retry, chờ giữa các lần thử không chặn event loop
+
+        :return: (success, đường dẫn file hoặc thông báo lỗi, thông tin {'format', 'size', 'sha256'} hoặc None)
+        """
+        policy = self._host(url)['policy']
+        partial = PartialFile(save_path, resume=self.resume)
+        loop = asyncio.get_running_loop()
+        # Cache dùng SQLite/đọc ghi file đồng bộ, chạy trên thread khác để không chặn event loop
+        cached = await loop.run_in_executor(None, self._lookup, url) if self.cache else None
+        for retry in range(self.max_retries):
+            if retry > 0:
+                # Backoff tăng dần có jitter để các request không retry cùng lúc
+                await asyncio.sleep(backoff_delay(retry))
+            if self.cancelled is not None and self.cancelled.is_set():
+                return False, "Đã hủy tải", None
+
+            headers = self.get_headers(url)
+            # Để httpx tự chọn Accept-Encoding theo các decoder đang có
+            headers.pop('Accept-Encoding', None)
+            if cached and not partial.offset:
+                headers.update(self.cache.conditional_headers(cached))
+
+            try:
+                status, response_headers, latency, fmt = await self._fetch(client, url, headers, partial)
+            except httpx.TimeoutException:
+                policy.on_throttled()
+                self._keep_or_discard(partial)
+                if retry == self.max_retries - 1:
+                    return False, "Timeout khi tải ảnh", None
+                continue
+            except httpx.HTTPError as e:
+                self._keep_or_discard(partial)
+                if retry == self.max_retries - 1:
+                    return False, f"Lỗi khi tải ảnh: {str(e)}", None
+                continue
+
+            if status in THROTTLE_STATUSES:
+                policy.on_throttled(parse_retry_after(response_headers.get('Retry-After')))
+            else:
+                policy.on_success(latency)
+
+            if status in (200, 206):
+                if fmt is None:
+                    resumed = status == 206
+                    partial.discard()
+                    if resumed and retry < self.max_retries - 1:
+                        # Phần đã tải không khớp, tải lại từ đầu
+                        continue
+                    return False, "File không phải là ảnh hợp lệ", None
+
+                if self.verify:
+                    # Kiểm tra đầy đủ trên thread khác, các request khác vẫn tiếp tục
+                    if not await loop.run_in_executor(None, verify_image, partial.part_path):
+                        partial.discard()
+                        return False, "File không phải là ảnh hợp lệ", None
+
+                final_path, info = partial.commit()
+                if self.cache:
+                    await loop.run_in_executor(None, self._store, url, final_path, info, response_headers)
+                return True, final_path, info
+
+            if status == 304 and cached:  # Bản lưu trong cache vẫn còn mới
+                restored = await loop.run_in_executor(None, self._restore, url, cached, save_path)
+                if restored:
+                    return True, restored[0], dict(restored[1], cached=True)
+                cached = None
+                continue
+
+            if status == 416:  # Range không hợp lệ, tải lại từ đầu
+                partial.discard()
+                continue
+
+            if status == 403:  # Forbidden
+                if retry == self.max_retries - 1:
+                    return False, f"Lỗi 403 Forbidden sau {self.max_retries} lần thử", None
+                continue
+
+            if status in THROTTLE_STATUSES:
+                if retry == self.max_retries - 1:
+                    return False, f"Lỗi HTTP {status} sau {self.max_retries} lần thử", None
+                continue
+
+            return False, f"Lỗi HTTP {status}", None
+
+        return False, "Đã hết số lần thử", None
+
+    def _lookup(self, url):
+        try:
+            return self.cache.lookup(url)
+        except Exception as e:
+            print(f"Không thể đọc cache cho {url}: {str(e)}")
+            return None
+
+    def _restore(self, url, cached, save_path):
+        try:
+            return self.cache.restore_image(url, cached, save_path)
+        except Exception as e:
+            print(f"Không thể lấy ảnh từ cache cho {url}: {str(e)}")
+            return None
+
+    def _store(self, url, path, info, headers):
+        """Lưu ảnh vừa tải vào cache, lỗi cache không làm hỏng lượt tải"""
+        if not self.cache:
+            return
+        try:
+            self.cache.store_file(url, path, info['sha256'], headers)
+        except Exception as e:
+            print(f"Không thể lưu cache cho {url}: {str(e)}")
+
+    def _keep_or_discard(self, partial):
+        """Lỗi mạng giữa chừng: giữ phần đã tải để tải tiếp nếu bật resume"""
+        if self.resume and os.path.exists(partial.part_path):
+            partial.offset = os.path.getsize(partial.part_path)
+        else:
+            partial.discard()
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .formats import SNIFF_SIZE, path_for_format, sniff_format
+
+# Thư mục và dung lượng tối đa của cache HTTP trên đĩa (HTTP_CACHE=0 để tắt)
+# Mặc định nhỏ vì /tmp của môi trường serverless có dung lượng giới hạn
+CACHE_ENABLED = os.environ.get('HTTP_CACHE', '1') not in ('0', 'false', 'off')
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', '/tmp/http_cache')
+CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def content_charset(headers):
+    """Charset khai báo trong Content-Type (ví dụ 'text/html; charset=euc-kr'), None nếu không có"""
+    match = CHARSET_RE.search(headers.get('Content-Type') or '')
+    return match.group(1).lower() if match else None
+
+
+class HttpCache:
+    """
+    Cache phản hồi HTTP trên đĩa cho trang chapter và ảnh.
+
+    Nội dung được lưu theo hash SHA-256 (cùng nội dung chỉ lưu một lần), chỉ mục
+    url -> hash/ETag/Last-Modified nằm trong SQLite. Khi tải lại, request gửi kèm
+    If-None-Match/If-Modified-Since; server trả 304 thì dùng bản trong cache.
+    Khi vượt dung lượng tối đa, các URL lâu không dùng nhất bị xóa trước (LRU).
+
+    Các hàm đều đồng bộ (SQLite, đọc/ghi file); code asyncio phải gọi qua run_in_executor.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.bodies_dir = os.path.join(root, 'bodies')
+        self.lock = threading.Lock()
+        # Tổng dung lượng ước tính, chỉ tính lại chính xác khi vượt giới hạn
+        self.total = None
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'url TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, '
+                'etag TEXT, last_modified TEXT, stored_at REAL, accessed_at REAL, charset TEXT)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+            if 'charset' not in {row[1] for row in db.execute('PRAGMA table_info(entries)')}:
+                # Cache tạo từ phiên bản trước chưa lưu charset
+                try:
+                    db.execute('ALTER TABLE entries ADD COLUMN charset TEXT')
+                except sqlite3.OperationalError:  # Process khác vừa thêm cột
+                    pass
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def body_path(self, digest):
+        return os.path.join(self.bodies_dir, digest[:2], digest)
+
+    def lookup(self, url):
+        """Thông tin bản lưu của URL ({'digest', 'size', 'etag', 'last_modified', 'charset', 'path'}) hoặc None"""
+        with self.lock, self._db() as db:
+            row = db.execute('SELECT digest, size, etag, last_modified, charset FROM entries WHERE url = ?',
+                             (url,)).fetchone()
+        if row is None:
+            return None
+        entry = {'digest': row[0], 'size': row[1], 'etag': row[2], 'last_modified': row[3],
+                 'charset': row[4], 'path': self.body_path(row[0])}
+        if not os.path.isfile(entry['path']):
+            return None
+        return entry
+
+    def conditional_headers(self, entry):
+        """Header để server kiểm tra bản lưu còn mới không"""
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def touch(self, url):
+        """Đánh dấu URL vừa được dùng (server trả 304)"""
+        with self.lock, self._db() as db:
+            db.execute('UPDATE entries SET accessed_at = ? WHERE url = ?', (time.time(), url))
+
+    def read(self, entry):
+        with open(entry['path'], 'rb') as f:
+            return f.read()
+
+    def store_bytes(self, url, data, headers):
+        """Lưu nội dung trong bộ nhớ (ví dụ HTML của trang chapter)"""
+        if not self._has_validators(headers):
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.body_path(digest)
+        added = not os.path.exists(path)
+        if added:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return self._index(url, digest, len(data), headers, added)
+
+    def store_file(self, url, file_path, digest, headers):
+        """Lưu file đã tải xong (hard link nếu cùng ổ đĩa, không thì sao chép)"""
+        if not self._has_validators(headers):
+            return None
+        path = self.body_path(digest)
+        added = not os.path.exists(path)
+        if added:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            try:
+                os.link(file_path, tmp_path)
+            except OSError:
+                shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, path)
+        return self._index(url, digest, os.path.getsize(path), headers, added)
+
+    def restore_image(self, url, entry, save_path):
+        """
+        Tạo file ảnh từ bản lưu khi server trả 304 (hard link nếu được)
+
+        :return: (đường dẫn file, {'format', 'size', 'sha256'}) hoặc None nếu bản lưu không phải ảnh
+        """
+        with open(entry['path'], 'rb') as f:
+            fmt = sniff_format(f.read(SNIFF_SIZE))
+        if fmt is None:
+            return None
+
+        final_path = path_for_format(save_path, fmt)
+        if os.path.exists(final_path):
+            os.remove(final_path)
+        try:
+            os.link(entry['path'], final_path)
+        except OSError:
+            shutil.copyfile(entry['path'], final_path)
+        self.touch(url)
+        return final_path, {'format': fmt, 'size': entry['size'], 'sha256': entry['digest']}
+
+    def _has_validators(self, headers):
+        # Không có ETag/Last-Modified thì không kiểm tra lại được, không lưu
+        return bool(headers.get('ETag') or headers.get('Last-Modified'))
+
+    def _index(self, url, digest, size, headers, added=True):
+        now = time.time()
+        with self.lock, self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries (url, digest, size, etag, last_modified, stored_at, accessed_at, '
+                'charset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, digest, size, headers.get('ETag'), headers.get('Last-Modified'), now, now,
+                 content_charset(headers))
+            )
+            if self.total is None:
+                self.total = self._sum(db)
+            elif added:
+                self.total += size
+            over_limit = self.total > self.max_bytes
+        if over_limit:
+            self.evict()
+        return digest
+
+    def _sum(self, db):
+        return db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)'
+        ).fetchone()[0]
+
+    def evict(self):
+        """Xóa các URL lâu không dùng nhất cho tới khi tổng dung lượng nằm trong giới hạn"""
+        with self.lock, self._db() as db:
+            total = self.total = self._sum(db)
+            if total <= self.max_bytes:
+                return
+
+            rows = db.execute('SELECT url, digest, size FROM entries ORDER BY accessed_at').fetchall()
+            for url, digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+                db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                still_used = db.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+                if not still_used:
+                    try:
+                        os.remove(self.body_path(digest))
+                    except OSError:
+                        pass
+                    total -= size
+            self.total = total
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Cache dùng chung của process, None nếu bị tắt hoặc không tạo được thư mục"""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = HttpCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Không thể tạo cache HTTP, tải trực tiếp: {str(e)}")
+                return None
+        return _default_cache
@@ -1,21 +1,64 @@
 import os
 import time
 import random
+import threading
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse
 from PIL import Image
 import io
 import json
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from .sources import SourceConfig
+from .extract import extract_image_urls, select_image_urls
+from .formats import EXTENSIONS, transcode_file, verify_image
+from .partial import CHUNK_SIZE, PartialFile
+from .cache import get_default_cache
+from ..workers import get_process_pool
+from ..ratelimit import backoff_delay, get_host_policy, parse_retry_after
+
+try:
+    from .async_engine import AsyncDownloadEngine
+except ImportError:  # Chưa cài httpx
+    AsyncDownloadEngine = None
+
+# Cách tải ảnh mặc định: 'async' (asyncio + httpx) hoặc 'threads' (ThreadPoolExecutor + requests)
+DEFAULT_BACKEND = os.environ.get('DOWNLOAD_BACKEND', 'async')
+
 
 class ImageDownloader:
-    def __init__(self):
+    def __init__(self, backend=None, verify=False, transcode=None, profile=None, resume=False, cache=True):
+        """
+        :param backend: 'async' hoặc 'threads' (mặc định theo biến môi trường DOWNLOAD_BACKEND)
+        :param verify: Kiểm tra đầy đủ từng ảnh bằng PIL sau khi tải (mặc định chỉ kiểm tra magic bytes)
+        :param transcode: Định dạng ('JPEG', 'WEBP', 'PNG') để chuyển ảnh ngay khi tải xong, None giữ nguyên
+        :param profile: Profile encode khi chuyển định dạng
+        :param resume: Tải tiếp chapter đã tải dở trong output_dir (dựa vào info.json và file .part)
+        :param cache: Dùng cache HTTP trên đĩa (True: cache chung của process, False: tắt, hoặc một HttpCache)
+        """
         self.source_config = SourceConfig()
         self.session = requests.Session()
         self.max_retries = 3
         self.max_workers = 5  # Số lượng thread tải đồng thời
+        # Connection pool đủ lớn cho tất cả thread, tránh mở lại kết nối liên tục
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.verify = verify
+        self.resume = resume
+        self.cache = get_default_cache() if cache is True else (cache or None)
+        self.transcode = transcode.upper() if transcode else None
+        if self.transcode and self.transcode not in EXTENSIONS:
+            raise ValueError(f"Định dạng không hợp lệ: {transcode}")
+        self.profile = profile
+        self.backend = backend or DEFAULT_BACKEND
+        if self.backend == 'async' and AsyncDownloadEngine is None:
+            self.backend = 'threads'
+        self.cancelled = threading.Event()
+        
+    def cancel(self):
+        """Dừng tải các ảnh chưa gửi request (ví dụ khi client ngắt kết nối), ảnh đang tải dở vẫn chạy tới khi xong"""
+        self.cancelled.set()
         
     def is_valid_image_url(self, url):
         """Kiểm tra URL có phải là ảnh hợp lệ không"""
@@ -99,28 +142,94 @@ class ImageDownloader:
         
         return headers
 
+    def save_stream(self, response, partial):
+        """
+        Ghi body của response ra file .part theo từng đoạn, nhận dạng định dạng từ các byte đầu
+
+        :return: Định dạng ảnh, hoặc None nếu không phải ảnh / phần đã tải không dùng được
+        """
+        if not partial.begin(response.status_code, response.headers.get('Content-Range')):
+            return None
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if not partial.write(chunk):
+                return None
+        return partial.finish()
+
     def download_image(self, url, save_path, index):
-        """Tải một ảnh với retry và xử lý lỗi"""
+        """
+        Tải một ảnh với retry và xử lý lỗi, ghi thẳng ra đĩa khi đang nhận dữ liệu
+
+        :return: (success, đường dẫn file hoặc thông báo lỗi, thông tin {'format', 'size', 'sha256'} hoặc None)
+        """
         max_retries = 3
+        # Giới hạn tốc độ theo host (token bucket, Retry-After) dùng chung với các lần tải khác
+        policy = get_host_policy(urlparse(url).netloc)
+        partial = PartialFile(save_path, resume=self.resume)
+        cached = self.cache.lookup(url) if self.cache else None
         for retry in range(max_retries):
             try:
-                # Thêm delay ngẫu nhiên giữa các lần thử
+                # Backoff tăng dần có jitter giữa các lần thử
                 if retry > 0:
-                    time.sleep(random.uniform(2, 5))
+                    time.sleep(backoff_delay(retry))
+                if self.cancelled.is_set():
+                    return False, "Đã hủy tải", None
                 
                 headers = self.get_headers(url)
                 print(f"Tải ảnh {index} với headers: {headers}")
                 
-                response = self.session.get(url, headers=headers, timeout=10)
+                # Giữ lượt của host (giới hạn AIMD) trong suốt request, kể cả lúc nhận body
+                with policy.slot():
+                    delay = policy.reserve()
+                    if delay > 0:
+                        time.sleep(delay)
+                    started = time.monotonic()
+                    request_headers = dict(headers, **partial.request_headers())
+                    if cached and not partial.offset:
+                        request_headers.update(self.cache.conditional_headers(cached))
+                    response = self.session.get(url, headers=request_headers, timeout=10, stream=True)
+                    
+                    if response.status_code in (403, 429) or response.status_code >= 500:
+                        policy.on_throttled(parse_retry_after(response.headers.get('Retry-After')))
+                    else:
+                        policy.on_success(time.monotonic() - started)
+                    
+                    fmt = None
+                    if response.status_code in (200, 206):
+                        try:
+                            fmt = self.save_stream(response, partial)
+                        finally:
+                            partial.close()
+                            response.close()
                 
-                if response.status_code == 200:
-                    if not self.is_valid_image_content(response.content):
-                        return False, "File không phải là ảnh hợp lệ"
+                if response.status_code in (200, 206):
+                    if fmt is None:
+                        resumed = response.status_code == 206
+                        partial.discard()
+                        if resumed and retry < max_retries - 1:
+                            # Phần đã tải không khớp, tải lại từ đầu
+                            continue
+                        return False, "File không phải là ảnh hợp lệ", None
                     
-                    with open(save_path, 'wb') as f:
-                        f.write(response.content)
-                    return True, save_path
+                    if self.verify and not verify_image(partial.part_path):
+                        partial.discard()
+                        return False, "File không phải là ảnh hợp lệ", None
                     
+                    final_path, info = partial.commit()
+                    self.store_in_cache(url, final_path, info, response.headers)
+                    return True, final_path, info
+                
+                # Không cần đọc body của các phản hồi lỗi
+                response.close()
+                
+                if response.status_code == 304 and cached:  # Bản lưu trong cache vẫn còn mới
+                    restored = self.cache.restore_image(url, cached, save_path)
+                    if restored:
+                        return True, restored[0], dict(restored[1], cached=True)
+                    cached = None
+                
+                elif response.status_code == 416:  # Range không hợp lệ, tải lại từ đầu
+                    partial.discard()
+                
                 elif response.status_code == 403:  # Forbidden
                     if retry < max_retries - 1:
                         # Thử thay đổi User-Agent và Referer
@@ -128,24 +237,76 @@ class ImageDownloader:
                         # Thay đổi Referer nếu cần
                         if 'Referer' in headers:
                             headers['Referer'] = headers['Referer'].replace('http://', 'https://')
-                        time.sleep(random.uniform(3, 6))
                     else:
-                        return False, f"Lỗi 403 Forbidden sau {max_retries} lần thử"
+                        return False, f"Lỗi 403 Forbidden sau {max_retries} lần thử", None
+                
+                elif response.status_code == 429 or response.status_code >= 500:
+                    if retry == max_retries - 1:
+                        return False, f"Lỗi HTTP {response.status_code} sau {max_retries} lần thử", None
                         
                 else:
-                    return False, f"Lỗi HTTP {response.status_code}"
+                    return False, f"Lỗi HTTP {response.status_code}", None
                     
             except requests.exceptions.Timeout:
+                policy.on_throttled()
+                self.keep_or_discard(partial)
                 if retry == max_retries - 1:
-                    return False, "Timeout khi tải ảnh"
-                time.sleep(random.uniform(3, 6))
+                    return False, "Timeout khi tải ảnh", None
                 
             except requests.exceptions.RequestException as e:
+                self.keep_or_discard(partial)
                 if retry == max_retries - 1:
-                    return False, f"Lỗi khi tải ảnh: {str(e)}"
-                time.sleep(random.uniform(3, 6))
+                    return False, f"Lỗi khi tải ảnh: {str(e)}", None
                 
-        return False, "Đã hết số lần thử"
+        return False, "Đã hết số lần thử", None
+
+    def store_in_cache(self, url, path, info, headers):
+        """Lưu ảnh vừa tải vào cache, lỗi cache không làm hỏng lượt tải"""
+        if not self.cache:
+            return
+        try:
+            self.cache.store_file(url, path, info['sha256'], headers)
+        except Exception as e:
+            print(f"Không thể lưu cache cho {url}: {str(e)}")
+
+    def keep_or_discard(self, partial):
+        """Lỗi mạng giữa chừng: giữ phần đã tải để tải tiếp nếu bật resume"""
+        if self.resume and os.path.exists(partial.part_path):
+            partial.offset = os.path.getsize(partial.part_path)
+        else:
+            partial.discard()
+
+    def fetch_page(self, url, headers):
+        """
+        Tải HTML của trang chapter, dùng bản trong cache nếu server trả 304
+
+        :return: HTML (str; bytes khi bản trong cache không có charset - parser tự nhận dạng theo thẻ meta)
+        """
+        cached = self.cache.lookup(url) if self.cache else None
+        if cached:
+            headers = dict(headers, **self.cache.conditional_headers(cached))
+
+        response = self.session.get(url, headers=headers, timeout=10)
+        print(f"Status code: {response.status_code}")
+        if response.status_code == 304 and cached:
+            print("Trang không thay đổi, dùng bản trong cache")
+            self.cache.touch(url)
+            html = self.cache.read(cached)
+            if cached['charset']:
+                # Giải mã theo charset của phản hồi gốc, giống response.text
+                try:
+                    return html.decode(cached['charset'], errors='replace')
+                except LookupError:
+                    print(f"Charset không hợp lệ trong cache: {cached['charset']}")
+            return html
+        response.raise_for_status()
+
+        if self.cache:
+            try:
+                self.cache.store_bytes(url, response.content, response.headers)
+            except Exception as e:
+                print(f"Không thể lưu cache cho {url}: {str(e)}")
+        return response.text
 
     def crawl_images(self, url):
         """Crawl tất cả ảnh từ trang web"""
@@ -154,74 +315,22 @@ class ImageDownloader:
             headers = self.source_config.get_headers(url)
             print(f"Headers đã được tạo: {headers}")
             
-            response = self.session.get(url, headers=headers, timeout=10)
-            print(f"Status code: {response.status_code}")
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            print(f"Đã parse HTML thành công")
+            source = self.source_config.get_source(url)
             image_urls = []
+            if source and source.fetch_images and self.source_config.get_source(url, fallback=False) is source:
+                # Nguồn có API JSON (chỉ khi đúng host của nguồn): lấy thẳng danh sách ảnh, không cần parse HTML
+                try:
+                    image_urls = source.fetch_images(self.session, url, headers)
+                    print(f"Lấy danh sách ảnh qua API của {source.name}")
+                except Exception as e:
+                    print(f"Không lấy được ảnh qua API của {source.name}, crawl HTML: {str(e)}")
             
-            # Tìm ảnh trong các thẻ img
-            img_tags = soup.find_all('img')
-            print(f"Số lượng thẻ img tìm thấy: {len(img_tags)}")
-            
-            for img in img_tags:
-                # Kiểm tra các thuộc tính chứa URL ảnh
-                for attr in ['data-url', 'data-src', 'data-original', 'data-lazy-src', 'src']:
-                    src = img.get(attr, '')
-                    if src:
-                        print(f"Tìm thấy thuộc tính {attr}: {src}")
-                        # Chuyển đổi URL tương đối thành URL tuyệt đối
-                        if not src.startswith(('http://', 'https://')):
-                            src = urljoin(url, src)
-                            print(f"URL đã được chuyển đổi: {src}")
-                        
-                        # Loại bỏ các URL thumbnail và ảnh không liên quan
-                        if any(x in src.lower() for x in ['type=f218_218', 'type=w160', 'type=w210', 'type=q90', 'type=a92', 'thumb_', 'thumbnail', 'bg_transparency']):
-                            continue
-                            
-                        # Kiểm tra xem URL có phải là ảnh không
-                        if any(src.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']):
-                            image_urls.append(src)
-                            print(f"Thêm ảnh vào danh sách: {src}")
-            
-            # Tìm ảnh trong các thẻ div có class chứa từ khóa liên quan đến ảnh
-            div_tags = soup.find_all('div', class_=lambda x: x and any(keyword in x.lower() for keyword in ['image', 'img', 'photo', 'picture', 'chapter', 'comic']))
-            print(f"Số lượng thẻ div liên quan đến ảnh: {len(div_tags)}")
-            
-            for div in div_tags:
-                # Tìm ảnh trong background-image
-                style = div.get('style', '')
-                if 'background-image' in style:
-                    print(f"Tìm thấy background-image trong style: {style}")
-                    # Trích xuất URL từ background-image
-                    import re
-                    urls = re.findall(r'url\([\'"]?(.*?)[\'"]?\)', style)
-                    for src in urls:
-                        if not src.startswith(('http://', 'https://')):
-                            src = urljoin(url, src)
-                        # Loại bỏ các URL thumbnail
-                        if any(x in src.lower() for x in ['type=f218_218', 'type=w160', 'type=w210', 'type=q90', 'type=a92', 'thumb_', 'thumbnail']):
-                            continue
-                        if any(src.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']):
-                            image_urls.append(src)
-                            print(f"Thêm ảnh từ background: {src}")
-            
-            # Tìm ảnh trong các thẻ a có href chứa URL ảnh
-            a_tags = soup.find_all('a', href=lambda x: x and any(x.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']))
-            for a in a_tags:
-                src = a.get('href', '')
-                if not src.startswith(('http://', 'https://')):
-                    src = urljoin(url, src)
-                # Loại bỏ các URL thumbnail
-                if any(x in src.lower() for x in ['type=f218_218', 'type=w160', 'type=w210', 'type=q90', 'type=a92', 'thumb_', 'thumbnail']):
-                    continue
-                image_urls.append(src)
-                print(f"Thêm ảnh từ thẻ a: {src}")
-            
-            # Loại bỏ các URL trùng lặp
-            image_urls = list(dict.fromkeys(image_urls))
+            if not image_urls:
+                html = self.fetch_page(url, headers)
+                if source and source.selectors:
+                    image_urls = select_image_urls(html, url, source.selectors)
+                if not image_urls:
+                    image_urls = extract_image_urls(html, url)
             
             print(f"Tổng số ảnh tìm thấy: {len(image_urls)}")
             if not image_urls:
@@ -236,56 +345,215 @@ class ImageDownloader:
             print(f"Stack trace: {traceback.format_exc()}")
             return []
 
-    def download_images_parallel(self, image_urls, temp_dir):
-        """Tải nhiều ảnh song song"""
-        downloaded_files = []
+    def start_transcode(self, path, info, pending):
+        """
+        Gửi ảnh vừa tải xong sang process pool để chuyển định dạng trong khi các ảnh khác
+        vẫn đang tải; pending[path] giữ future (None nếu phải chuyển tuần tự sau khi tải xong)
+        """
+        if not self.transcode or info['format'] == self.transcode:
+            return
+        pending[path] = None
+        pool = get_process_pool()
+        if pool:
+            try:
+                pending[path] = pool.submit(transcode_file, path, self.transcode, self.profile)
+            except RuntimeError as e:  # Pool đã hỏng hoặc đã đóng
+                print(f"Không thể gửi {path} sang process pool: {str(e)}")
+
+    def finish_transcodes(self, images, pending):
+        """Chờ các ảnh chuyển định dạng xong và cập nhật lại thông tin file"""
+        for image in images:
+            path = image.pop('path')
+            image['file'] = os.path.basename(path)
+            if path not in pending:
+                continue
+            future = pending[path]
+            try:
+                try:
+                    new_path, size = future.result() if future else transcode_file(path, self.transcode, self.profile)
+                except Exception as e:
+                    if future is None or not os.path.exists(path):
+                        raise
+                    # Process pool lỗi, chuyển lại trong process hiện tại
+                    print(f"Lỗi process pool khi chuyển {path}: {str(e)}")
+                    new_path, size = transcode_file(path, self.transcode, self.profile)
+                image.update({'file': os.path.basename(new_path), 'format': self.transcode, 'size': size})
+                # Hash của file gốc không còn đúng với file đã chuyển định dạng
+                image.pop('sha256', None)
+            except Exception as e:
+                print(f"Không thể chuyển định dạng {path}: {str(e)}")
+
+    def download_images_parallel(self, image_urls, temp_dir, progress_callback=None, indices=None, on_image=None):
+        """
+        Tải nhiều ảnh song song
+
+        Ảnh được ghi nhận theo thứ tự tải xong (ảnh chậm không chặn các ảnh sau),
+        danh sách kết quả được sắp lại theo số thứ tự.
+
+        :param indices: Số thứ tự dùng đặt tên file cho từng URL (mặc định 1, 2, 3...)
+        :param on_image: Hàm on_image(image) được gọi ngay khi mỗi ảnh tải xong (trước khi chuyển định dạng),
+                         image gồm {'index', 'path', 'url', 'format', 'size', 'sha256'}
+        :return: (downloaded_files, failed_urls, images) - images là danh sách
+                 {'index', 'file', 'url', 'format', 'size', 'sha256'} của các ảnh tải thành công
+        """
+        indices = indices or list(range(1, len(image_urls) + 1))
+        if self.backend == 'async':
+            return self.download_images_async(image_urls, temp_dir, progress_callback, indices, on_image)
+
         failed_urls = []
+        images = []
+        pending = {}
         
         def download_task(args):
             url, index = args
-            # Tạo tên file với số thứ tự
+            # Tạo tên file với số thứ tự (đuôi được đổi theo định dạng thật)
             img_name = f'image_{index:03d}.jpg'
             save_path = os.path.join(temp_dir, img_name)
-            success, result = self.download_image(url, save_path, index)
-            return success, result, url
+            success, result, info = self.download_image(url, save_path, index)
+            if success:
+                self.start_transcode(result, info, pending)
+            return success, result, url, index, info
             
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(download_task, (url, i+1)) 
-                      for i, url in enumerate(image_urls)]
+            futures = [executor.submit(download_task, (url, index)) 
+                      for url, index in zip(image_urls, indices)]
             
-            for future in futures:
-                success, result, url = future.result()
+            for done, future in enumerate(as_completed(futures), 1):
+                success, result, url, index, info = future.result()
                 if success:
-                    downloaded_files.append(result)
+                    image = dict(info, index=index, path=result, url=url)
+                    images.append(image)
+                    if on_image:
+                        on_image(dict(image))
                 else:
                     failed_urls.append(f"{url}: {result}")
-                    
-        return downloaded_files, failed_urls
+                if progress_callback:
+                    progress_callback(done, len(futures))
+        
+        images.sort(key=lambda image: image['index'])
+        self.finish_transcodes(images, pending)
+        downloaded_files = [os.path.join(temp_dir, image['file']) for image in images]
+        return downloaded_files, failed_urls, images
 
-    def download_chapter(self, url, output_dir):
-        """Tải toàn bộ chapter"""
+    def download_images_async(self, image_urls, temp_dir, progress_callback=None, indices=None, on_image=None):
+        """Tải nhiều ảnh bằng asyncio trên một thread (giới hạn kết nối theo từng host)"""
+        engine = AsyncDownloadEngine(self.get_headers, verify=self.verify, resume=self.resume, cache=self.cache,
+                                     max_retries=self.max_retries, cancelled=self.cancelled)
+        indices = indices or list(range(1, len(image_urls) + 1))
+        tasks = [(url, os.path.join(temp_dir, f'image_{i:03d}.jpg'), i)
+                 for url, i in zip(image_urls, indices)]
+
+        failed_urls = []
+        images = []
+        pending = {}
+        
+        def on_complete(path, info, url, index):
+            if on_image:
+                on_image(dict(info, index=index, path=path, url=url))
+            self.start_transcode(path, info, pending)
+        
+        for (success, result, url, info), (_, _, index) in zip(
+                engine.download_all(tasks, progress_callback, on_complete), tasks):
+            if success:
+                images.append(dict(info, index=index, path=result, url=url))
+            else:
+                failed_urls.append(f"{url}: {result}")
+        
+        self.finish_transcodes(images, pending)
+        downloaded_files = [os.path.join(temp_dir, image['file']) for image in images]
+        return downloaded_files, failed_urls, images
+
+    def load_manifest(self, output_dir, url):
+        """
+        Đọc info.json của lần tải trước, trả về {url ảnh: thông tin file} của các ảnh
+        còn nguyên vẹn trên đĩa (đúng kích thước đã ghi)
+
+        Lần tải trước phải cùng URL, cùng định dạng đích và profile; nếu không thì tải lại
+        từ đầu thay vì dùng ảnh đã bị chuyển sang định dạng khác.
+        """
+        try:
+            with open(os.path.join(output_dir, 'info.json'), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if info.get('source_url') != url or info.get('target_format') != self.transcode:
+            return {}
+        if self.transcode and info.get('profile') != self.profile:
+            return {}
+
+        complete = {}
+        for image in info.get('images', []):
+            path = os.path.join(output_dir, image.get('file', ''))
+            if image.get('file') and os.path.isfile(path) and os.path.getsize(path) == image.get('size'):
+                complete[image['url']] = image
+        return complete
+
+    def download_chapter(self, url, output_dir, progress_callback=None, image_urls=None):
+        """
+        Tải toàn bộ chapter
+
+        Khi bật resume, các ảnh đã tải đủ theo info.json được bỏ qua, file tải dở
+        được tải tiếp bằng HTTP Range, chỉ các ảnh còn thiếu/lỗi được tải lại.
+
+        :param progress_callback: Hàm progress_callback(done, total) được gọi sau mỗi ảnh tải xong
+        :param image_urls: Danh sách ảnh đã crawl sẵn (chế độ tải nhiều chapter), None để crawl url
+        """
         try:
             # Tạo thư mục output nếu chưa tồn tại
             os.makedirs(output_dir, exist_ok=True)
             
             # Crawl tất cả ảnh từ trang web
-            image_urls = self.crawl_images(url)
+            if image_urls is None:
+                image_urls = self.crawl_images(url)
             if not image_urls:
                 return False, "Không tìm thấy ảnh nào trong trang web"
             
+            # Bỏ qua các ảnh đã tải đủ ở lần trước
+            complete = self.load_manifest(output_dir, url) if self.resume else {}
+            skipped = []
+            todo_urls = []
+            todo_indices = []
+            for index, image_url in enumerate(image_urls, 1):
+                if image_url in complete:
+                    image = dict(complete[image_url], index=index)
+                    skipped.append(dict(image, path=os.path.join(output_dir, image['file'])))
+                else:
+                    todo_urls.append(image_url)
+                    todo_indices.append(index)
+            if skipped:
+                print(f"Bỏ qua {len(skipped)} ảnh đã tải ở lần trước")
+            
             # Tải ảnh song song
-            downloaded_files, failed_urls = self.download_images_parallel(image_urls, output_dir)
+            images = []
+            failed_urls = []
+            if todo_urls:
+                downloaded_files, failed_urls, images = self.download_images_parallel(
+                    todo_urls, output_dir, progress_callback, todo_indices
+                )
+            
+            # Ảnh đã có nhưng khác định dạng yêu cầu thì chỉ cần chuyển định dạng
+            pending = {}
+            for image in skipped:
+                self.start_transcode(image['path'], image, pending)
+            self.finish_transcodes(skipped, pending)
+            
+            images = sorted(skipped + images, key=lambda image: image['index'])
+            downloaded_files = [os.path.join(output_dir, image['file']) for image in images]
             
             if not downloaded_files:
                 return False, "Không thể tải xuống ảnh nào"
             
-            # Tạo file thông tin
+            # Tạo file thông tin (dùng làm manifest cho lần tải tiếp theo)
             info = {
                 'total_images': len(image_urls),
                 'downloaded_count': len(downloaded_files),
+                'skipped_count': len(skipped),
                 'failed_count': len(failed_urls),
                 'failed_urls': failed_urls,
+                'images': images,
                 'source_url': url,
+                'target_format': self.transcode,
+                'profile': self.profile if self.transcode else None,
                 'download_time': time.strftime('%Y-%m-%d %H:%M:%S')
             }
             
@@ -295,8 +563,10 @@ class ImageDownloader:
             return True, {
                 'message': f'Đã tải xuống {len(downloaded_files)} ảnh!',
                 'success_count': len(downloaded_files),
+                'skipped_count': len(skipped),
                 'failed_count': len(failed_urls),
-                'failed_urls': failed_urls
+                'failed_urls': failed_urls,
+                'files': [image['file'] for image in images]
             }
             
         except Exception as e:
@@ -0,0 +1,110 @@
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # Chưa cài lxml, dùng html.parser của BeautifulSoup (chậm hơn)
+    lxml = None
+
+# Các thuộc tính của thẻ img có thể chứa URL ảnh (theo thứ tự ưu tiên)
+IMG_ATTRIBUTES = ('data-url', 'data-src', 'data-original', 'data-lazy-src', 'src')
+
+# URL thumbnail và ảnh không liên quan
+THUMBNAIL_RE = re.compile(
+    r'type=(?:f218_218|w160|w210|q90|a92)|thumb_|thumbnail|bg_transparency', re.IGNORECASE
+)
+IMAGE_EXT_RE = re.compile(r'\.(?:jpe?g|png|gif|webp)$', re.IGNORECASE)
+# Class của div có thể chứa ảnh nền của trang truyện
+IMAGE_CLASS_RE = re.compile(r'image|img|photo|picture|chapter|comic', re.IGNORECASE)
+BACKGROUND_URL_RE = re.compile(r'url\([\'"]?(.*?)[\'"]?\)')
+
+
+def _absolute(src, base_url):
+    if src.startswith(('http://', 'https://')):
+        return src
+    return urljoin(base_url, src)
+
+
+def _is_image(src):
+    return IMAGE_EXT_RE.search(src) is not None and THUMBNAIL_RE.search(src) is None
+
+
+def _iter_elements(html):
+    """Duyệt các thẻ img/div/a theo thứ tự trong trang, trả về (tên thẻ, hàm get thuộc tính)"""
+    if lxml is not None:
+        if isinstance(html, str):
+            # lxml không nhận str có khai báo encoding, chuyển về bytes UTF-8
+            parser = lxml.html.HTMLParser(encoding='utf-8')
+            root = lxml.html.document_fromstring(html.encode('utf-8'), parser=parser)
+        else:
+            root = lxml.html.document_fromstring(html)
+        for element in root.iter('img', 'div', 'a'):
+            yield element.tag, element.get
+    else:
+        soup = BeautifulSoup(html, 'html.parser', multi_valued_attributes=None)
+        for element in soup.find_all(('img', 'div', 'a')):
+            yield element.name, element.get
+
+
+def extract_image_urls(html, base_url):
+    """
+    Lấy danh sách URL ảnh của trang chapter trong một lần duyệt cây HTML
+
+    Thứ tự kết quả giống cách crawl cũ: ảnh từ thẻ img, rồi ảnh nền của các div
+    liên quan đến ảnh, rồi link ảnh trong thẻ a; URL trùng chỉ giữ lần đầu.
+
+    :param html: HTML của trang (str hoặc bytes)
+    :param base_url: URL của trang để chuyển URL tương đối thành tuyệt đối
+    """
+    from_img, from_background, from_links = [], [], []
+
+    for tag, get in _iter_elements(html):
+        if tag == 'img':
+            for attr in IMG_ATTRIBUTES:
+                src = get(attr)
+                if src:
+                    from_img.append(_absolute(src, base_url))
+        elif tag == 'div':
+            style = get('style')
+            if style and 'background-image' in style and IMAGE_CLASS_RE.search(get('class') or ''):
+                from_background.extend(_absolute(src, base_url) for src in BACKGROUND_URL_RE.findall(style))
+        else:
+            href = get('href')
+            if href and IMAGE_EXT_RE.search(href):
+                from_links.append(_absolute(href, base_url))
+
+    seen = set()
+    image_urls = []
+    for src in from_img + from_background + from_links:
+        if src not in seen and _is_image(src):
+            seen.add(src)
+            image_urls.append(src)
+    return image_urls
+
+
+def select_image_urls(html, base_url, selectors):
+    """
+    Lấy URL ảnh chỉ trong khung đọc truyện theo CSS selector của nguồn
+
+    Mỗi thẻ img lấy thuộc tính đầu tiên có giá trị theo IMG_ATTRIBUTES (data-* trước
+    src để bỏ qua ảnh "loading"). Không lọc theo đuôi file vì CDN thường trả URL không đuôi.
+
+    :return: Danh sách URL ảnh, rỗng nếu không selector nào khớp (trang đổi giao diện)
+    """
+    soup = BeautifulSoup(html, 'lxml' if lxml is not None else 'html.parser')
+    seen = set()
+    image_urls = []
+    for selector in selectors:
+        for img in soup.select(selector):
+            src = next((img.get(attr) for attr in IMG_ATTRIBUTES if img.get(attr)), None)
+            if not src:
+                continue
+            src = _absolute(src.strip(), base_url)
+            if src not in seen and THUMBNAIL_RE.search(src) is None:
+                seen.add(src)
+                image_urls.append(src)
+        if image_urls:
+            break
+    return image_urls
@@ -0,0 +1,70 @@
+import os
+from PIL import Image
+from ..encoder_profiles import save_image
+
+# Số byte đầu cần đọc để nhận dạng định dạng ảnh
+SNIFF_SIZE = 32
+
+# Đuôi file tương ứng với từng định dạng
+EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+    'BMP': '.bmp',
+    'AVIF': '.avif'
+}
+
+
+def sniff_format(head):
+    """
+    Nhận dạng định dạng ảnh từ các byte đầu (magic bytes), không cần giải mã ảnh
+
+    :return: 'JPEG', 'PNG', 'GIF', 'WEBP', 'BMP', 'AVIF' hoặc None nếu không phải ảnh
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head.startswith(b'BM'):
+        return 'BMP'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return 'AVIF'
+    return None
+
+
+def verify_image(path):
+    """Kiểm tra đầy đủ cấu trúc file ảnh bằng PIL (chậm hơn sniff_format)"""
+    try:
+        with Image.open(path) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+
+def path_for_format(save_path, fmt):
+    """Đổi đuôi file theo định dạng thật của ảnh, ví dụ image_001.jpg -> image_001.png"""
+    return os.path.splitext(save_path)[0] + EXTENSIONS.get(fmt, os.path.splitext(save_path)[1])
+
+
+def transcode_file(path, target_format, profile=None):
+    """
+    Chuyển ảnh đã tải sang định dạng đích và xóa file gốc
+    (hàm top-level để chạy được trong process con)
+
+    :return: (đường dẫn file mới, kích thước)
+    """
+    output_path = path_for_format(path, target_format)
+    if output_path != path and os.path.exists(output_path):
+        # File cũ có thể là hard link tới cache HTTP, xóa thay vì ghi đè nội dung
+        os.remove(output_path)
+    with Image.open(path) as img:
+        size, quality = save_image(img, output_path, target_format, profile)
+    if output_path != path:
+        os.remove(path)
+    return output_path, size
@@ -0,0 +1,110 @@
+import hashlib
+import os
+from .formats import SNIFF_SIZE, path_for_format, sniff_format
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PartialFile:
+    """
+    File ảnh đang tải (<đích>.part).
+
+    Dữ liệu được ghi ra đĩa ngay khi nhận được, định dạng được nhận dạng từ các
+    byte đầu và hash SHA-256 được tính trong lúc ghi. Nếu lần tải trước bị ngắt,
+    phần đã tải được giữ lại để tải tiếp bằng HTTP Range.
+    """
+
+    def __init__(self, save_path, resume=False):
+        self.save_path = save_path
+        self.part_path = save_path + '.part'
+        self.offset = os.path.getsize(self.part_path) if resume and os.path.exists(self.part_path) else 0
+        self.file = None
+        self.head = b''
+        self.format = None
+        self.hash = None
+        self.size = 0
+
+    def request_headers(self):
+        """Header Range để tải tiếp phần còn thiếu (rỗng nếu tải từ đầu)"""
+        return {'Range': f'bytes={self.offset}-'} if self.offset else {}
+
+    def begin(self, status_code, content_range=None):
+        """
+        Chuẩn bị ghi theo phản hồi của server: 206 đúng vị trí thì ghi tiếp,
+        200 (server bỏ qua Range) thì ghi lại từ đầu
+
+        :return: False nếu phản hồi 206 không khớp phần đã tải (cần xóa và tải lại từ đầu)
+        """
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        if status_code == 206:
+            if not self.offset or not (content_range or '').startswith(f'bytes {self.offset}-'):
+                return False
+            with open(self.part_path, 'rb') as f:
+                self.head = f.read(SNIFF_SIZE)
+                f.seek(0)
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    self.hash.update(chunk)
+                    self.size += len(chunk)
+            self.format = sniff_format(self.head)
+            if self.format is None:
+                return False
+            self.file = open(self.part_path, 'ab')
+            return True
+
+        self.offset = 0
+        return True
+
+    def write(self, chunk):
+        """Ghi một đoạn dữ liệu, trả về False nếu các byte đầu cho thấy không phải ảnh"""
+        if self.file is not None:
+            self._write(chunk)
+            return True
+        self.head += chunk
+        if len(self.head) < SNIFF_SIZE:
+            return True
+        return self._open_head()
+
+    def _write(self, chunk):
+        self.file.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def _open_head(self):
+        self.format = sniff_format(self.head)
+        if self.format is None:
+            return False
+        self.file = open(self.part_path, 'wb')
+        self._write(self.head)
+        return True
+
+    def finish(self):
+        """Kết thúc ghi, trả về định dạng ảnh hoặc None nếu không phải ảnh"""
+        if self.file is None and not self._open_head():
+            return None
+        self.close()
+        return self.format
+
+    def close(self):
+        """Đóng file, giữ lại phần đã tải"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        """Xóa phần đã tải"""
+        self.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self.offset = 0
+
+    def commit(self):
+        """
+        Đổi file .part thành file hoàn chỉnh, đuôi theo định dạng thật
+
+        :return: (đường dẫn file, {'format', 'size', 'sha256'})
+        """
+        final_path = path_for_format(self.save_path, self.format)
+        os.replace(self.part_path, final_path)
+        return final_path, {'format': self.format, 'size': self.size, 'sha256': self.hash.hexdigest()}
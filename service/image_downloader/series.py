@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+
+# Số chapter được giữ chờ giữa hai bước liên tiếp (bước trước chạy nhanh hơn sẽ phải chờ)
+SERIES_QUEUE_SIZE = int(os.environ.get('SERIES_QUEUE_SIZE', 2))
+
+# Số chapter được tải ảnh cùng lúc: ảnh cuối của chapter trước tải song song với ảnh đầu của chapter sau
+SERIES_DOWNLOAD_WORKERS = int(os.environ.get('SERIES_DOWNLOAD_WORKERS', 2))
+
+# Số chapter tối đa của một lần tải
+MAX_SERIES_CHAPTERS = 500
+
+# Thời gian chờ tối đa mỗi lần thao tác với hàng đợi trước khi kiểm tra lại cờ dừng (giây)
+QUEUE_POLL_INTERVAL = 0.5
+
+_DONE = object()
+
+
+def expand_chapter_range(template, start, end):
+    """
+    Tạo danh sách URL chapter từ mẫu, ví dụ https://example.com/truyen/chapter-{n} với n từ start tới end
+
+    :raise ValueError: Mẫu không có {n} hoặc khoảng chapter không hợp lệ
+    """
+    if '{n}' not in template:
+        raise ValueError('URL mẫu phải chứa {n} ở vị trí số chapter')
+    if start < 0 or end < start:
+        raise ValueError(f'Khoảng chapter không hợp lệ: {start} - {end}')
+    if end - start + 1 > MAX_SERIES_CHAPTERS:
+        raise ValueError(f'Chỉ tải được tối đa {MAX_SERIES_CHAPTERS} chapter mỗi lần')
+    return [template.replace('{n}', str(n)) for n in range(start, end + 1)]
+
+
+def _put(q, item, stop):
+    """Đưa vào hàng đợi, chờ khi hàng đợi đầy; trả về False nếu pipeline đã dừng"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """Lấy từ hàng đợi, trả về _DONE nếu pipeline đã dừng"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def download_series(downloader, chapter_urls, output_for, progress_callback=None, on_chapter=None,
+                    on_downloaded=None, queue_size=SERIES_QUEUE_SIZE, download_workers=SERIES_DOWNLOAD_WORKERS):
+    """
+    Tải nhiều chapter theo dây chuyền: crawl -> tải ảnh -> đóng gói
+
+    Mỗi bước chạy trên thread riêng, nối với nhau bằng hàng đợi giới hạn: chapter N+1
+    được crawl trong lúc ảnh của chapter N đang tải, và bước crawl dừng lại chờ khi
+    đã đi trước bước tải `queue_size` chapter. Bước đóng gói chạy trên thread gọi hàm.
+
+    :param downloader: ImageDownloader dùng cho cả series
+    :param output_for: Hàm output_for(number, url) trả về (thư mục lưu chapter, lock)
+    :param progress_callback: Hàm progress_callback(done, total, message) theo số chapter đã xong
+    :param on_chapter: Hàm on_chapter(chapter) gọi ở bước đóng gói ngay khi mỗi chapter tải xong
+    :param on_downloaded: Hàm on_downloaded(chapter) gọi ở bước tải, khi vẫn còn giữ lock của chapter
+    :return: Danh sách chapter theo thứ tự {'number', 'url', 'success', 'output_dir', 'result' hoặc 'error'}
+    """
+    download_workers = max(1, download_workers)
+    crawled = queue.Queue(maxsize=max(1, queue_size))
+    downloaded = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+
+    def crawl_stage():
+        try:
+            for number, url in enumerate(chapter_urls, 1):
+                try:
+                    image_urls = downloader.crawl_images(url)
+                except Exception as e:
+                    print(f"Lỗi khi crawl chapter {url}: {str(e)}")
+                    image_urls = []
+                if not _put(crawled, (number, url, image_urls), stop):
+                    return
+        finally:
+            for _ in range(download_workers):
+                _put(crawled, _DONE, stop)
+
+    def download_stage():
+        try:
+            while True:
+                item = _get(crawled, stop)
+                if item is _DONE:
+                    return
+                number, url, image_urls = item
+                chapter = {'number': number, 'url': url, 'success': False}
+                try:
+                    if not image_urls:
+                        raise RuntimeError("Không tìm thấy ảnh nào trong trang web")
+                    output_dir, lock = output_for(number, url)
+                    chapter['output_dir'] = output_dir
+                    with lock:
+                        success, result = downloader.download_chapter(url, output_dir, image_urls=image_urls)
+                        chapter['success'] = success
+                        chapter['result' if success else 'error'] = result
+                        if on_downloaded:
+                            on_downloaded(chapter)
+                except Exception as e:
+                    chapter['success'] = False
+                    chapter['error'] = str(e)
+                if not _put(downloaded, chapter, stop):
+                    return
+        finally:
+            _put(downloaded, _DONE, stop)
+
+    threads = [threading.Thread(target=crawl_stage, daemon=True)]
+    threads.extend(threading.Thread(target=download_stage, daemon=True) for _ in range(download_workers))
+    for thread in threads:
+        thread.start()
+
+    chapters = []
+    finished = 0
+    try:
+        while finished < download_workers:
+            chapter = downloaded.get()
+            if chapter is _DONE:
+                finished += 1
+                continue
+            if on_chapter:
+                on_chapter(chapter)
+            chapters.append(chapter)
+            if progress_callback:
+                status = 'xong' if chapter['success'] else f"lỗi: {chapter['error']}"
+                progress_callback(len(chapters), len(chapter_urls), f"Chapter {chapter['number']} {status}")
+    finally:
+        # Bước đóng gói lỗi thì dừng các bước trước thay vì để chúng chờ hàng đợi mãi
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return sorted(chapters, key=lambda chapter: chapter['number'])
@@ -1,89 +1,173 @@
+import json
 from urllib.parse import urlparse
 
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+
+def image_headers(base_url, accept_language):
+    """Headers tải ảnh giống trình duyệt đang đọc truyện trên base_url"""
+    return {
+        'User-Agent': USER_AGENT,
+        'Referer': f'{base_url}/',
+        'Origin': base_url,
+        'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+        'Accept-Language': accept_language,
+        'Connection': 'keep-alive',
+        'Sec-Fetch-Dest': 'image',
+        'Sec-Fetch-Mode': 'no-cors',
+        'Sec-Fetch-Site': 'cross-site'
+    }
+
+
+class Source:
+    """
+    Một trang truyện được hỗ trợ
+
+    :param name: Tên nguồn, đồng thời là từ khóa dự phòng khi host không nằm trong `hosts`
+                 (các trang mirror đổi tên miền liên tục, ví dụ nettruyenvio.com)
+    :param hosts: Các host (và tên miền cha) thuộc nguồn, tra cứu chính xác
+    :param selectors: CSS selector của thẻ img trong khung đọc truyện, chỉ lấy ảnh trong đó
+                      (bỏ qua quảng cáo/thumbnail); rỗng thì dùng cách tìm ảnh chung
+    :param fetch_images: Hàm fetch_images(session, url, headers) lấy thẳng danh sách URL ảnh
+                         từ API JSON của trang, không cần tải và parse HTML (chỉ dùng khi
+                         host nằm trong `hosts`, không dùng khi khớp theo tên)
+    """
+
+    def __init__(self, name, base_url, hosts, accept_language, selectors=(), fetch_images=None):
+        self.name = name
+        self.base_url = base_url
+        self.hosts = tuple(hosts)
+        self.headers = image_headers(base_url, accept_language)
+        self.selectors = tuple(selectors)
+        self.fetch_images = fetch_images
+
+
+BILIBILI_API = 'https://manga.bilibili.com/twirp/comic.v1.Comic'
+
+
+def fetch_bilibili_images(session, url, headers):
+    """
+    Lấy ảnh chapter của manga.bilibili.com qua API (URL dạng /mc<comic_id>/<ep_id>)
+
+    :return: Danh sách URL ảnh đã kèm token, rỗng nếu URL không phải trang chapter
+    """
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    if len(parts) < 2 or not parts[-1].isdigit():
+        return []
+
+    api_headers = dict(headers, Accept='application/json, text/plain, */*')
+    api_headers.pop('Sec-Fetch-Dest', None)
+    params = {'device': 'pc', 'platform': 'web'}
+
+    response = session.post(f'{BILIBILI_API}/GetImageIndex', params=params,
+                            json={'ep_id': int(parts[-1])}, headers=api_headers, timeout=10)
+    response.raise_for_status()
+    paths = [image['path'] for image in response.json()['data']['images']]
+    if not paths:
+        return []
+
+    response = session.post(f'{BILIBILI_API}/ImageToken', params=params,
+                            json={'urls': json.dumps(paths)}, headers=api_headers, timeout=10)
+    response.raise_for_status()
+    return [f"{image['url']}?token={image['token']}" for image in response.json()['data']]
+
+
+# Các nguồn được hỗ trợ, thêm nguồn mới bằng register_source
+SOURCES = {}
+
+
+def register_source(source):
+    SOURCES[source.name] = source
+    return source
+
+
+register_source(Source(
+    'nettruyen', 'https://nettruyen.com', ['nettruyen.com'], 'vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7',
+    selectors=['div.reading-detail div.page-chapter img']
+))
+register_source(Source(
+    'truyenqq', 'https://truyenqq.com', ['truyenqq.com'], 'vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7',
+    selectors=['div.chapter_content div.page-chapter img', 'div.reading-detail div.page-chapter img']
+))
+register_source(Source(
+    'webtoon', 'https://comic.naver.com', ['comic.naver.com', 'image-comic.pstatic.net'],
+    'ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7',
+    selectors=['div.wt_viewer img']
+))
+# LINE Webtoon là trang riêng: ảnh trên CDN webtoon-phinf chỉ trả về khi Referer là webtoons.com
+register_source(Source(
+    'webtoons', 'https://www.webtoons.com', ['webtoons.com', 'webtoon-phinf.pstatic.net'], 'en-US,en;q=0.9',
+    selectors=['#_imageList img']
+))
+register_source(Source(
+    'bilibili', 'https://manga.bilibili.com', ['manga.bilibili.com', 'hdslb.com'], 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+    fetch_images=fetch_bilibili_images
+))
+
 
 class SourceConfig:
     def __init__(self):
+        # Tra cứu host -> nguồn bằng dict thay vì duyệt từng nguồn
+        self.hosts = {}
+        # Host chỉ khớp theo tên nguồn (mirror), tách riêng để không lẫn với host chính xác
+        self.fallback_hosts = {}
+        for source in SOURCES.values():
+            for host in source.hosts:
+                self.hosts[host] = source
         self.sources = {
-            'nettruyen': {
-                'base_url': 'https://nettruyen.com',
-                'headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Referer': 'https://nettruyen.com/',
-                    'Origin': 'https://nettruyen.com',
-                    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                    'Accept-Language': 'vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'Connection': 'keep-alive',
-                    'Sec-Fetch-Dest': 'image',
-                    'Sec-Fetch-Mode': 'no-cors',
-                    'Sec-Fetch-Site': 'cross-site'
-                }
-            },
-            'truyenqq': {
-                'base_url': 'https://truyenqq.com',
-                'headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Referer': 'https://truyenqq.com/',
-                    'Origin': 'https://truyenqq.com',
-                    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                    'Accept-Language': 'vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'Connection': 'keep-alive',
-                    'Sec-Fetch-Dest': 'image',
-                    'Sec-Fetch-Mode': 'no-cors',
-                    'Sec-Fetch-Site': 'cross-site'
-                }
-            },
-            'webtoon': {
-                'base_url': 'https://comic.naver.com',
-                'headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Referer': 'https://comic.naver.com/',
-                    'Origin': 'https://comic.naver.com',
-                    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                    'Accept-Language': 'ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'Connection': 'keep-alive',
-                    'Sec-Fetch-Dest': 'image',
-                    'Sec-Fetch-Mode': 'no-cors',
-                    'Sec-Fetch-Site': 'cross-site'
-                }
-            },
-            'manga': {
-                'base_url': 'https://manga.bilibili.com',
-                'headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Referer': 'https://manga.bilibili.com/',
-                    'Origin': 'https://manga.bilibili.com',
-                    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                    'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'Connection': 'keep-alive',
-                    'Sec-Fetch-Dest': 'image',
-                    'Sec-Fetch-Mode': 'no-cors',
-                    'Sec-Fetch-Site': 'cross-site'
-                }
-            }
+            name: {'base_url': source.base_url, 'headers': source.headers}
+            for name, source in SOURCES.items()
         }
 
+    def get_source(self, url_or_domain, fallback=True):
+        """
+        Tìm nguồn của URL/domain: host chính xác, rồi tên miền cha, cuối cùng theo tên nguồn
+
+        :param fallback: False để chỉ khớp theo host (bỏ qua bước khớp theo tên nguồn)
+        """
+        domain = urlparse(url_or_domain).netloc if '//' in url_or_domain else url_or_domain
+        domain = domain.lower().split(':')[0]
+
+        labels = domain.split('.')
+        for i in range(len(labels) - 1):
+            source = self.hosts.get('.'.join(labels[i:]))
+            if source:
+                return source
+
+        if not fallback:
+            return None
+        if domain in self.fallback_hosts:
+            return self.fallback_hosts[domain]
+        for name, source in SOURCES.items():
+            if name in domain:
+                # Ghi nhớ để lần sau tra cứu trực tiếp
+                self.fallback_hosts[domain] = source
+                return source
+        return None
+
     def get_source_config(self, domain):
         """Lấy cấu hình cho một domain cụ thể"""
-        for source_name, config in self.sources.items():
-            if source_name in domain.lower():
-                return config
+        source = self.get_source(domain)
+        if source:
+            return self.sources[source.name]
         return None
 
     def get_headers(self, url):
         """Lấy headers phù hợp cho URL"""
         parsed_url = urlparse(url)
         domain = parsed_url.netloc.lower()
-        
+
         # Tìm cấu hình phù hợp
         config = self.get_source_config(domain)
         if config:
             headers = config['headers'].copy()
             headers['Host'] = parsed_url.netloc
             return headers
-            
+
         # Headers mặc định nếu không tìm thấy cấu hình
         return {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'User-Agent': USER_AGENT,
             'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9',
             'Connection': 'keep-alive',
@@ -96,4 +180,4 @@ class SourceConfig:
             'Referer': f'https://{domain}/',
             'Origin': f'https://{domain}',
             'Host': parsed_url.netloc
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify, request, url_for
+
+# Số job nặng chạy đồng thời (tải chapter, OCR, cắt/ghép hàng loạt)
+DEFAULT_JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+
+# Cho phép chạy job nền (tham số async). Mặc định tắt: trên môi trường serverless thread nền
+# có thể bị dừng sau khi trả response và request hỏi trạng thái có thể tới instance khác
+ASYNC_JOBS = os.environ.get('ASYNC_JOBS', '0').lower() in ('1', 'true', 'yes', 'on')
+
+# Thời gian giữ trạng thái job đã xong (giây)
+DEFAULT_JOB_MAX_AGE = int(os.environ.get('WORKSPACE_MAX_AGE', 3600))
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class JobError(Exception):
+    """Lỗi nghiệp vụ của job, message được trả thẳng cho người dùng"""
+    pass
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = STATUS_QUEUED
+        self.progress = {'done': 0, 'total': 0}
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class JobManager:
+    """
+    Hàng đợi job chạy nền với số worker giới hạn.
+
+    Trạng thái job được giữ trong bộ nhớ và ghi ra file JSON trong `state_dir`
+    để process khác (khi chạy nhiều worker) vẫn trả lời được request hỏi trạng thái.
+    """
+
+    def __init__(self, state_dir, max_workers=DEFAULT_JOB_WORKERS, max_age=DEFAULT_JOB_MAX_AGE):
+        self.state_dir = state_dir
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Đưa một hàm vào hàng đợi và trả về job ngay lập tức.
+
+        Hàm được gọi dưới dạng func(progress, *args, **kwargs), trong đó
+        progress(done, total, message=None) dùng để báo tiến độ.
+        Giá trị trả về của hàm (dict) là kết quả của job.
+        """
+        job = Job(kind)
+        with self.lock:
+            self._purge_expired()
+            self.jobs[job.id] = job
+        self._save(job)
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def submit_with_workspace(self, kind, workspace, func, *args, **kwargs):
+        """
+        Chạy func(workspace, *args, progress=..., **kwargs) dưới dạng job nền.
+
+        Job sở hữu workspace và dọn nó khi kết thúc.
+        """
+        def task(progress):
+            try:
+                return func(workspace, *args, progress=progress, **kwargs)
+            finally:
+                workspace.cleanup()
+
+        return self.submit(kind, task)
+
+    def get(self, job_id):
+        """Lấy trạng thái job (dict) hoặc None nếu không tồn tại"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return job.to_dict()
+
+        # Job có thể do process khác tạo ra
+        state_path = self._state_path(job_id)
+        if not state_path:
+            return None
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self, job, func, args, kwargs):
+        def progress(done, total, message=None):
+            with self.lock:
+                job.progress = {'done': done, 'total': total}
+                if message is not None:
+                    job.message = message
+                job.updated_at = time.time()
+            self._save(job)
+
+        self._update(job, status=STATUS_RUNNING)
+        try:
+            result = func(progress, *args, **kwargs)
+            self._update(job, status=STATUS_DONE, result=result)
+        except JobError as e:
+            self._update(job, status=STATUS_FAILED, error=str(e))
+        except Exception as e:
+            print(f"Lỗi khi chạy job {job.kind} {job.id}: {str(e)}")
+            print(traceback.format_exc())
+            self._update(job, status=STATUS_FAILED, error=str(e))
+
+    def _update(self, job, **fields):
+        with self.lock:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+        self._save(job)
+
+    def _state_path(self, job_id):
+        # Chỉ chấp nhận job_id dạng hex để tránh path traversal
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        with self.lock:
+            data = job.to_dict()
+        state_path = self._state_path(job.id)
+        tmp_path = f'{state_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, state_path)
+        except OSError as e:
+            print(f"Không thể lưu trạng thái job {job.id}: {str(e)}")
+
+    def _purge_expired(self):
+        """Xóa các job đã xong quá hạn khỏi bộ nhớ và ổ đĩa (gọi khi đang giữ lock)"""
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.status in (STATUS_DONE, STATUS_FAILED) and now - job.updated_at > self.max_age]
+        for job_id in expired:
+            del self.jobs[job_id]
+            try:
+                os.remove(self._state_path(job_id))
+            except OSError:
+                pass
+
+
+def is_async_request():
+    """Kiểm tra client có yêu cầu chạy dưới dạng job nền không (tham số async, chỉ khi bật ASYNC_JOBS)"""
+    if not ASYNC_JOBS:
+        return False
+    value = request.values.get('async')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('async')
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def job_accepted(job):
+    """Response trả về ngay khi job đã được đưa vào hàng đợi"""
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('job_status', job_id=job.id)
+    }), 202
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Cache kết quả OCR/dịch trên đĩa (OCR_CACHE=0 để tắt)
+CACHE_ENABLED = os.environ.get('OCR_CACHE', '1') not in ('0', 'false', 'off')
+CACHE_DIR = os.environ.get('OCR_CACHE_DIR', '/tmp/ocr_cache')
+CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+def make_key(kind, *parts):
+    """Khóa cache từ loại kết quả và các thành phần (được chuẩn hóa bằng JSON rồi hash)"""
+    payload = json.dumps([kind] + list(parts), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_digest(source):
+    """SHA-256 nội dung file upload (UploadedFile hoặc đường dẫn)"""
+    digest = hashlib.sha256()
+    f = source.open_binary() if hasattr(source, 'open_binary') else open(source, 'rb')
+    with f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class OcrCache:
+    """
+    Cache kết quả OCR và bản dịch theo hash nội dung.
+
+    Khóa do caller tạo bằng make_key (hash ảnh + tham số tiền xử lý + phiên bản prompt
+    + model, hoặc hash văn bản + ngôn ngữ + thể loại/phong cách), giá trị là văn bản
+    lưu trong SQLite. Khi vượt dung lượng tối đa, khóa lâu không dùng nhất bị xóa trước (LRU).
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'stored_at REAL, accessed_at REAL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        """Văn bản đã lưu của khóa hoặc None"""
+        with self.lock, self._db() as db:
+            row = db.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key, value):
+        if not value:
+            return
+        now = time.time()
+        with self.lock, self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+        self.evict()
+
+    def evict(self):
+        """Xóa các khóa lâu không dùng nhất cho tới khi tổng dung lượng nằm trong giới hạn"""
+        with self.lock, self._db() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_ocr_cache():
+    """Cache dùng chung của process, None nếu bị tắt hoặc không tạo được thư mục"""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = OcrCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Không thể tạo cache OCR: {str(e)}")
+                return None
+        return _default_cache
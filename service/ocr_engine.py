@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .genai_clients import get_client, run_async
+from .ocr_cache import get_default_ocr_cache, make_key, text_digest
+from .ratelimit import TokenBucket, backoff_delay
+
+# Model Gemini dùng cho OCR và dịch
+OCR_MODEL = 'gemini-2.5-pro-exp-03-25'
+
+# Số request Gemini chạy cùng lúc và số request tối đa mỗi phút cho mỗi API key
+OCR_CONCURRENCY = int(os.environ.get('OCR_CONCURRENCY', 4))
+OCR_RPM = float(os.environ.get('OCR_RPM', 30))
+
+# Cách gọi Gemini: 'async' (client.aio trên event loop chung) hoặc 'threads' (client đồng bộ)
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'async')
+
+# Tăng khi đổi prompt để không dùng lại kết quả cache của prompt cũ
+OCR_PROMPT_VERSION = 1
+TRANSLATE_PROMPT_VERSION = 1
+
+# Mã lỗi nên thử lại (hết quota tạm thời, server quá tải)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+OCR_PROMPT = """
+NHIỆM VỤ: Nhận dạng và trích xuất văn bản từ ảnh với độ chính xác cao nhất.
+
+YÊU CẦU CHẤT LƯỢNG:
+1. Nhận dạng chính xác 100% nội dung văn bản, kể cả chữ nhỏ
+2. Phân biệt rõ các đoạn văn bản khác nhau, các bóng thoại khác nhau
+3. Giữ nguyên vị trí và thứ tự của các bóng thoại
+4. Không bỏ sót bất kỳ ký tự nào
+
+QUY TẮC XỬ LÝ:
+1. Loại bỏ các yếu tố không phải văn bản
+2. QUAN TRỌNG: Xử lý mỗi bóng thoại (speech bubble) như MỘT CÂU HOÀN CHỈNH TRÊN MỘT DÒNG DUY NHẤT
+3. Mỗi bóng thoại riêng biệt sẽ được xuất ra thành một dòng văn bản riêng biệt
+4. Giữ nguyên các dấu câu và định dạng đặc biệt
+
+ĐỊNH DẠNG ĐẦU RA:
+- Mỗi bóng thoại trên một dòng riêng
+- Giữ nguyên các dấu câu và định dạng
+- Không thêm bất kỳ chú thích hay giải thích nào
+- Không tách văn bản trong một bóng thoại thành nhiều dòng
+"""
+
+OCR_CONFIG = {
+    "temperature": 0.1,  # Giảm temperature để tăng độ chính xác
+    "max_output_tokens": 2048,  # Tăng max tokens để xử lý văn bản dài
+    "top_p": 0.8,
+    "top_k": 40,
+    "candidate_count": 1
+}
+
+TRANSLATE_CONFIG = {
+    "temperature": 0.2,
+    "max_output_tokens": 2048
+}
+
+
+def translation_prompt(text, lang_name, genres=None, styles=None):
+    return f"""
+Hãy dịch đoạn văn bản sau sang {lang_name}.
+Thể loại: {', '.join(genres) if genres else 'Không xác định'}
+Phong cách: {', '.join(styles) if styles else 'Không xác định'}
+
+Văn bản cần dịch:
+{text}
+"""
+
+
+def batch_translation_prompt(text, lang_names, genres=None, styles=None):
+    return f"""
+Hãy dịch đoạn văn bản sau sang từng ngôn ngữ: {', '.join(lang_names)}.
+Thể loại: {', '.join(genres) if genres else 'Không xác định'}
+Phong cách: {', '.join(styles) if styles else 'Không xác định'}
+
+Chỉ trả về một đối tượng JSON, khóa là đúng các tên ngôn ngữ {json.dumps(lang_names, ensure_ascii=False)},
+giá trị là bản dịch đầy đủ của văn bản sang ngôn ngữ đó.
+
+Văn bản cần dịch:
+{text}
+"""
+
+
+def parse_translations(response_text, keys):
+    """
+    Tách phản hồi JSON của lần dịch nhiều ngôn ngữ thành {khóa: bản dịch}
+
+    Chỉ giữ các khóa yêu cầu có bản dịch không rỗng (caller dịch lại riêng các khóa thiếu).
+
+    :raise ValueError: Phản hồi không phải JSON object
+    """
+    text = (response_text or '').strip()
+    if text.startswith('```'):
+        # Bỏ khung ```json ... ``` nếu model vẫn bọc kết quả
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError('Phản hồi không phải JSON object')
+    return {key: data[key].strip() for key in keys if isinstance(data.get(key), str) and data[key].strip()}
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_key_bucket(api_key, rpm=OCR_RPM):
+    """Token bucket dùng chung cho mọi request của cùng API key (quota Gemini tính theo key)"""
+    key = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rpm / 60.0)
+        return bucket
+
+
+def is_retryable(error):
+    """Lỗi tạm thời của Gemini (429/5xx) thì thử lại"""
+    return getattr(error, 'code', None) in RETRY_STATUSES
+
+
+class OcrEngine:
+    """
+    Gọi Gemini cho nhiều trang cùng lúc.
+
+    Tối đa `max_in_flight` request chạy song song, số request mỗi phút của API key
+    được giới hạn bằng token bucket (thay cho việc sleep cố định sau mỗi trang).
+    Lỗi 429/5xx được thử lại với backoff tăng dần. Kết quả OCR/dịch được lưu
+    trong cache theo hash nội dung, trang đã xử lý trước đó trả về ngay.
+    """
+
+    def __init__(self, api_key, max_in_flight=OCR_CONCURRENCY, rpm=OCR_RPM, max_retries=3, cache=True,
+                 backend=None):
+        """
+        :param cache: Dùng cache OCR trên đĩa (True: cache chung của process, False: tắt, hoặc một OcrCache)
+        :param backend: 'async' hoặc 'threads' (mặc định theo biến môi trường OCR_BACKEND)
+        """
+        # Client dùng chung theo API key, giữ kết nối giữa các request
+        self.client = get_client(api_key)
+        self.backend = backend or OCR_BACKEND
+        self.bucket = get_key_bucket(api_key, rpm)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.cache = get_default_ocr_cache() if cache is True else (cache or None)
+        self.stats = {'ocr_calls': 0, 'ocr_cache_hits': 0, 'translate_calls': 0, 'translate_cache_hits': 0,
+                      'bytes_sent': 0}
+        # Thông tin ảnh đã gửi lên cho từng trang (dung lượng, định dạng, kích thước)
+        self.payloads = []
+        self.stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _cache_get(self, key):
+        if not self.cache:
+            return None
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            print(f"Không thể đọc cache OCR: {str(e)}")
+            return None
+
+    def _cache_put(self, key, value):
+        if not self.cache:
+            return
+        try:
+            self.cache.put(key, value)
+        except Exception as e:
+            print(f"Không thể lưu cache OCR: {str(e)}")
+
+    def generate(self, contents, config):
+        """Gọi generate_content khi còn quota, trả về text của phản hồi ('' nếu rỗng)"""
+        for retry in range(self.max_retries):
+            delay = self.bucket.reserve()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                if self.backend == 'async':
+                    response = run_async(self.client.aio.models.generate_content(
+                        model=OCR_MODEL, contents=contents, config=config
+                    ))
+                else:
+                    response = self.client.models.generate_content(model=OCR_MODEL, contents=contents, config=config)
+                return response.text or ''
+            except Exception as e:
+                if not is_retryable(e) or retry == self.max_retries - 1:
+                    raise
+                print(f"Gemini trả lỗi {getattr(e, 'code', '')}, thử lại: {str(e)}")
+                time.sleep(backoff_delay(retry + 1, base=2.0))
+        return ''
+
+    def ocr_key(self, image_digest, params):
+        """Khóa cache OCR: hash ảnh gốc + tham số tiền xử lý + phiên bản prompt + model"""
+        return make_key('ocr', image_digest, params, OCR_PROMPT_VERSION, OCR_MODEL)
+
+    def cached_ocr(self, key):
+        """Kết quả OCR đã lưu (None nếu chưa có), dùng để bỏ qua cả bước tiền xử lý ảnh"""
+        text = self._cache_get(key)
+        if text is not None:
+            self._count('ocr_cache_hits')
+        return text
+
+    def ocr_image(self, data, mime_type, cache_key=None, payload=None):
+        """
+        Nhận dạng văn bản trong ảnh (bytes đã encode), lưu kết quả vào cache nếu có cache_key
+
+        :param payload: Thông tin ảnh gửi lên để báo cáo trong kết quả (ví dụ từ encode_payload)
+        """
+        self._count('ocr_calls')
+        with self.stats_lock:
+            self.stats['bytes_sent'] += len(data)
+            self.payloads.append(dict(payload or {}, bytes=len(data)))
+        text = self.generate(
+            [{"text": OCR_PROMPT}, {"inline_data": {"mime_type": mime_type, "data": data}}],
+            OCR_CONFIG
+        )
+        if cache_key:
+            self._cache_put(cache_key, text)
+        return text
+
+    def translation_key(self, text, lang_name, genres=None, styles=None):
+        return make_key('translate', text_digest(text), lang_name, sorted(genres or []), sorted(styles or []),
+                        TRANSLATE_PROMPT_VERSION, OCR_MODEL)
+
+    def translate_many(self, text, lang_names, genres=None, styles=None):
+        """
+        Dịch văn bản sang nhiều ngôn ngữ trong một request (phản hồi JSON theo từng ngôn ngữ)
+
+        Ngôn ngữ đã có trong cache không được dịch lại; nếu phản hồi không đọc được
+        hoặc thiếu ngôn ngữ nào thì ngôn ngữ đó được dịch riêng bằng translate().
+
+        :return: {tên ngôn ngữ: bản dịch}
+        """
+        translations = {}
+        missing = []
+        for lang_name in dict.fromkeys(lang_names):
+            cached = self._cache_get(self.translation_key(text, lang_name, genres, styles))
+            if cached is not None:
+                self._count('translate_cache_hits')
+                translations[lang_name] = cached
+            else:
+                missing.append(lang_name)
+
+        if len(missing) > 1:
+            self._count('translate_calls')
+            config = dict(TRANSLATE_CONFIG, max_output_tokens=TRANSLATE_CONFIG['max_output_tokens'] * len(missing),
+                          response_mime_type='application/json')
+            try:
+                batch = parse_translations(
+                    self.generate(batch_translation_prompt(text, missing, genres, styles), config), missing
+                )
+            except ValueError as e:
+                print(f"Không đọc được bản dịch nhiều ngôn ngữ, dịch riêng từng ngôn ngữ: {str(e)}")
+                batch = {}
+            for lang_name, translated in batch.items():
+                self._cache_put(self.translation_key(text, lang_name, genres, styles), translated)
+            translations.update(batch)
+            missing = [lang_name for lang_name in missing if lang_name not in batch]
+
+        for lang_name in missing:
+            translations[lang_name] = self.translate(text, lang_name, genres, styles)
+        return translations
+
+    def translate(self, text, lang_name, genres=None, styles=None):
+        """Dịch văn bản sang ngôn ngữ lang_name (dùng lại bản dịch đã lưu của cùng văn bản)"""
+        key = self.translation_key(text, lang_name, genres, styles)
+        translated = self._cache_get(key)
+        if translated is not None:
+            self._count('translate_cache_hits')
+            return translated
+        self._count('translate_calls')
+        translated = self.generate(translation_prompt(text, lang_name, genres, styles), TRANSLATE_CONFIG)
+        self._cache_put(key, translated)
+        return translated
+
+    def map(self, func, items, progress=None):
+        """
+        Chạy func(item) cho từng phần tử trên nhiều thread, trả về kết quả theo đúng thứ tự items
+
+        Mỗi kết quả là (True, giá trị) hoặc (False, exception) nên một trang lỗi
+        không làm hỏng các trang khác.
+
+        :param progress: Hàm progress(done, total, message) gọi khi mỗi phần tử xong
+        """
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = {executor.submit(func, item): index for index, item in enumerate(items)}
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    results[index] = (True, future.result())
+                except Exception as e:
+                    results[index] = (False, e)
+                if progress:
+                    progress(done, len(items), f'Đã xử lý {done}/{len(items)} file')
+        return results
@@ -0,0 +1,82 @@
+import os
+from PIL import Image
+from .encoder_profiles import encode_image
+
+# Dung lượng tối đa của ảnh gửi lên Gemini cho mỗi trang (byte)
+PAYLOAD_BUDGET = int(os.environ.get('OCR_PAYLOAD_BYTES', 400 * 1024))
+
+# Số pixel tối đa gửi lên (ảnh lớn hơn được thu nhỏ trước khi encode)
+MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 4 * 1024 * 1024))
+
+# Chiều rộng tối thiểu để chữ nhỏ vẫn đọc được; không thu nhỏ thêm ảnh hẹp hơn mức này
+# (giới hạn số pixel và kích thước bên dưới vẫn được ưu tiên)
+MIN_WIDTH = 720
+
+# Kích thước tối đa mỗi chiều của ảnh WebP; ảnh gửi lên không vượt quá mức này
+WEBP_MAX_DIMENSION = 16383
+MAX_DIMENSION = WEBP_MAX_DIMENSION
+
+# Quality thấp hơn mức này làm nhòe nét chữ, nên thu nhỏ ảnh thay vì giảm quality tiếp
+MIN_QUALITY = 60
+
+# Tỉ lệ thu nhỏ mỗi bước khi chưa đạt dung lượng mục tiêu
+SCALE_STEP = 0.8
+
+PAYLOAD_FORMATS = (('WEBP', 'image/webp'), ('JPEG', 'image/jpeg'))
+
+
+def payload_params(budget=PAYLOAD_BUDGET):
+    """Tham số ảnh hưởng tới ảnh gửi lên (là một phần của khóa cache OCR)"""
+    return {'budget': budget, 'max_pixels': MAX_PIXELS, 'max_dimension': MAX_DIMENSION, 'min_width': MIN_WIDTH,
+            'min_quality': MIN_QUALITY}
+
+
+def _resize(img, scale):
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def _formats(img):
+    """Định dạng encode được ảnh này (WebP không nhận ảnh có chiều vượt WEBP_MAX_DIMENSION)"""
+    if max(img.size) > WEBP_MAX_DIMENSION:
+        return [item for item in PAYLOAD_FORMATS if item[0] != 'WEBP']
+    return PAYLOAD_FORMATS
+
+
+def encode_payload(img, budget=PAYLOAD_BUDGET):
+    """
+    Encode ảnh trang truyện để gửi OCR: grayscale, WebP hoặc JPEG, trong giới hạn dung lượng
+
+    Ở mỗi độ phân giải, cả WebP và JPEG được tìm quality cao nhất vừa dung lượng;
+    nếu cần quality thấp hơn MIN_QUALITY thì thu nhỏ ảnh thêm một bước (không nhỏ hơn
+    MIN_WIDTH) vì chữ ở độ phân giải thấp hơn nhưng nét vẫn rõ hơn chữ bị nén quá mức.
+    Ảnh luôn được thu nhỏ về tối đa MAX_PIXELS pixel và MAX_DIMENSION mỗi chiều trước,
+    kể cả trang webtoon dài bị hẹp hơn MIN_WIDTH.
+
+    :return: (dữ liệu, mime type, {'format', 'quality', 'width', 'height', 'bytes'})
+    """
+    if img.mode != 'L':
+        img = img.convert('L')
+
+    scale = min(1.0, (MAX_PIXELS / (img.width * img.height)) ** 0.5, MAX_DIMENSION / max(img.size))
+    if scale < 1:
+        img = _resize(img, scale)
+
+    smallest = None
+    while True:
+        best = None
+        for fmt, mime_type in _formats(img):
+            data, quality = encode_image(img, fmt, 'balanced', budget, min_quality=MIN_QUALITY)
+            candidate = (data, mime_type, {'format': fmt, 'quality': quality, 'width': img.width,
+                                           'height': img.height, 'bytes': len(data)})
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = candidate
+            if len(data) <= budget:
+                if best is None or (quality, -len(data)) > (best[2]['quality'], -best[2]['bytes']):
+                    best = candidate
+        if best:
+            return best
+        if img.width * SCALE_STEP < MIN_WIDTH:
+            # Không thu nhỏ thêm được, gửi bản nhỏ nhất đã encode
+            return smallest
+        img = _resize(img, SCALE_STEP)
@@ -0,0 +1,176 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+# Giới hạn mặc định cho mỗi host: số request mỗi giây và số request đồng thời
+HOST_RATE = float(os.environ.get('DOWNLOAD_HOST_RPS', 20))
+HOST_MAX_CONCURRENCY = int(os.environ.get('DOWNLOAD_PER_HOST', 8))
+
+# Độ trễ vượt quá LATENCY_FACTOR lần độ trễ tốt nhất được coi là host đang quá tải
+LATENCY_FACTOR = 3.0
+
+# Hệ số EWMA kéo độ trễ tham chiếu về độ trễ hiện tại (host chậm đi lâu dài không bị coi là quá tải mãi)
+LATENCY_DECAY = 0.1
+
+# Thời gian chờ tối đa theo Retry-After (tránh treo job vì header bất thường)
+MAX_RETRY_AFTER = 120.0
+
+
+def parse_retry_after(value, now=None):
+    """Đọc header Retry-After (số giây hoặc ngày giờ HTTP), trả về số giây cần chờ hoặc None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - (now or time.time())
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(retry, base=0.5, cap=30.0):
+    """Thời gian chờ trước lần thử thứ `retry` (tăng gấp đôi mỗi lần, có jitter)"""
+    return random.uniform(0, min(cap, base * (2 ** retry)))
+
+
+class TokenBucket:
+    """
+    Token bucket giới hạn tốc độ request.
+
+    reserve() lấy trước một token và trả về số giây cần chờ để token đó hợp lệ,
+    nên dùng được cho cả thread (time.sleep) lẫn asyncio (asyncio.sleep).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class AimdLimiter:
+    """
+    Giới hạn số request đồng thời theo AIMD (tăng cộng, giảm nhân).
+
+    Mỗi request thành công với độ trễ bình thường tăng giới hạn thêm khoảng
+    1/limit (tức +1 sau mỗi "vòng"); khi bị chặn (403/429), lỗi 5xx, timeout hoặc
+    độ trễ tăng vọt thì giảm một nửa, tối đa một lần mỗi `cooldown` giây.
+
+    Độ trễ tham chiếu lấy ngay mẫu nhanh hơn, còn mẫu chậm hơn thì kéo nó lên dần (EWMA).
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=HOST_MAX_CONCURRENCY, decrease=0.5, cooldown=1.0):
+        self.value = float(min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return max(self.minimum, int(self.value))
+
+    def on_success(self, latency):
+        with self.lock:
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+            if latency > self.best_latency * LATENCY_FACTOR:
+                self._decrease()
+            else:
+                self.value = min(self.maximum, self.value + 1.0 / max(1.0, self.value))
+            self.best_latency += LATENCY_DECAY * (latency - self.best_latency)
+
+    def on_congestion(self):
+        with self.lock:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.value = max(float(self.minimum), self.value * self.decrease)
+
+
+class HostPolicy:
+    """Trạng thái giới hạn của một host: token bucket, AIMD và thời điểm được gửi lại (Retry-After)"""
+
+    def __init__(self, rate=HOST_RATE, max_concurrency=HOST_MAX_CONCURRENCY):
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate)
+        self.concurrency = AimdLimiter(maximum=max_concurrency)
+        self.blocked_until = 0.0
+        self.active = 0
+        self.lock = threading.Lock()
+        self.slots = threading.Condition()
+
+    @property
+    def limit(self):
+        return self.concurrency.limit
+
+    @contextmanager
+    def slot(self):
+        """Giữ một lượt kết nối tới host (cho các thread), chờ khi số request đang chạy đạt giới hạn AIMD"""
+        with self.slots:
+            self.slots.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.slots:
+                self.active -= 1
+                self.slots.notify_all()
+
+    def reserve(self):
+        """Số giây cần chờ trước khi gửi request tiếp theo tới host"""
+        with self.lock:
+            blocked = self.blocked_until - time.monotonic()
+        return max(blocked, self.bucket.reserve())
+
+    def on_success(self, latency):
+        self.concurrency.on_success(latency)
+        with self.bucket.lock:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.5)
+
+    def on_throttled(self, retry_after=None):
+        """Host trả về 403/429/5xx: giảm tốc độ và số kết nối, chờ theo Retry-After nếu có"""
+        self.concurrency.on_congestion()
+        with self.bucket.lock:
+            self.bucket.rate = max(0.5, self.bucket.rate * 0.5)
+        if retry_after:
+            with self.lock:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_host_policy(host):
+    """Lấy trạng thái giới hạn dùng chung cho host (giữ giữa các lần tải trong cùng process)"""
+    host = host.lower()
+    with _policies_lock:
+        policy = _policies.get(host)
+        if policy is None:
+            policy = _policies[host] = HostPolicy()
+        return policy
@@ -0,0 +1,123 @@
+import io
+import os
+import shutil
+import tempfile
+from flask import Request
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+# File upload nhỏ hơn ngưỡng này được giữ trong bộ nhớ, lớn hơn mới ghi ra đĩa
+SPILL_THRESHOLD = int(os.environ.get('UPLOAD_SPILL_THRESHOLD', 16 * 1024 * 1024))
+
+
+class UploadSpool(tempfile.SpooledTemporaryFile):
+    """File tạm của một upload: nằm trong bộ nhớ đến max_size, lớn hơn thì chuyển ra đĩa"""
+
+    def buffered(self):
+        """Dữ liệu nếu file còn trong bộ nhớ (dùng chung buffer của BytesIO, không copy), None nếu đã ra đĩa"""
+        if self._rolled:
+            return None
+        return self._file.getvalue()
+
+
+class UploadRequest(Request):
+    """
+    Request giữ file upload trong bộ nhớ đến SPILL_THRESHOLD.
+
+    Mặc định Werkzeug ghi mọi upload lớn hơn 500KB ra file tạm trên đĩa.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(max_size=SPILL_THRESHOLD, mode='rb+')
+
+
+class UploadedFile:
+    """
+    File đầu vào cho các bộ xử lý: dữ liệu nằm trong bộ nhớ (data) hoặc trên đĩa (path).
+
+    Có thể pickle để gửi sang process con.
+    """
+
+    def __init__(self, name, data=None, path=None):
+        self.name = name
+        self.data = data
+        self.path = path
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(os.path.basename(path), path=path)
+
+    @classmethod
+    def from_image(cls, name, img, format=None):
+        """Encode lại ảnh PIL vào bộ nhớ (giữ định dạng gốc nếu có)"""
+        buffer = io.BytesIO()
+        img.save(buffer, format or img.format or 'PNG')
+        return cls(name, data=buffer.getvalue())
+
+    @property
+    def size(self):
+        return len(self.data) if self.data is not None else os.path.getsize(self.path)
+
+    def open_binary(self):
+        """Mở dữ liệu dạng file-like"""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def open_image(self):
+        """Mở ảnh PIL trực tiếp từ bộ nhớ hoặc file"""
+        if self.data is not None:
+            return Image.open(io.BytesIO(self.data))
+        return Image.open(self.path)
+
+    def save(self, path):
+        """Ghi ra đĩa (cho các công cụ chỉ làm việc với thư mục)"""
+        if self.data is not None:
+            with open(path, 'wb') as f:
+                f.write(self.data)
+        else:
+            shutil.copyfile(self.path, path)
+
+
+def open_image(source):
+    """Mở ảnh từ đường dẫn hoặc UploadedFile"""
+    if isinstance(source, UploadedFile):
+        return source.open_image()
+    return Image.open(source)
+
+
+def ingest_uploads(files, spill_dir, threshold=SPILL_THRESHOLD):
+    """
+    Đọc các file upload trực tiếp từ stream, không qua bước lưu rồi mở lại.
+
+    File lớn hơn `threshold` được ghi vào `spill_dir` để không chiếm bộ nhớ. Upload còn
+    trong bộ nhớ của UploadRequest được dùng trực tiếp, không copy sang bytes mới.
+
+    Returns:
+        Danh sách UploadedFile theo thứ tự upload
+    """
+    uploads = []
+    for index, file in enumerate(files, 1):
+        if not file.filename:
+            continue
+        name = secure_filename(file.filename) or f'upload_{index}'
+
+        stream = file.stream
+        if isinstance(stream, UploadSpool):
+            data = stream.buffered()
+            head = b''
+            stream.seek(0)
+        else:
+            data = head = stream.read(threshold + 1)
+        if data is not None and len(data) <= threshold:
+            uploads.append(UploadedFile(name, data=data))
+            continue
+
+        os.makedirs(spill_dir, exist_ok=True)
+        # Thêm số thứ tự vì các tên khác nhau có thể trùng nhau sau secure_filename
+        path = os.path.join(spill_dir, f'{index:03d}_{name}')
+        with open(path, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(stream, f)
+        uploads.append(UploadedFile(name, path=path))
+    return uploads
@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Số process xử lý ảnh dùng chung cho cả ứng dụng (mặc định bằng số core)
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    Lấy process pool dùng chung cho các tác vụ nặng CPU (encode/decode ảnh).
+
+    Dùng chung một pool để nhiều request đồng thời không tạo quá nhiều process
+    hơn số core. Trả về None nếu môi trường không hỗ trợ multiprocessing
+    (ví dụ serverless không có /dev/shm), khi đó caller xử lý tuần tự.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None and IMAGE_WORKERS > 1:
+            try:
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+            except (OSError, NotImplementedError) as e:
+                print(f"Không thể tạo process pool, chuyển sang xử lý tuần tự: {str(e)}")
+                return None
+        return _pool
+
+
+def reset_process_pool():
+    """Bỏ pool hiện tại (ví dụ khi một process con bị crash làm pool hỏng)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def run_in_pool(func, items, max_workers=None):
+    """
+    Chạy func(*item) cho từng phần tử trên nhiều process, giữ nguyên thứ tự kết quả.
+
+    :param max_workers: None dùng pool chung, 1 chạy tuần tự trong process hiện tại,
+                        số khác tạo pool riêng với số process tương ứng
+    """
+    items = list(items)
+    if max_workers == 1 or len(items) <= 1:
+        return [func(*item) for item in items]
+
+    if max_workers is None:
+        pool = get_process_pool()
+        if pool is None:
+            return [func(*item) for item in items]
+        try:
+            return list(pool.map(func, *zip(*items)))
+        except BrokenProcessPool:
+            reset_process_pool()
+            return [func(*item) for item in items]
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, *zip(*items)))
+    except (OSError, NotImplementedError) as e:
+        print(f"Không thể tạo process pool, chuyển sang xử lý tuần tự: {str(e)}")
+        return [func(*item) for item in items]
+
+
+def stream_to_pool(func, items, max_workers=None, max_pending=None):
+    """
+    Như run_in_pool nhưng lấy từng phần tử từ iterator và chỉ giữ tối đa `max_pending`
+    tác vụ chưa xong, để dữ liệu đầu vào lớn (ví dụ pixel của từng phần ảnh) được tạo
+    dần thay vì tạo sẵn toàn bộ trước khi gửi sang các process.
+
+    :param max_pending: Số tác vụ tối đa chưa lấy kết quả (mặc định bằng số process)
+    """
+    if max_workers == 1:
+        return [func(*item) for item in items]
+
+    owned = max_workers is not None
+    if owned:
+        try:
+            pool = ProcessPoolExecutor(max_workers=max_workers)
+        except (OSError, NotImplementedError) as e:
+            print(f"Không thể tạo process pool, chuyển sang xử lý tuần tự: {str(e)}")
+            return [func(*item) for item in items]
+    else:
+        pool = get_process_pool()
+        if pool is None:
+            return [func(*item) for item in items]
+
+    max_pending = max(1, max_pending or max_workers or IMAGE_WORKERS)
+    results = []
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                results.append(_pending_result(func, pending))
+            future = None
+            if pool is not None:
+                try:
+                    future = pool.submit(func, *item)
+                except BrokenProcessPool:
+                    # Process con bị crash: các phần còn lại xử lý trong process hiện tại
+                    if owned:
+                        pool.shutdown(wait=False)
+                    else:
+                        reset_process_pool()
+                    pool = None
+            pending.append((future, item))
+        while pending:
+            results.append(_pending_result(func, pending))
+    finally:
+        if owned and pool is not None:
+            pool.shutdown()
+    return results
+
+
+def _pending_result(func, pending):
+    """Kết quả của tác vụ cũ nhất, chạy lại trong process hiện tại nếu pool bị hỏng"""
+    future, item = pending.popleft()
+    if future is None:
+        return func(*item)
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        return func(*item)
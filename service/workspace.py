@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+# Thời gian giữ lại workspace/file kết quả trước khi bị dọn (giây)
+DEFAULT_MAX_AGE = int(os.environ.get('WORKSPACE_MAX_AGE', 3600))
+
+# Tên file kết quả có dạng <tên>_<id 16 ký tự hex>.<đuôi>
+ARTIFACT_PATTERN = re.compile(r'^.+_[0-9a-f]{16}(\.\w+)+$')
+WORKSPACE_PREFIX = 'ws_'
+
+# Đuôi của file manifest mô tả archive được stream khi tải xuống
+MANIFEST_SUFFIX = '.manifest.json'
+
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+
+class Workspace:
+    """
+    Thư mục làm việc riêng cho từng request.
+
+    Mỗi request có thư mục tạm và tên file kết quả riêng nên nhiều request
+    (nhiều thread/process) có thể chạy đồng thời mà không ghi đè lẫn nhau.
+    """
+
+    def __init__(self, root, name='job'):
+        self.root = root
+        self.id = uuid.uuid4().hex[:16]
+        self.path = os.path.join(root, f'{WORKSPACE_PREFIX}{name}_{self.id}')
+        self.published = []
+        os.makedirs(self.path)
+        purge_expired(root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+    def subdir(self, name):
+        """Tạo (nếu chưa có) và trả về thư mục con trong workspace"""
+        dir_path = os.path.join(self.path, name)
+        os.makedirs(dir_path, exist_ok=True)
+        return dir_path
+
+    def snapshot(self, name, source_dir, files, copy=()):
+        """
+        Đưa các file của thư mục dùng chung (ví dụ thư mục chapter khi resume) vào
+        thư mục con `name` của workspace để request sau không xóa/ghi đè được kết quả đã publish.
+
+        File được hard link (không tốn thêm dung lượng), copy nếu không link được;
+        các file trong `copy` (bị ghi đè tại chỗ, như info.json) luôn được copy.
+
+        :return: Danh sách (tên file, đường dẫn trong workspace)
+        """
+        dest_dir = self.subdir(name)
+        entries = []
+        for file in files:
+            source, dest = os.path.join(source_dir, file), os.path.join(dest_dir, file)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.exists(dest):
+                os.remove(dest)
+            if file in copy:
+                shutil.copyfile(source, dest)
+            else:
+                try:
+                    os.link(source, dest)
+                except OSError:
+                    shutil.copyfile(source, dest)
+            entries.append((file, dest))
+        return entries
+
+    def artifact_name(self, filename):
+        """Tạo tên file kết quả duy nhất, ví dụ converted_images_<id>.zip"""
+        base, ext = os.path.splitext(filename)
+        return f'{base}_{self.id}{ext}'
+
+    def publish(self, filename, source_dir=None, entries=None):
+        """
+        Đăng ký kết quả để /download/<filename> stream file zip trực tiếp từ workspace.
+
+        Không tạo file zip trên đĩa: chỉ ghi một manifest liệt kê các entry,
+        file zip được sinh ra khi client tải xuống.
+
+        :param source_dir: Thư mục chứa kết quả (lấy toàn bộ file, đường dẫn tương đối làm tên entry)
+        :param entries: Hoặc danh sách (arcname, đường dẫn file) cụ thể
+        :return: Tên file kết quả để trả về cho client
+        """
+        if entries is None:
+            entries = []
+            for root, dirs, files in os.walk(source_dir):
+                dirs.sort()
+                for file in sorted(files):
+                    file_path = os.path.join(root, file)
+                    entries.append((os.path.relpath(file_path, source_dir), file_path))
+
+        artifact_name = self.artifact_name(filename)
+        manifest = {
+            'workspace': self.path,
+            'entries': [[arcname, os.path.abspath(path)] for arcname, path in entries]
+        }
+        with open(os.path.join(self.root, artifact_name + MANIFEST_SUFFIX), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+        self.published.extend(path for arcname, path in entries)
+        return artifact_name
+
+    def cleanup(self):
+        """Xóa thư mục làm việc (giữ lại các file đã publish để tải xuống)"""
+        if not self.published:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+
+        keep = {os.path.relpath(os.path.abspath(path), self.path).split(os.sep)[0] for path in self.published}
+        for entry in os.listdir(self.path):
+            if entry in keep:
+                continue
+            entry_path = os.path.join(self.path, entry)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    pass
+
+
+def load_published(root, filename):
+    """Đọc danh sách entry của kết quả đã publish, trả về None nếu không có"""
+    if not ARTIFACT_PATTERN.match(filename) or os.sep in filename or '/' in filename:
+        return None
+    manifest_path = os.path.join(root, filename + MANIFEST_SUFFIX)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return [(arcname, path) for arcname, path in manifest['entries']]
+
+
+def purge_expired(root, max_age=DEFAULT_MAX_AGE, interval=60):
+    """
+    Xóa các workspace và file kết quả đã quá hạn.
+
+    Được gọi mỗi khi tạo workspace mới nhưng chỉ quét thư mục tối đa một lần
+    mỗi `interval` giây để không tốn I/O.
+    """
+    global _last_purge
+    now = time.time()
+    with _purge_lock:
+        if now - _last_purge < interval:
+            return
+        _last_purge = now
+
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+
+    for entry in entries:
+        is_workspace = entry.startswith(WORKSPACE_PREFIX)
+        if not is_workspace and not ARTIFACT_PATTERN.match(entry):
+            continue
+        entry_path = os.path.join(root, entry)
+        try:
+            if now - os.path.getmtime(entry_path) < max_age:
+                continue
+            if os.path.isdir(entry_path):
+                if is_workspace:
+                    shutil.rmtree(entry_path, ignore_errors=True)
+            else:
+                os.remove(entry_path)
+        except OSError:
+            continue
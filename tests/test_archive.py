@@ -0,0 +1,55 @@
+import io
+import zipfile
+from service.archive import ZIP_DEFLATED, ZIP_STORED, ZipStream, deflate_file, stream_zip
+
+
+def read_zip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+def test_zip_stream_round_trip(tmp_path):
+    image = tmp_path / 'page.jpg'
+    image.write_bytes(b'\xff\xd8\xff' + bytes(range(256)) * 300)
+    text = 'xin chào\n'.encode('utf-8') * 1000
+
+    archive = ZipStream()
+    chunks = []
+    chunks.extend(archive.write_file('ảnh/page.jpg', str(image), ZIP_STORED))
+    chunks.extend(archive.write_bytes('info.json', text, ZIP_DEFLATED))
+    chunks.extend(archive.write_bytes('empty.txt', b'', ZIP_DEFLATED))
+    chunks.extend(archive.close())
+
+    with read_zip(chunks) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ['ảnh/page.jpg', 'info.json', 'empty.txt']
+        assert zf.getinfo('ảnh/page.jpg').compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo('info.json').compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read('ảnh/page.jpg') == image.read_bytes()
+        assert zf.read('info.json') == text
+        assert zf.read('empty.txt') == b''
+
+
+def test_write_compressed_matches_source(tmp_path):
+    doc = tmp_path / 'doc.txt'
+    doc.write_bytes(b'abc' * 10000)
+
+    archive = ZipStream()
+    chunks = list(archive.write_compressed('doc.txt', *deflate_file(str(doc))))
+    chunks.extend(archive.close())
+
+    with read_zip(chunks) as zf:
+        assert zf.read('doc.txt') == doc.read_bytes()
+
+
+def test_stream_zip_keeps_entry_order(tmp_path):
+    entries = []
+    for i in range(20):
+        path = tmp_path / (f'{i:02d}.txt' if i % 2 else f'{i:02d}.png')
+        path.write_bytes(str(i).encode() * (i + 1) * 100)
+        entries.append((path.name, str(path)))
+
+    with read_zip(stream_zip(entries, max_workers=3)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, path in entries]
+        for name, path in entries:
+            assert zf.read(name) == open(path, 'rb').read()
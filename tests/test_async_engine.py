@@ -0,0 +1,121 @@
+import asyncio
+import importlib
+import sys
+import uuid
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('PIL')
+
+from service.image_downloader import async_engine
+from service.image_downloader.async_engine import AsyncDownloadEngine
+from service.ratelimit import AimdLimiter, get_host_policy
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 200
+
+
+def no_headers(url):
+    return {}
+
+
+def unique_host():
+    # Policy của host được dùng chung trong process, mỗi test dùng host riêng
+    return f'{uuid.uuid4().hex}.example'
+
+
+def tracking_transport(stats, delay=0.02):
+    """Transport giả ghi lại số request chạy cùng lúc (tổng và theo host)"""
+    async def handler(request):
+        host = request.url.host
+        stats['active'] += 1
+        stats['hosts'][host] = stats['hosts'].get(host, 0) + 1
+        stats['peak'] = max(stats['peak'], stats['active'])
+        stats['host_peak'][host] = max(stats['host_peak'].get(host, 0), stats['hosts'][host])
+        await asyncio.sleep(delay)
+        stats['active'] -= 1
+        stats['hosts'][host] -= 1
+        return httpx.Response(200, content=PNG)
+    return httpx.MockTransport(handler)
+
+
+def new_stats():
+    return {'active': 0, 'peak': 0, 'hosts': {}, 'host_peak': {}}
+
+
+def tasks_for(tmp_path, urls):
+    return [(url, str(tmp_path / f'image_{i:03d}.jpg'), i) for i, url in enumerate(urls, 1)]
+
+
+def test_global_in_flight_cap(tmp_path):
+    stats = new_stats()
+    urls = [f'https://{unique_host()}/{i}.png' for i in range(12)]
+    engine = AsyncDownloadEngine(no_headers, max_in_flight=3, transport=tracking_transport(stats))
+
+    results = engine.download_all(tasks_for(tmp_path, urls))
+
+    assert all(success for success, result, url, info in results)
+    assert [url for success, result, url, info in results] == urls
+    assert results[0][1].endswith('image_001.png')
+    assert stats['peak'] <= 3
+
+
+def test_per_host_cap_follows_policy_limit(tmp_path):
+    host = unique_host()
+    get_host_policy(host).concurrency = AimdLimiter(initial=2, maximum=2)
+    stats = new_stats()
+    urls = [f'https://{host}/{i}.png' for i in range(8)]
+    engine = AsyncDownloadEngine(no_headers, max_in_flight=16, transport=tracking_transport(stats))
+
+    results = engine.download_all(tasks_for(tmp_path, urls))
+
+    assert all(success for success, result, url, info in results)
+    assert stats['host_peak'][host] == 2
+
+
+def test_retry_with_backoff(tmp_path, monkeypatch):
+    delays = []
+    monkeypatch.setattr(async_engine, 'backoff_delay', lambda retry: delays.append(retry) or 0)
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url)
+        if len(attempts) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, content=PNG)
+
+    url = f'https://{unique_host()}/1.png'
+    engine = AsyncDownloadEngine(no_headers, transport=httpx.MockTransport(handler))
+
+    [(success, path, _, info)] = engine.download_all(tasks_for(tmp_path, [url]))
+
+    assert success and info['format'] == 'PNG'
+    assert len(attempts) == 2
+    assert delays == [1]
+
+
+def test_gives_up_after_max_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(async_engine, 'backoff_delay', lambda retry: 0)
+    url = f'https://{unique_host()}/1.png'
+    engine = AsyncDownloadEngine(no_headers, max_retries=2, transport=httpx.MockTransport(lambda r: httpx.Response(429)))
+
+    [(success, error, _, info)] = engine.download_all(tasks_for(tmp_path, [url]))
+
+    assert not success and '429' in error
+    assert info is None
+
+
+def test_threads_backend_when_httpx_is_missing(monkeypatch):
+    from service.image_downloader import downloader
+
+    monkeypatch.setitem(sys.modules, 'httpx', None)
+    monkeypatch.delitem(sys.modules, 'service.image_downloader.async_engine')
+    try:
+        importlib.reload(downloader)
+        assert downloader.AsyncDownloadEngine is None
+        assert downloader.ImageDownloader(backend='async', cache=False).backend == 'threads'
+    finally:
+        monkeypatch.undo()
+        importlib.reload(downloader)
+    assert downloader.AsyncDownloadEngine is not None
@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('PIL')
+pytest.importorskip('flask')
+
+from cutmergeimage import compute_cuts
+
+
+def test_even_cuts_cover_whole_image():
+    cuts = compute_cuts(1000, 300)
+
+    assert len(cuts) == 4
+    assert cuts[0][0] == 0 and cuts[-1][1] == 1000
+    assert all(bottom == next_top for (_, bottom), (next_top, _) in zip(cuts, cuts[1:]))
+
+
+def test_short_image_is_not_cut():
+    assert compute_cuts(200, 300) == [(0, 200)]
+
+
+def test_cuts_snap_to_smooth_rows():
+    scores = np.full(1000, 50.0, dtype=np.float32)
+    scores[270] = 0  # khoảng trống giữa hai khung gần vị trí cắt đều 250
+    scores[600] = 0  # nằm ngoài khoảng cho phép quanh vị trí 500
+
+    cuts = compute_cuts(1000, 250, scores, tolerance=40)
+
+    assert [top for top, _ in cuts] == [0, 270, 500, 750]
+    assert cuts[-1][1] == 1000
@@ -0,0 +1,83 @@
+import os
+import time
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('PIL')
+
+from service.image_downloader.cache import HttpCache
+
+VALIDATORS = {'ETag': '"v1"'}
+
+
+def test_lookup_and_conditional_headers(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store_bytes('https://a/1', b'hello', {'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    entry = cache.lookup('https://a/1')
+
+    assert cache.read(entry) == b'hello'
+    assert cache.conditional_headers(entry) == {
+        'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'
+    }
+
+
+def test_responses_without_validators_are_not_stored(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store_bytes('https://a/1', b'hello', {})
+    assert cache.lookup('https://a/1') is None
+
+
+def test_lru_eviction_removes_oldest_bodies(tmp_path):
+    cache = HttpCache(str(tmp_path), max_bytes=250)
+    for i in range(3):
+        cache.store_bytes(f'https://a/{i}', bytes([i]) * 100, VALIDATORS)
+        time.sleep(0.01)
+    # Trùng nội dung với ảnh 2 nên không tốn thêm dung lượng
+    cache.store_bytes('https://b/2', bytes([2]) * 100, VALIDATORS)
+
+    assert cache.lookup('https://a/0') is None
+    assert cache.lookup('https://a/1') is not None
+    assert cache.lookup('https://a/2') is not None
+    assert cache.lookup('https://b/2') is not None
+    assert cache.total == 200
+    assert len([name for root, dirs, files in os.walk(cache.bodies_dir) for name in files]) == 2
+
+
+def test_charset_is_stored_with_entry(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    cache.store_bytes('https://a/1', '만화'.encode('euc-kr'),
+                      dict(VALIDATORS, **{'Content-Type': 'text/html; charset="EUC-KR"'}))
+    cache.store_bytes('https://a/2', b'<html></html>', VALIDATORS)
+
+    assert cache.lookup('https://a/1')['charset'] == 'euc-kr'
+    assert cache.lookup('https://a/2')['charset'] is None
+
+
+def test_old_index_gets_charset_column(tmp_path):
+    import sqlite3
+    db = sqlite3.connect(str(tmp_path / 'index.db'))
+    db.execute('CREATE TABLE entries (url TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, '
+               'etag TEXT, last_modified TEXT, stored_at REAL, accessed_at REAL)')
+    db.close()
+
+    cache = HttpCache(str(tmp_path))
+    cache.store_bytes('https://a/1', b'hello', dict(VALIDATORS, **{'Content-Type': 'text/html; charset=utf-8'}))
+
+    assert cache.lookup('https://a/1')['charset'] == 'utf-8'
+
+
+def test_fetch_page_decodes_cached_html_with_its_charset(tmp_path):
+    from service.image_downloader import ImageDownloader
+
+    class NotModified:
+        status_code = 304
+
+    cache = HttpCache(str(tmp_path))
+    cache.store_bytes('https://a/c1', '<p>만화</p>'.encode('euc-kr'),
+                      dict(VALIDATORS, **{'Content-Type': 'text/html; charset=euc-kr'}))
+    downloader = ImageDownloader(cache=cache)
+    downloader.session.get = lambda url, headers, timeout: NotModified()
+
+    assert downloader.fetch_page('https://a/c1', {}) == '<p>만화</p>'
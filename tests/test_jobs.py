@@ -0,0 +1,49 @@
+import time
+import pytest
+
+pytest.importorskip('flask')
+
+from service.jobs import STATUS_DONE, STATUS_FAILED, JobError, JobManager
+
+
+def wait_for(manager, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in (STATUS_DONE, STATUS_FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError('job chưa xong')
+
+
+def test_job_result_and_progress(tmp_path):
+    manager = JobManager(str(tmp_path), max_workers=1)
+
+    def task(progress, count):
+        progress(count, count, 'xong')
+        return {'count': count}
+
+    job = wait_for(manager, manager.submit('test', task, 3).id)
+
+    assert job['result'] == {'count': 3}
+    assert job['progress'] == {'done': 3, 'total': 3}
+    # Process khác đọc được trạng thái từ file
+    assert JobManager(str(tmp_path)).get(job['job_id'])['status'] == STATUS_DONE
+
+
+def test_job_error_is_reported(tmp_path):
+    manager = JobManager(str(tmp_path), max_workers=1)
+
+    def task(progress):
+        raise JobError('Không tìm thấy ảnh')
+
+    job = wait_for(manager, manager.submit('test', task).id)
+
+    assert job['status'] == STATUS_FAILED
+    assert job['error'] == 'Không tìm thấy ảnh'
+
+
+def test_unknown_or_invalid_job_id(tmp_path):
+    manager = JobManager(str(tmp_path))
+    assert manager.get('0' * 32) is None
+    assert manager.get('../etc/passwd') is None
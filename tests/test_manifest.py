@@ -0,0 +1,55 @@
+import json
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('PIL')
+
+from service.image_downloader import ImageDownloader
+
+URL = 'https://example.com/chapter-1'
+
+
+def write_manifest(output_dir, target_format, profile=None):
+    (output_dir / 'image_001.webp').write_bytes(b'x' * 10)
+    info = {'source_url': URL, 'target_format': target_format, 'profile': profile,
+            'images': [{'url': 'https://example.com/1.jpg', 'file': 'image_001.webp', 'size': 10}]}
+    (output_dir / 'info.json').write_text(json.dumps(info))
+
+
+def test_manifest_requires_same_target_format(tmp_path):
+    write_manifest(tmp_path, 'WEBP', 'quality')
+
+    assert ImageDownloader(resume=True, cache=False).load_manifest(str(tmp_path), URL) == {}
+    assert ImageDownloader(transcode='JPEG', resume=True, cache=False).load_manifest(str(tmp_path), URL) == {}
+    assert ImageDownloader(transcode='WEBP', profile='small', resume=True,
+                           cache=False).load_manifest(str(tmp_path), URL) == {}
+
+    complete = ImageDownloader(transcode='WEBP', profile='quality', resume=True,
+                               cache=False).load_manifest(str(tmp_path), URL)
+    assert list(complete) == ['https://example.com/1.jpg']
+
+
+def test_chapter_dir_depends_on_format():
+    pytest.importorskip('flask')
+    from service.dowloadImg import chapter_dir
+
+    original = chapter_dir('/tmp', URL)
+    assert chapter_dir('/tmp', URL, None, 'quality') == original
+    assert chapter_dir('/tmp', URL, 'WEBP', 'quality') != original
+    assert chapter_dir('/tmp', URL, 'WEBP', 'quality') != chapter_dir('/tmp', URL, 'WEBP', 'small')
+
+
+def test_chapter_lock_excludes_other_processes(tmp_path):
+    pytest.importorskip('flask')
+    fcntl = pytest.importorskip('fcntl')
+    from service.dowloadImg import get_chapter_lock
+
+    with get_chapter_lock(str(tmp_path)):
+        # Process khác (file descriptor khác) không lấy được khóa
+        with open(tmp_path / '.lock', 'a') as other:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    with open(tmp_path / '.lock', 'a') as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
@@ -0,0 +1,25 @@
+from service.ocr_cache import OcrCache, make_key
+
+
+def test_make_key_is_stable():
+    assert make_key('ocr', 'abc', {'b': 1, 'a': 2}) == make_key('ocr', 'abc', {'a': 2, 'b': 1})
+    assert make_key('ocr', 'abc') != make_key('translate', 'abc')
+
+
+def test_lru_eviction(tmp_path):
+    cache = OcrCache(str(tmp_path), max_bytes=25)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'y' * 10)
+    assert cache.get('a') == 'x' * 10  # a vừa được dùng, b cũ nhất
+
+    cache.put('c', 'z' * 10)
+
+    assert cache.get('a') == 'x' * 10
+    assert cache.get('b') is None
+    assert cache.get('c') == 'z' * 10
+
+
+def test_empty_values_are_not_stored(tmp_path):
+    cache = OcrCache(str(tmp_path))
+    cache.put('a', '')
+    assert cache.get('a') is None
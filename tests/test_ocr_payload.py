@@ -0,0 +1,49 @@
+import io
+import pytest
+
+pytest.importorskip('PIL')
+
+from PIL import Image, ImageDraw
+from service.encoder_profiles import encode_image
+from service.ocr_payload import MAX_PIXELS, WEBP_MAX_DIMENSION, _formats, encode_payload
+
+
+def strip(width, height):
+    img = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 400):
+        draw.text((20, y + 20), 'speech bubble ' * 5, fill=0)
+    return img
+
+
+def test_tall_webtoon_strip_is_encoded_within_limits():
+    data, mime_type, info = encode_payload(strip(800, 20000))
+
+    assert info['height'] <= WEBP_MAX_DIMENSION
+    assert info['width'] * info['height'] <= MAX_PIXELS * 1.01
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.size == (info['width'], info['height'])
+        assert decoded.format == info['format']
+
+
+def test_webp_is_skipped_past_its_dimension_limit():
+    formats = [fmt for fmt, mime_type in _formats(Image.new('L', (10, WEBP_MAX_DIMENSION + 1)))]
+    assert formats == ['JPEG']
+    assert 'WEBP' in [fmt for fmt, mime_type in _formats(Image.new('L', (10, 10)))]
+
+
+def test_small_page_is_sent_at_full_size():
+    data, mime_type, info = encode_payload(Image.new('RGB', (600, 900), 'white'))
+
+    assert (info['width'], info['height']) == (600, 900)
+    assert mime_type == f"image/{info['format'].lower()}"
+    assert info['bytes'] == len(data)
+
+
+def test_quality_search_stops_at_min_quality():
+    img = Image.effect_noise((256, 256), 64)
+
+    data, quality = encode_image(img, 'JPEG', 'balanced', 1000, min_quality=60)
+
+    assert quality == 60
+    assert len(data) > 1000
@@ -0,0 +1,61 @@
+import hashlib
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('PIL')
+
+from service.image_downloader.partial import PartialFile
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+
+def test_resume_with_range(tmp_path):
+    save_path = str(tmp_path / 'image_001')
+    first = PartialFile(save_path, resume=True)
+    assert first.request_headers() == {}
+    assert first.begin(200)
+    assert first.write(PNG[:4000])
+    first.close()  # Mất kết nối giữa chừng, giữ lại file .part
+
+    second = PartialFile(save_path, resume=True)
+    assert second.request_headers() == {'Range': 'bytes=4000-'}
+    assert second.begin(206, f'bytes 4000-{len(PNG) - 1}/{len(PNG)}')
+    assert second.write(PNG[4000:])
+    assert second.finish() == 'PNG'
+    path, info = second.commit()
+
+    assert path.endswith('.png')
+    assert open(path, 'rb').read() == PNG
+    assert info == {'format': 'PNG', 'size': len(PNG), 'sha256': hashlib.sha256(PNG).hexdigest()}
+
+
+def test_mismatched_range_is_rejected(tmp_path):
+    save_path = str(tmp_path / 'image_001')
+    first = PartialFile(save_path, resume=True)
+    first.begin(200)
+    first.write(PNG[:4000])
+    first.close()
+
+    second = PartialFile(save_path, resume=True)
+    assert not second.begin(206, 'bytes 0-99/100')
+
+
+def test_server_ignoring_range_restarts_download(tmp_path):
+    save_path = str(tmp_path / 'image_001')
+    (tmp_path / 'image_001.part').write_bytes(PNG[:4000])
+
+    partial = PartialFile(save_path, resume=True)
+    assert partial.begin(200)
+    partial.write(PNG)
+    partial.finish()
+    path, info = partial.commit()
+
+    assert open(path, 'rb').read() == PNG
+    assert info['size'] == len(PNG)
+
+
+def test_non_image_is_rejected(tmp_path):
+    partial = PartialFile(str(tmp_path / 'image_001'))
+    partial.begin(200)
+    assert not partial.write(b'<html>' + b' ' * 100)
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from service.ratelimit import AimdLimiter, HostPolicy, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=2, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0.4 < bucket.reserve() <= 0.5
+
+
+def test_aimd_increases_slowly_and_halves_on_congestion():
+    limiter = AimdLimiter(initial=4, maximum=8, cooldown=0)
+    for _ in range(8):
+        limiter.on_success(0.1)
+    assert limiter.limit == 5
+
+    limiter.on_congestion()
+    assert limiter.limit == 2
+
+    # Độ trễ tăng vọt cũng được coi là quá tải
+    limiter.on_success(1.0)
+    assert limiter.limit == 1
+
+
+def test_host_policy_respects_retry_after():
+    policy = HostPolicy(rate=100, max_concurrency=4)
+
+    policy.on_throttled(retry_after=5)
+
+    assert policy.reserve() > 4
+    assert policy.bucket.rate == 50
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470) == 10
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_aimd_reference_latency_decays_towards_current():
+    limiter = AimdLimiter(initial=2, maximum=8, cooldown=0)
+    limiter.on_success(0.01)
+    for _ in range(30):
+        limiter.on_success(0.1)
+
+    # Sau một mẫu nhanh bất thường, độ trễ bình thường không còn bị coi là quá tải
+    value = limiter.value
+    limiter.on_success(0.1)
+    assert limiter.value > value
+    assert limiter.best_latency > 0.05
+
+
+def test_host_policy_slot_limits_concurrent_requests():
+    policy = HostPolicy(rate=1000)
+    policy.concurrency = AimdLimiter(initial=2, maximum=2)
+    state = {'active': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def request():
+        with policy.slot():
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.02)
+            with lock:
+                state['active'] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert state['peak'] == 2
+    assert policy.active == 0
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('PIL')
+
+from service.image_downloader.sources import SourceConfig
+
+
+@pytest.fixture
+def config():
+    return SourceConfig()
+
+
+@pytest.mark.parametrize('url, name', [
+    ('https://manga.bilibili.com/mc123/456', 'bilibili'),
+    ('https://i0.hdslb.com/bfs/manga/1.jpg', 'bilibili'),
+    ('https://comic.naver.com/webtoon/detail?no=1', 'webtoon'),
+    ('https://image-comic.pstatic.net/webtoon/1/1.jpg', 'webtoon'),
+    ('https://www.webtoons.com/en/title/1', 'webtoons'),
+    ('https://webtoon-phinf.pstatic.net/1/1.jpg', 'webtoons'),
+    ('https://nettruyen.com:443/truyen/1', 'nettruyen'),
+])
+def test_exact_and_parent_host(config, url, name):
+    assert config.get_source(url).name == name
+    assert config.get_source(url, fallback=False).name == name
+
+
+def test_unrelated_manga_site_is_not_bilibili(config):
+    assert config.get_source('https://twmanga.com/comic/1/2') is None
+    assert config.get_source('https://mangadex.org/chapter/1') is None
+
+
+def test_mirror_matches_by_name_only_with_fallback(config):
+    assert config.get_source('https://nettruyenvio.com/truyen/1').name == 'nettruyen'
+    assert config.get_source('https://nettruyenvio.com/truyen/1', fallback=False) is None
+    # Host đã khớp theo tên không được coi là host chính xác ở lần sau
+    assert config.get_source('nettruyenvio.com', fallback=False) is None
+
+
+def test_headers_use_source_referer(config):
+    headers = config.get_headers('https://manga.bilibili.com/mc1/2')
+    assert headers['Referer'] == 'https://manga.bilibili.com/'
+    assert headers['Host'] == 'manga.bilibili.com'
+
+
+def test_webtoons_has_its_own_referer(config):
+    headers = config.get_headers('https://webtoon-phinf.pstatic.net/1/1.jpg')
+    assert headers['Referer'] == 'https://www.webtoons.com/'
+    assert config.get_headers('https://comic.naver.com/webtoon/detail')['Referer'] == 'https://comic.naver.com/'
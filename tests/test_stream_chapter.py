@@ -0,0 +1,73 @@
+import io
+import os
+import threading
+import zipfile
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+Image = pytest.importorskip('PIL.Image')
+
+from service import dowloadImg
+from service.workspace import WORKSPACE_PREFIX
+
+
+class FakeDownloader:
+    """Thay cho ImageDownloader: ghi ảnh PNG vào thư mục tải, có thể chờ tới khi bị hủy"""
+
+    def __init__(self, count, block=False):
+        self.count = count
+        self.block = block
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def download_images_parallel(self, image_urls, temp_dir, on_image=None):
+        try:
+            for index in range(1, self.count + 1):
+                path = os.path.join(temp_dir, f'image_{index:03d}.png')
+                Image.new('RGB', (8, 8), 'red').save(path)
+                on_image({'index': index, 'path': path, 'url': image_urls[index - 1],
+                          'format': 'PNG', 'size': os.path.getsize(path)})
+            if self.block:
+                self.cancelled.wait(5)
+            return [], [], []
+        finally:
+            self.finished.set()
+
+
+def workspaces(root):
+    return [entry for entry in os.listdir(root) if entry.startswith(WORKSPACE_PREFIX)]
+
+
+def test_stream_chapter_transcodes_and_writes_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(dowloadImg, 'get_process_pool', lambda: None)
+    urls = ['https://example.com/1.png', 'https://example.com/2.png']
+
+    data = b''.join(dowloadImg.stream_chapter(str(tmp_path), FakeDownloader(2), 'https://example.com/c1',
+                                              urls, 'JPEG', 'balanced'))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert sorted(archive.namelist()) == ['image_001.jpg', 'image_002.jpg', 'info.json']
+    assert workspaces(tmp_path) == []
+
+
+def test_stream_chapter_starts_lazily_and_cancels_on_close(tmp_path):
+    downloader = FakeDownloader(1, block=True)
+    stream = dowloadImg.stream_chapter(str(tmp_path), downloader, 'https://example.com/c1',
+                                       ['https://example.com/1.png'])
+    assert workspaces(tmp_path) == []
+
+    next(stream)
+    stream.close()
+
+    assert downloader.cancelled.is_set()
+    assert downloader.finished.wait(5)
+    for _ in range(50):
+        if not workspaces(tmp_path):
+            break
+        threading.Event().wait(0.02)
+    assert workspaces(tmp_path) == []
@@ -0,0 +1,35 @@
+import io
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('PIL')
+
+from werkzeug.datastructures import FileStorage
+from service.uploads import UploadSpool, ingest_uploads
+
+
+def spool(data, max_size):
+    stream = UploadSpool(max_size=max_size, mode='rb+')
+    stream.write(data)
+    stream.seek(0)
+    return stream
+
+
+def test_in_memory_upload_is_used_without_spilling(tmp_path):
+    uploads = ingest_uploads([FileStorage(spool(b'abc', 1024), filename='page.png')], str(tmp_path / 'spill'))
+
+    assert uploads[0].name == 'page.png'
+    assert bytes(uploads[0].data) == b'abc'
+    assert not (tmp_path / 'spill').exists()
+
+
+def test_spilled_uploads_with_same_name_do_not_collide(tmp_path):
+    files = [FileStorage(spool(b'a' * 64, 16), filename='../page.png'),
+             FileStorage(io.BytesIO(b'b' * 64), filename='page.png')]
+
+    uploads = ingest_uploads(files, str(tmp_path), threshold=16)
+
+    assert [upload.name for upload in uploads] == ['page.png', 'page.png']
+    assert uploads[0].path != uploads[1].path
+    assert open(uploads[0].path, 'rb').read() == b'a' * 64
+    assert open(uploads[1].path, 'rb').read() == b'b' * 64
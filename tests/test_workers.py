@@ -0,0 +1,37 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from service import workers
+
+
+def square(x):
+    return x * x
+
+
+def test_stream_to_pool_keeps_order():
+    assert workers.stream_to_pool(square, ((i,) for i in range(20)), max_workers=2) == [i * i for i in range(20)]
+    assert workers.stream_to_pool(square, ((i,) for i in range(5)), max_workers=1) == [0, 1, 4, 9, 16]
+
+
+def test_stream_to_pool_bounds_pending_tasks(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(workers, 'get_process_pool', lambda: pool)
+    lock = threading.Lock()
+    state = {'produced': 0, 'done': 0, 'ahead': 0}
+
+    def work(x):
+        with lock:
+            state['done'] += 1
+        return x
+
+    def tasks():
+        for i in range(50):
+            with lock:
+                state['ahead'] = max(state['ahead'], state['produced'] - state['done'])
+                state['produced'] += 1
+            yield (i,)
+
+    try:
+        assert workers.stream_to_pool(work, tasks(), max_pending=3) == list(range(50))
+    finally:
+        pool.shutdown()
+    assert state['ahead'] <= 3
@@ -0,0 +1,32 @@
+import os
+from service.workspace import Workspace, load_published
+
+
+def test_publish_and_load(tmp_path):
+    workspace = Workspace(str(tmp_path), 'test')
+    result = tmp_path / 'a.txt'
+    result.write_text('a')
+
+    name = workspace.publish('result.zip', entries=[('a.txt', str(result))])
+
+    assert load_published(str(tmp_path), name) == [('a.txt', str(result))]
+    assert load_published(str(tmp_path), '../' + name) is None
+
+
+def test_snapshot_survives_shared_directory_changes(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    (shared / 'image_001.jpg').write_bytes(b'jpeg')
+    (shared / 'info.json').write_text('{"v": 1}')
+    workspace = Workspace(str(tmp_path), 'test')
+
+    entries = dict(workspace.snapshot('images', str(shared), ['image_001.jpg', 'info.json'], copy=('info.json',)))
+
+    # Request sau chuyển định dạng (xóa ảnh gốc) và ghi đè info.json tại chỗ
+    os.remove(shared / 'image_001.jpg')
+    with open(shared / 'info.json', 'w') as f:
+        f.write('{"v": 2}')
+
+    assert open(entries['image_001.jpg'], 'rb').read() == b'jpeg'
+    assert open(entries['info.json']).read() == '{"v": 1}'
+    assert all(path.startswith(workspace.path) for path in entries.values())